@@ -1,10 +1,150 @@
+from struct import iter_unpack
+
+# Standard generator polynomials (with leading 1). Only the polynomial is used: no reflection, 
+# no initial value and no final XOR like the rest of this simulator.
+PRESETS = {
+    'CRC-8': 0x107,  # x^8+x^2+x+1 (CRC-8-CCITT)
+    'CRC-16': 0x18005,  # x^16+x^15+x^2+1 (CRC-16-IBM)
+    'CRC-16-CCITT': 0x11021,  # x^16+x^12+x^5+1
+    'CRC-32': 0x104C11DB7,  # IEEE 802.3
+}
+
+# Table-driven modes: bytes processed per step. `auto`: `table` for short divisors (fewer big int 
+# operations per byte in Python), `slice8` for CRC-16 and wider.
+MODES = {'bitwise': 0, 'table': 1, 'slice4': 4, 'slice8': 8}
+_CHUNK_FORMAT = {1: '>B', 4: '>I', 8: '>Q'}
+
+_TABLES = {}  # (divisor, n_slices) -> lookup tables. Built once per polynomial.
+_SYNDROMES = {}  # divisor -> single bit error syndromes (see `syndrome_table`)
+_NP_TABLES = {}  # divisor -> `crc_tables(divisor, 1)[0]` as NumPy array (batch mode)
+BATCH_BLOCK = 8192  # frames per block of batch mode
+
+
+def crc_tables(divisor:int, n_slices:int):
+    """Build (or fetch from cache) lookup tables of `divisor` for slicing-by-`n_slices`.
+        `tables[j][b]` is remainder of `b * x^(8j+r)` (r: degree of `divisor`)."""
+    key = (divisor, n_slices)
+    if key in _TABLES:
+        return _TABLES[key]
+    r = divisor.bit_length()-1
+    top = 1<<r
+    mask = top-1
+    tables = []
+    row = [0]*256
+    for b in range(256):  # tables[0]: remainder of b*x^r, bit by bit
+        rem = 0
+        for i in range(7, -1, -1):
+            rem = (rem<<1) ^ (((b>>i) & 1)<<r)
+            if rem & top:
+                rem ^= divisor
+        row[b] = rem & mask
+    tables.append(row)
+    for j in range(1, n_slices):  # tables[j][b] = tables[j-1][b] * x^8
+        prev = tables[-1]
+        row = [0]*256
+        for b in range(256):
+            rem = prev[b]
+            for i in range(8):
+                rem <<= 1
+                if rem & top:
+                    rem ^= divisor
+            row[b] = rem
+        tables.append(row)
+    _TABLES[key] = tables
+    return tables
+
+
+def syndrome_table(divisor:int, n_bits:int):
+    """Syndromes of single bit errors: `table[i]` is remainder of `x^i` by `divisor` for `i < n_bits`.
+        CRC is linear, so remainder of a received frame is XOR of syndromes of its error bits 
+        (frame is detected as invalid iff that XOR is not 0). Tables are cached and extended on demand."""
+    table = _SYNDROMES.setdefault(divisor, [])
+    top = 1<<(divisor.bit_length()-1)
+    rem = table[-1]<<1 if table else 1  # x^i before reduction
+    while len(table) < n_bits:
+        if rem & top:
+            rem ^= divisor
+        table.append(rem)
+        rem <<= 1
+    return table[:n_bits]
+
+
+def pack_frames(frames, n_bytes=None):
+    """Pack integer frames into a NumPy uint8 array for batch mode: one row per frame with big-endian bytes
+        of frame (`frame.to_bytes(n_bytes, 'big')`), so frames of any length are right-aligned in rows.
+        `n_bytes`: row width (default: bytes of longest frame)."""
+    import numpy as np
+    if n_bytes is None:
+        n_bytes = max((frame.bit_length() for frame in frames), default=0)+7 >> 3
+    buffer = b''.join(frame.to_bytes(n_bytes, 'big') for frame in frames)
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(len(frames), n_bytes)
+
+
+def unpack_frames(frames) -> list:
+    """Integer frames of rows of a packed array (see `pack_frames`)."""
+    return [int.from_bytes(row, 'big') for row in as_packed(frames)]
+
+
+def as_packed(frames):
+    """View frames of batch mode as uint8 rows. `frames`: uint8 array (rows of `pack_frames`), or uint64
+        array with one row of big-endian words per frame (most significant word first), or 1d uint64 array
+        (one word per frame)."""
+    import numpy as np
+    frames = np.asarray(frames)
+    if frames.dtype == np.uint64:
+        if frames.ndim == 1:
+            frames = frames[:, None]
+        return frames.astype('>u8').view(np.uint8).reshape(len(frames), -1)
+    assert frames.dtype == np.uint8 and frames.ndim == 2, f'unknown packed frames: {frames.dtype} {frames.shape}'
+    return frames
+
+
+def shift_rows(frames, shift:int, n_bytes:int):
+    """Shift packed frames by `shift` bits (left if positive, right if negative). Return rows of `n_bytes`."""
+    import numpy as np
+    bits = np.unpackbits(frames, axis=1)
+    n = len(frames)
+    if shift > 0:
+        bits = np.concatenate((bits, np.zeros((n, shift), dtype=np.uint8)), axis=1)
+    elif shift < 0:
+        bits = bits[:, :shift]
+    n_bits = 8*n_bytes
+    if bits.shape[1] < n_bits:
+        bits = np.concatenate((np.zeros((n, n_bits-bits.shape[1]), dtype=np.uint8), bits), axis=1)
+    return np.packbits(bits[:, bits.shape[1]-n_bits:], axis=1)
+
+
 class CRC:
     """Compute CRC of given `data` due to `divisor` polynomial."""
-    def __init__(self, divisor:int) -> None:
+    def __init__(self, divisor:int, mode='auto') -> None:
         """get divisor polynomial.
-            `divisor`: [int] irreducable divisor polynomial"""
+            `divisor`: [int] irreducable divisor polynomial
+            `mode`: remainder algorithm. `bitwise`: bit by bit long division, `table`: byte-wise lookup table,
+                `slice4`, `slice8`: slicing-by-4/8 lookup tables, `auto`: choose a table mode. All modes are bit-exact."""
         self.divisor = divisor
         self.divisor_len = divisor.bit_length()-1
+        if mode == 'auto':
+            mode = 'table' if self.divisor_len < 16 else 'slice8'
+        assert mode in MODES, f'unknown CRC mode: {mode}'
+        self.mode = mode
+        self.n_slices = MODES[mode]
+        self.tables = crc_tables(divisor, self.n_slices) if self.n_slices else None
+
+    def __getstate__(self):
+        """Pickle without lookup tables (snapshots stay small), they are rebuilt from cache on load."""
+        state = self.__dict__.copy()
+        state['tables'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.n_slices:
+            self.tables = crc_tables(self.divisor, self.n_slices)
+
+    @classmethod
+    def preset(cls, name:str, mode='auto'):
+        """Create CRC of a standard polynomial e.g. `CRC.preset('CRC-32')`. See `PRESETS`."""
+        return cls(PRESETS[name], mode)
 
     def encode(self, data, data_len):
         """get `data` and compute CRC encoded data.
@@ -20,8 +160,114 @@ class CRC:
             return (data>>self.divisor_len), data_len-self.divisor_len, True
         return 0, 0, False
 
+    def np_table(self):
+        """Byte lookup table of batch mode (NumPy uint32 for divisors up to degree 32, else uint64).
+            NumPy is imported only in batch mode."""
+        table = _NP_TABLES.get(self.divisor)
+        if table is None:
+            import numpy as np
+            assert self.divisor_len <= 64, "Batch mode supports divisors up to degree 64."
+            dtype = np.uint32 if self.divisor_len <= 32 else np.uint64
+            table = _NP_TABLES[self.divisor] = np.array(crc_tables(self.divisor, 1)[0], dtype=dtype)
+        return table
+
+    def remainders(self, frames, augment=False):
+        """Batch mode: remainders of many frames at once (NumPy uint64 array), bit-exact with `div_remainder`.
+            `frames`: packed frames (see `as_packed`). Frames are right-aligned, so leading zero bytes of
+                shorter frames do not change their remainder and all rows run in the same byte steps.
+            `augment`: remainder of `frame * x^r` (CRC of `encode`) instead of `frame`.
+            One vectorized table lookup per byte column, over blocks of `BATCH_BLOCK` frames (cache sized)."""
+        import numpy as np
+        frames = as_packed(frames)
+        out = np.empty(len(frames), dtype=np.uint64)
+        for start in range(0, len(frames), BATCH_BLOCK):
+            out[start:start+BATCH_BLOCK] = self.block_remainders(frames[start:start+BATCH_BLOCK], augment)
+        return out
+
+    def block_remainders(self, frames, augment):
+        """`remainders` of one block: state of all frames is updated in place, byte column by byte column."""
+        import numpy as np
+        table = self.np_table()
+        dtype = table.dtype.type
+        r = self.divisor_len
+        columns = np.ascontiguousarray(frames.T).astype(dtype)  # byte column j of all frames
+        state = np.zeros(len(frames), dtype=dtype)
+        index = np.empty_like(state)
+        low = np.empty_like(state)
+        if r >= 8:
+            shift, mask, eight = dtype(r-8), dtype((1<<(r-8))-1), dtype(8)
+            for column in columns:
+                np.right_shift(state, shift, out=index)
+                if augment:
+                    index ^= column
+                np.bitwise_and(state, mask, out=low)
+                low <<= eight
+                np.take(table, index, out=state)
+                state ^= low
+                if not augment:  # state*x^8 + byte
+                    state ^= column
+        else:
+            shift, r_, mask = dtype(8-r), dtype(r), dtype((1<<r)-1)
+            for column in columns:
+                np.left_shift(state, shift, out=index)
+                if augment:
+                    index ^= column
+                    np.take(table, index, out=state)
+                else:  # high bits of byte are reduced, low `r` bits are added
+                    index ^= column>>r_
+                    np.take(table, index, out=state)
+                    state ^= column & mask
+        return state
+
+    def encode_many(self, frames, data_lens):
+        """Batch `encode`: return `(encoded frames, encoded lengths)`. Encoded frames are uint8 rows
+            (see `pack_frames`) wide enough for the longest frame. `data_lens`: int or array of frame lengths."""
+        import numpy as np
+        frames = as_packed(frames)
+        r = self.divisor_len
+        data_lens = np.broadcast_to(np.asarray(data_lens, dtype=np.int64), (len(frames),))
+        rem = self.remainders(frames, augment=True)
+        max_len = int(data_lens.max()) if len(frames) else 0
+        n_bytes = max(max_len+r+7 >> 3, 1)
+        if r % 8 == 0:  # append remainder bytes
+            enc = np.zeros((len(frames), n_bytes), dtype=np.uint8)
+            width = min(frames.shape[1], n_bytes-r//8)
+            enc[:, n_bytes-r//8-width:n_bytes-r//8] = frames[:, frames.shape[1]-width:]
+        else:
+            enc = shift_rows(frames, r, n_bytes)
+        rem_bytes = rem.astype('>u8').view(np.uint8).reshape(len(frames), 8)
+        n_rem = min(r+7 >> 3, n_bytes)
+        enc[:, n_bytes-n_rem:] |= rem_bytes[:, 8-n_rem:]
+        return enc, data_lens+r
+
+    def decode_many(self, frames, data_lens):
+        """Batch `decode`: return `(data, lengths, valid)`. Like `decode`, data and length of invalid frames
+            are 0. `data`: uint8 rows (see `pack_frames`), `valid`: bool array."""
+        import numpy as np
+        frames = as_packed(frames)
+        r = self.divisor_len
+        data_lens = np.broadcast_to(np.asarray(data_lens, dtype=np.int64), (len(frames),))
+        valid = self.remainders(frames) == 0
+        max_len = int(data_lens.max()) if len(frames) else 0
+        n_bytes = max(max_len-r+7 >> 3, 1)
+        if r % 8 == 0:  # drop remainder bytes
+            data = np.zeros((len(frames), n_bytes), dtype=np.uint8)
+            width = min(frames.shape[1]-r//8, n_bytes)
+            if width > 0:
+                data[:, n_bytes-width:] = frames[:, frames.shape[1]-r//8-width:frames.shape[1]-r//8]
+        else:
+            data = shift_rows(frames, -r, n_bytes)
+        data[~valid] = 0
+        return data, np.where(valid, data_lens-r, 0), valid
+
     def div_remainder(self, num, num_len):
         """divide `num` by `divisor` in modulo 2"""
+        if self.tables is None:
+            return self.bitwise_remainder(num, num_len)
+        return self.table_remainder(num, num_len)
+
+    def bitwise_remainder(self, num, num_len):
+        """divide `num` by `divisor` in modulo 2, bit by bit."""
         shift_ind = num_len-self.divisor_len
         denum = self.divisor<<(shift_ind-1)  # align divisor to data MSB 1
         indicator = 1<<(num_len-1)
@@ -37,6 +283,61 @@ class CRC:
         remainder = num >>(shift_ind)
         return remainder
 
+    def table_remainder(self, num, num_len):
+        """divide `num` by `divisor` in modulo 2, `n_slices` bytes per step.
+            `num` = `head`*x^r + `tail` => remainder = (`head`*x^r mod divisor) + `tail`. 
+            Bits of `num` above `num_len` are kept in place, like `bitwise_remainder`."""
+        r = self.divisor_len
+        high = num>>num_len  # out of frame bits
+        num &= (1<<num_len)-1
+        head, tail = num>>r, num & ((1<<r)-1)
+        n_slices = self.n_slices
+        step = 8*n_slices
+        n_bytes = -(-(num_len-r)//step)*n_slices  # pad head to whole steps (leading zeros does not change CRC)
+        if n_bytes <= 0:
+            return (high<<num_len) | tail
+        tables = self.tables
+        state = 0
+        if n_slices == 1:
+            table = tables[0]
+            if r >= 8:
+                shift, mask = r-8, (1<<(r-8))-1
+                for byte in head.to_bytes(n_bytes, 'big'):
+                    state = table[(state>>shift) ^ byte] ^ ((state & mask)<<8)
+            else:
+                shift = 8-r
+                for byte in head.to_bytes(n_bytes, 'big'):
+                    state = table[(state<<shift) ^ byte]
+        else:
+            chunks = iter_unpack(_CHUNK_FORMAT[n_slices], head.to_bytes(n_bytes, 'big'))
+            if n_slices == 4:
+                t0, t1, t2, t3 = tables
+                if r >= 32:
+                    shift, mask = r-32, (1<<(r-32))-1
+                    for (chunk,) in chunks:
+                        v = (state>>shift) ^ chunk
+                        state = ((state & mask)<<32) ^ t0[v & 0xFF] ^ t1[(v>>8) & 0xFF] ^ t2[(v>>16) & 0xFF] ^ t3[v>>24]
+                else:
+                    shift = 32-r
+                    for (chunk,) in chunks:
+                        v = (state<<shift) ^ chunk
+                        state = t0[v & 0xFF] ^ t1[(v>>8) & 0xFF] ^ t2[(v>>16) & 0xFF] ^ t3[v>>24]
+            else:
+                t0, t1, t2, t3, t4, t5, t6, t7 = tables
+                if r >= 64:
+                    shift, mask = r-64, (1<<(r-64))-1
+                    for (chunk,) in chunks:
+                        v = (state>>shift) ^ chunk
+                        state = (((state & mask)<<64) ^ t0[v & 0xFF] ^ t1[(v>>8) & 0xFF] ^ t2[(v>>16) & 0xFF] ^ t3[(v>>24) & 0xFF] ^
+                                 t4[(v>>32) & 0xFF] ^ t5[(v>>40) & 0xFF] ^ t6[(v>>48) & 0xFF] ^ t7[v>>56])
+                else:
+                    shift = 64-r
+                    for (chunk,) in chunks:
+                        v = (state<<shift) ^ chunk
+                        state = (t0[v & 0xFF] ^ t1[(v>>8) & 0xFF] ^ t2[(v>>16) & 0xFF] ^ t3[(v>>24) & 0xFF] ^
+                                 t4[(v>>32) & 0xFF] ^ t5[(v>>40) & 0xFF] ^ t6[(v>>48) & 0xFF] ^ t7[v>>56])
+        return (high<<num_len) | state ^ tail
+
 
 if __name__ == '__main__':
     divisor = 0xB
@@ -53,9 +354,5 @@ if __name__ == '__main__':
     print(f'decoded data: {bin(dec_data)}')
     print(dec_data == data)
 
-    # import time
-    # t_start = time.time()
-    # for i in range(10**5):
-        # enc_data, enc_data_size = crc.encode(data, data_len)
-    # t_end = time.time()
-    # print(f'time is :{t_end - t_start} s.')
\ No newline at end of file
+
+    # Benchmarks of encode/decode: `python benchmark.py crc`
\ No newline at end of file
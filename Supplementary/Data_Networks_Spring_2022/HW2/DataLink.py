@@ -1,4 +1,5 @@
-from Layers import Node
+from Layers import Node, Frame, SAP_data, DL_START, DL_TIMEOUT
+from simulator import EVENT_TYPES
 
 from collections import deque
 
@@ -17,6 +18,7 @@ class DataLink:
         # Set header for ACK, NAK
         self.ACK_header = 0xAA
         self.NAK_header = 0x55
+        self.start_pending = False  # a `DL start` event is waiting (see `schedule_start`)
     
     def assign_Node(self, Node:Node):
         """Assign this PHY to `Node` that contains this PHY."""
@@ -31,14 +33,51 @@ class DataLink:
         self.full_fil_buffer()  # Ensure buffer is full.
         pass  # Based on your algorithm: OVERRIDE THIS FUNCTION IN CHILDREN
         # For example: Not True
-        self.Node.add_event((1, 'DL timeout', 3))  # set new timer
+        self.start_timer(3, self.spare_time)  # set new timer for seq_nr=3
 
     def full_fil_buffer(self):
-        """Fullfil transmitting buffer."""
-        fullfil_req = {'SDU': 'push'}
+        """Fullfil transmitting buffer. Stops early if L3 has no packet (e.g. empty router queue)."""
+        fullfil_req = SAP_data(None, 'push')
         while len(self.buffer_packet) < self.N_buffer:
+            n_packets = len(self.buffer_packet)
             self.Node.from_L2_to_L3(fullfil_req)
+            if len(self.buffer_packet) == n_packets:  # L3 has no packet
+                break
     
+    def fetch_packet(self):
+        """Pop oldest packet of buffer. If buffer is empty, first request a new packet from L3.
+            Return `None` if L3 has no packet."""
+        if not self.buffer_packet:
+            self.Node.from_L2_to_L3(SAP_data(None, 'push'))
+            if not self.buffer_packet:
+                return None
+        return self.buffer_packet.pop()
+
+    def schedule_start(self, IDU=None):
+        """Add a `DL start` event for when L1 is free again (`spare_time`). At most one such event is pending;
+            `start_transmit` of children must clear `start_pending`."""
+        if self.start_pending:
+            return
+        self.start_pending = True
+        self.Node.add_event((max(self.Node.get_sim_time(), self.spare_time), DL_START, IDU))
+
+    def channel_freed(self, t_free):
+        """Transmission of this DL was aborted (`Channel.cancel`): L1 is free from `t_free`, not from the end
+            of aborted frame."""
+        if self.spare_time > t_free:
+            self.spare_time = t_free
+
+    def cancel_transmit(self, handle=None) -> bool:
+        """Cancel transmission of a frame of this DL: `handle` is `Node.L1.last_handle` right after the frame is
+            passed to L1 (default: latest frame). If it is still being transmitted, L1 is free from now on
+            (`channel_freed`). Return `False` if frame has already been received or cancelled."""
+        return self.Node.L1.cancel(handle)
+
+    def wakeup(self):
+        """L3 has new packets (e.g. a router queued one): start transmitting if DL is waiting for packets.
+            Default: schedule a `DL start` (`start_transmit` of sliding windows checks window and L1)."""
+        self.schedule_start()
+
     def push_buffer(self, PDU):
         """Push new packet to buffer. L3 calls this function."""
         assert len(self.buffer_packet) < self.N_buffer, "L2 Buffer is full!"
@@ -50,14 +89,31 @@ class DataLink:
         self.buffer_packet.pop()
         self.buffer_seq_nr.rotate(1)
 
+    def start_timer(self, seq_nr:int, t_start=None):
+        """Start (or restart) `seq_nr` timer. It times out `self.timeout` after `t_start` (default: now)."""
+        if t_start is None:
+            t_start = self.Node.get_sim_time()
+        return self.Node.timers.start(seq_nr, t_start+self.timeout)
+    
+    restart_timer = start_timer
+    
+    def stop_timer(self, seq_nr:int) -> bool:
+        """Cancel `seq_nr` timer. Return `False` if it was not running."""
+        return self.Node.timers.cancel(seq_nr)
+    
+    def timer_running(self, seq_nr:int) -> bool:
+        """Return whether `seq_nr` timer is running."""
+        return self.Node.timers.is_running(seq_nr)
+
     def timeout_func(self, seq_nr:int):
         """`seq_nr` packet timer timed out!"""
         pass  # Based on your algorithm: OVERRIDE THIS FUNCTION IN CHILDREN
 
     def call_from_L3(self, IDU:dict):
         """L3 calls L2. We assume that this happens only for Tx and L3 can only push new packet."""
-        if IDU['SDU'] == None:
-            self.push_buffer(IDU['PDU'])
+        IDU = SAP_data.of(IDU)
+        if IDU.SDU == None:
+            self.push_buffer(IDU.PDU)
         else:
             raise ValueError(f"Unknown IDU for L2 {IDU}")
     
@@ -65,15 +121,19 @@ class DataLink:
         """PHY calls L2: receiving ACK, NAK or packets."""
         pass  # Based on your algorithm: OVERRIDE THIS FUNCTION IN CHILDREN
 
+    def event_handlers(self):
+        """Event handlers of DL. `Node` registers them when this DL is bound."""
+        return {DL_TIMEOUT: self.timeout_event, DL_START: self.start_transmit}
+
+    def timeout_event(self, seq_nr:int):
+        """`DL timeout` event: forget fired timer and run `timeout_func`."""
+        self.Node.timers.expire(seq_nr)
+        self.timeout_func(seq_nr)
+
     def event_run(self, event):
         """Run nearest event. In this case PHY receives packet from channel."""
-        # check for event type. Switch case!
-        if event[1] == 'DL timeout':
-            self.timeout_func(event[2])  # seq_nr
-        elif event[1] == 'DL start':
-            self.start_transmit(event[2])  # IDU
-        else:
-            raise ValueError(f"Unknown event for DL {event[1]}")
+        handler = EVENT_TYPES.handler(self.event_handlers(), event[1])
+        handler(event[2])
 
 
 ####################
@@ -84,44 +144,52 @@ class Stop_Wait_Tx(DataLink):
         self.N_buffer = 1
         self.next_frame_to_send = 0
         self.spare_time = 0
+        self.idle = True  # no frame in flight and no `DL start` pending (see `wakeup`)
     
     def start_transmit(self, *arg):
         """Fullfil Tx buffer from L3 + Start transmitting packet + Set timer."""
+        self.start_pending = False
         self.full_fil_buffer()  # Ensure buffer is full.
+        if not self.buffer_packet:  # L3 has no packet: wait for `wakeup`
+            self.idle = True
+            return
+        self.idle = False
         PDU = self.buffer_packet[-1]  # -1,0???????????????????????????????????????????????????????????????
-        # Add HEADER (tail)
-        PDU['frame_size'] += 1
-        PDU['frame'] = PDU['frame']<<1 | self.next_frame_to_send
-        IDU = {'PDU':PDU, 'SDU':None}
+        # Add HEADER (tail). Buffered PDU is not changed, so retransmissions get the same frame.
+        IDU = SAP_data(PDU.add_header(self.next_frame_to_send, 1))
         # Set transmitting event
         self.spare_time = self.Node.from_L2_to_L1(IDU)
         # Set timer event
-        event = (self.spare_time+self.timeout, 'DL timeout', self.next_frame_to_send)
-        self.Node.add_event(event)
+        self.start_timer(self.next_frame_to_send, self.spare_time)
 
 
     def call_from_L1(self, IDU):
         """Get ACK from Rx. Progress packet + Clear timer + Clear packet buffer + Set new transmit event"""
-        assert (IDU['PDU']['frame']>>1) == (self.ACK_header), f"Unknown Rx header (Not ACK): {bin(IDU['PDU']['frame'])}"
-        acked_frame = IDU['PDU']['frame'] & 0x1
+        IDU = SAP_data.of(IDU)
+        if (IDU.PDU.frame>>1) != self.ACK_header:  # Not ACK (undetected error): drop, timer retransmits
+            return
+        acked_frame = IDU.PDU.frame & 0x1
         if acked_frame == self.next_frame_to_send:
+            # Clear timer
+            self.stop_timer(self.next_frame_to_send)
             # Inc frame
             self.next_frame_to_send = 1 - self.next_frame_to_send
-            # Clear timer
-            eve_que= self.Node.ret_event_queue()
-            # ind = list(map(lambda el:el[0], filter(lambda el:el[1]=='DL timeout', enumerate(eve_que))))[0]
-            eve_que = list(filter(lambda el:el[1]!='DL timeout', eve_que))  # notch filter timeouts!
-            self.Node.set_event_queue(eve_que)  # set filterd queue!
             # Clear sending packet buffer to inject new packet from L3
             self.pop_buffer()
             # Add new transmit
-            event = (self.Node.get_sim_time(), 'DL start', None)
+            event = (self.Node.get_sim_time(), DL_START, None)
             self.Node.add_event(event)
     
+    def wakeup(self):
+        """L3 has new packets: start transmitting if DL is idle."""
+        if self.idle:
+            self.idle = False
+            self.schedule_start()
+
     def timeout_func(self, seq_nr: int):
         """Retransmit packet"""
         # Retransmit
-        event = (self.Node.get_sim_time(), 'DL start', None)
+        event = (self.Node.get_sim_time(), DL_START, None)
         self.Node.add_event(event)
 
 
@@ -137,63 +205,324 @@ class Stop_Wait_Rx(DataLink):
 
     def call_from_L1(self, IDU):
         """Check seq_nr of received frame + send ACK"""
-        seq_nr = IDU['PDU']['frame'] & 0x1
+        IDU = SAP_data.of(IDU)
+        seq_nr, PDU = IDU.PDU.remove_header(1)  # Extract frame
         if seq_nr == self.frame_expexcted:
-            IDU['PDU']['frame'] >>= 1; IDU['PDU']['frame_size'] -= 1  # Extract frame
-            self.Node.from_L2_to_L3(IDU)  # Pass to L3
+            self.Node.from_L2_to_L3(SAP_data(PDU))  # Pass to L3
             self.frame_expexcted = 1 - self.frame_expexcted  # Next state
-        IDU = {'PDU':{'frame':self.ACK_header<<1 | (1-self.frame_expexcted), 'frame_size':8+1}, 'SDU':None}  # ACK frame
-        event = (self.Node.get_sim_time(), 'DL start', IDU)
+        IDU = SAP_data(Frame(self.ACK_header<<1 | (1-self.frame_expexcted), 8+1))  # ACK frame
+        event = (self.Node.get_sim_time(), DL_START, IDU)
         self.Node.add_event(event)  # transmit ACK
 
 ####################
-# Go Back N
+# Sliding window protocols
+# Absolute sequence numbers (0, 1, 2, ...) are used inside DL and only `seq % seq_mod` is sent. 
+# Frames of window are kept in ring buffers: frame `seq` in `window[seq % N_window]`.
+# Data frame: payload + seq_nr (tail). ACK frame: ACK_header (8 bits) + seq_nr (tail).
+
 class Go_BackN_Tx(DataLink):
-    def __init__(self, timeout) -> None:
-        super().__init__(timeout)
+    """Go Back N sender. Cumulative ACKs (ACK carries next expected seq_nr), one timer per frame.
+        On timeout all outstanding frames are retransmitted."""
+    def __init__(self, timeout, N_window=7) -> None:
+        super().__init__(timeout, N_window=N_window)
+        self.seq_bits = N_window.bit_length()  # seq_mod >= N_window+1
+        self.seq_mod = 1<<self.seq_bits
+        self.window = [None]*N_window  # ring buffer of PDUs
+        self.base = 0  # oldest unACKed frame
+        self.next_seq = 0  # next frame to transmit
+        self.top = 0  # frames [base, top) are stored in window
     
-    def start_transmit(self, IDU: dict):
-        pass  # Override this
+    def start_transmit(self, *arg):
+        """Transmit next frame of window (new frame from L3 or a retransmission) + Set its timer."""
+        self.start_pending = False
+        if self.next_seq >= self.base+self.N_window:  # window is full
+            return
+        if self.spare_time > self.Node.get_sim_time():  # L1 is busy
+            return self.schedule_start()
+        seq = self.next_seq
+        if seq == self.top:  # new frame
+            PDU = self.fetch_packet()
+            if PDU is None:
+                return
+            self.window[seq % self.N_window] = PDU
+            self.top += 1
+        IDU = SAP_data(self.window[seq % self.N_window].add_header(seq % self.seq_mod, self.seq_bits))
+        self.spare_time = self.Node.from_L2_to_L1(IDU)
+        self.start_timer(seq, self.spare_time)
+        self.next_seq += 1
+        if self.next_seq < self.base+self.N_window:
+            self.schedule_start()
 
     def call_from_L1(self, IDU):
-        pass  # Override this
+        """Get cumulative ACK."""
+        IDU = SAP_data.of(IDU)
+        ack, PDU = IDU.PDU.remove_header(self.seq_bits)
+        if PDU.frame != self.ACK_header or PDU.frame_size != 8:  # Not ACK (undetected error): drop
+            return
+        self.process_ack(ack)
+
+    def process_ack(self, ack:int):
+        """Cumulative ACK `ack` (next expected seq_nr): slide window + Clear timers of ACKed frames.
+            O(1) per ACKed frame."""
+        n_acked = (ack-self.base) % self.seq_mod
+        if n_acked == 0 or n_acked > self.top-self.base:  # duplicate ACK
+            return
+        for seq in range(self.base, self.base+n_acked):
+            self.stop_timer(seq)
+            self.window[seq % self.N_window] = None
+        self.base += n_acked
+        if self.next_seq < self.base:  # ACKed frames that are waiting for retransmission
+            self.next_seq = self.base
+        self.schedule_start()
     
     def timeout_func(self, seq_nr: int):
-        pass  # Override this
+        """Go back N: retransmit all outstanding frames."""
+        if seq_nr < self.base:
+            return
+        for seq in range(self.base, self.next_seq):
+            self.stop_timer(seq)
+        self.next_seq = self.base
+        self.schedule_start()
 
 
 class Go_BackN_Rx(DataLink):
-    def __init__(self, timeout) -> None:
-        super().__init__(timeout)
+    """Go Back N receiver. Accepts only in order frames and sends cumulative ACKs."""
+    def __init__(self, timeout=0, N_window=7) -> None:
+        super().__init__(timeout, N_window=N_window)
+        self.seq_bits = N_window.bit_length()
+        self.seq_mod = 1<<self.seq_bits
+        self.frame_expected = 0
     
     def start_transmit(self, IDU: dict):
-        pass  # Override this
+        """Transmit ACK of latest state (ACKs that were waiting for L1 are merged)."""
+        self.start_pending = False
+        ACK = Frame(self.ACK_header<<self.seq_bits | (self.frame_expected % self.seq_mod), 8+self.seq_bits)
+        self.spare_time = self.Node.from_L2_to_L1(SAP_data(ACK))
+
+    def call_from_L1(self, IDU):
+        """Check seq_nr of received frame + send ACK"""
+        IDU = SAP_data.of(IDU)
+        seq_nr, PDU = IDU.PDU.remove_header(self.seq_bits)
+        if seq_nr == self.frame_expected % self.seq_mod:
+            self.Node.from_L2_to_L3(SAP_data(PDU))  # Pass to L3
+            self.frame_expected += 1
+        self.schedule_start()  # transmit ACK
+
+class Go_BackN_Duplex(Go_BackN_Tx):
+    """Go Back N in both directions of a `Duplex_link` (both Nodes run this DL). ACKs are piggybacked on data
+        frames of reverse direction: data frame = payload + seq_nr + ack (next expected seq_nr) + kind bit 1.
+        ACK frame (kind bit 0) = ACK_header + ack, only if no data frame can carry the ACK when it is due:
+        `ack_delay` after a frame is received (0: at next transmission opportunity of L1).
+        `N_window=1` is Stop and Wait (alternating bit) with piggybacking."""
+    ACK_TIMER = -1  # timer key of delayed ACK (seq_nr timers are >= 0)
+
+    def __init__(self, timeout, N_window=7, ack_delay=0.) -> None:
+        super().__init__(timeout, N_window)
+        self.ack_delay = ack_delay
+        self.frame_expected = 0
+        self.ack_pending = False  # received frames are not ACKed yet
+        self.ack_due = False  # ACK goes with next transmission (ACK frame if there is no data frame)
+        self.piggybacked = 0  # statistics: ACKs carried by data frames
+        self.ack_frames = 0  # statistics: ACK frames
+
+    def start_transmit(self, *arg):
+        """Transmit next frame of window (with ACK of received frames), else a due ACK frame."""
+        self.start_pending = False
+        if self.spare_time > self.Node.get_sim_time():  # L1 is busy
+            return self.schedule_start()
+        seq = self.next_seq
+        if seq >= self.base+self.N_window:  # window is full
+            seq = None
+        elif seq == self.top:  # new frame
+            PDU = self.fetch_packet()
+            if PDU is None:
+                seq = None
+            else:
+                self.window[seq % self.N_window] = PDU
+                self.top += 1
+        if seq is None:
+            if self.ack_due:
+                self.send_ack()
+            return
+        if self.ack_pending:
+            self.piggybacked += 1
+            self.clear_ack()
+        PDU = self.window[seq % self.N_window].add_header(seq % self.seq_mod, self.seq_bits)
+        PDU = PDU.add_header(self.frame_expected % self.seq_mod, self.seq_bits).add_header(1, 1)
+        self.spare_time = self.Node.from_L2_to_L1(SAP_data(PDU))
+        self.start_timer(seq, self.spare_time)
+        self.next_seq += 1
+        if self.next_seq < self.base+self.N_window:
+            self.schedule_start()
+
+    def send_ack(self):
+        """Transmit ACK frame of received frames."""
+        ACK = Frame(self.ACK_header<<self.seq_bits | (self.frame_expected % self.seq_mod), 8+self.seq_bits)
+        self.clear_ack()
+        self.ack_frames += 1
+        self.spare_time = self.Node.from_L2_to_L1(SAP_data(ACK.add_header(0, 1)))
+
+    def clear_ack(self):
+        self.ack_pending = self.ack_due = False
+        self.stop_timer(self.ACK_TIMER)
+
+    def request_ack(self):
+        """A frame was received: ACK it with next data frame, or with an ACK frame after `ack_delay`."""
+        self.ack_pending = True
+        if self.ack_delay <= 0:
+            self.ack_due = True
+            if not self.start_pending and self.spare_time <= self.Node.get_sim_time():  # L1 is free: no extra event
+                self.start_transmit()
+            else:
+                self.schedule_start()
+        elif not self.timer_running(self.ACK_TIMER):
+            self.Node.timers.start(self.ACK_TIMER, self.Node.get_sim_time()+self.ack_delay)
 
     def call_from_L1(self, IDU):
-        pass  # Override this
+        """Get data frame (piggybacked ACK + data) or ACK frame."""
+        IDU = SAP_data.of(IDU)
+        kind, PDU = IDU.PDU.remove_header(1)
+        ack, PDU = PDU.remove_header(self.seq_bits)
+        if not kind:  # ACK frame
+            if PDU.frame == self.ACK_header and PDU.frame_size == 8:  # else undetected error: drop
+                self.process_ack(ack)
+            return
+        self.process_ack(ack)
+        seq_nr, PDU = PDU.remove_header(self.seq_bits)
+        if seq_nr == self.frame_expected % self.seq_mod:
+            self.Node.from_L2_to_L3(SAP_data(PDU))  # Pass to L3
+            self.frame_expected += 1
+        self.request_ack()
+
+    def timeout_func(self, seq_nr: int):
+        """ACK timer: ACK is due. Frame timer: go back N."""
+        if seq_nr == self.ACK_TIMER:
+            self.ack_due = True
+            return self.schedule_start()
+        super().timeout_func(seq_nr)
 
 ####################
 # Selective Repeat
 class Selective_Repeat_Tx(DataLink):
-    def __init__(self, timeout) -> None:
-        super().__init__(timeout)
+    """Selective Repeat sender. Selective ACKs (ACK carries seq_nr of received frame), one timer per frame.
+        On timeout or NAK only that frame is retransmitted."""
+    def __init__(self, timeout, N_window=4) -> None:
+        super().__init__(timeout, N_window=N_window)
+        self.seq_bits = (2*N_window-1).bit_length()  # seq_mod >= 2*N_window
+        self.seq_mod = 1<<self.seq_bits
+        self.window = [None]*N_window  # ring buffer of PDUs
+        self.acked = [False]*N_window  # ring buffer of ACK status
+        self.base = 0  # oldest unACKed frame
+        self.next_seq = 0  # next new frame
+        self.retransmit_queue = deque()  # timed out (or NAKed) frames
+        self.retransmit_set = set()  # frames of `retransmit_queue`
     
-    def start_transmit(self, IDU: dict):
-        pass  # Override this
+    def schedule_start(self, IDU=None):
+        if self.retransmit_queue or self.next_seq < self.base+self.N_window:
+            super().schedule_start(IDU)
+    
+    def start_transmit(self, *arg):
+        """Transmit a timed out frame or a new frame from L3 + Set its timer."""
+        self.start_pending = False
+        if self.spare_time > self.Node.get_sim_time():  # L1 is busy
+            return self.schedule_start()
+        N = self.N_window
+        while self.retransmit_queue:
+            seq = self.retransmit_queue.popleft()
+            self.retransmit_set.discard(seq)
+            if seq >= self.base and not self.acked[seq % N]:
+                break
+        else:
+            if self.next_seq >= self.base+N:  # window is full
+                return
+            PDU = self.fetch_packet()
+            if PDU is None:
+                return
+            seq = self.next_seq
+            self.window[seq % N] = PDU
+            self.acked[seq % N] = False
+            self.next_seq += 1
+        IDU = SAP_data(self.window[seq % N].add_header(seq % self.seq_mod, self.seq_bits))
+        self.spare_time = self.Node.from_L2_to_L1(IDU)
+        self.start_timer(seq, self.spare_time)
+        self.schedule_start()
 
     def call_from_L1(self, IDU):
-        pass  # Override this
+        """Get selective ACK: mark frame + Clear its timer + slide window. O(1) per ACKed frame.
+            Get NAK: retransmit frame."""
+        IDU = SAP_data.of(IDU)
+        ack, PDU = IDU.PDU.remove_header(self.seq_bits)
+        if PDU.frame_size != 8 or PDU.frame not in (self.ACK_header, self.NAK_header):  # undetected error: drop
+            return
+        N = self.N_window
+        seq = self.base+(ack-self.base) % self.seq_mod
+        if seq >= self.next_seq or self.acked[seq % N]:  # not outstanding or duplicate ACK
+            return
+        if PDU.frame == self.NAK_header:
+            return self.retransmit(seq)
+        self.acked[seq % N] = True
+        self.stop_timer(seq)
+        while self.base < self.next_seq and self.acked[self.base % N]:  # slide window
+            self.window[self.base % N] = None
+            self.base += 1
+        self.schedule_start()
+    
+    def retransmit(self, seq_nr: int):
+        """Queue `seq_nr` frame for retransmission."""
+        if seq_nr in self.retransmit_set:
+            return
+        self.retransmit_set.add(seq_nr)
+        self.retransmit_queue.append(seq_nr)
+        self.schedule_start()
     
     def timeout_func(self, seq_nr: int):
-        pass  # Override this
+        """Retransmit `seq_nr` frame."""
+        if seq_nr < self.base or self.acked[seq_nr % self.N_window]:
+            return
+        self.retransmit(seq_nr)
 
 
 class Selective_Repeat_Rx(DataLink):
-    def __init__(self, timeout) -> None:
-        super().__init__(timeout)
+    """Selective Repeat receiver. Buffers out of order frames of window, passes them to L3 in order 
+        and ACKs every received frame. First out of order frame triggers a NAK of missing frame."""
+    def __init__(self, timeout=0, N_window=4) -> None:
+        super().__init__(timeout, N_window=N_window)
+        self.seq_bits = (2*N_window-1).bit_length()
+        self.seq_mod = 1<<self.seq_bits
+        self.window = [None]*N_window  # ring buffer of received PDUs
+        self.base = 0  # next frame to pass to L3
+        self.ack_queue = deque()  # (header, seq_nr) of ACK/NAKs waiting for L1
+        self.nak_sent = False  # NAK of `base` has been sent
     
     def start_transmit(self, IDU: dict):
-        pass  # Override this
+        """Transmit oldest waiting ACK (or NAK)."""
+        self.start_pending = False
+        header, seq_nr = self.ack_queue.popleft()
+        ACK = Frame(header<<self.seq_bits | seq_nr, 8+self.seq_bits)
+        self.spare_time = self.Node.from_L2_to_L1(SAP_data(ACK))
+        if self.ack_queue:
+            self.schedule_start()
 
     def call_from_L1(self, IDU):
-        pass  # Override this
+        """Buffer received frame + pass in order frames to L3 + send ACK"""
+        IDU = SAP_data.of(IDU)
+        seq_nr, PDU = IDU.PDU.remove_header(self.seq_bits)
+        N = self.N_window
+        offset = (seq_nr-self.base) % self.seq_mod
+        if offset < N:  # in window
+            seq = self.base+offset
+            if self.window[seq % N] is None:
+                self.window[seq % N] = PDU
+            if self.window[self.base % N] is None and not self.nak_sent:  # gap: NAK missing frame
+                self.nak_sent = True
+                self.ack_queue.append((self.NAK_header, self.base % self.seq_mod))
+            while self.window[self.base % N] is not None:  # pass in order frames
+                self.Node.from_L2_to_L3(SAP_data(self.window[self.base % N]))
+                self.window[self.base % N] = None
+                self.base += 1
+                self.nak_sent = False
+        elif offset < self.seq_mod-N:  # out of any window: drop
+            return
+        # else: old frame, its ACK was lost => ACK again
+        self.ack_queue.append((self.ACK_header, seq_nr))
+        self.schedule_start()
@@ -1,13 +1,113 @@
-import numpy as np  # for source information bits generation.
-from random import getrandbits, random  # for source information bits generation.
-from functools import reduce  # for construct noise
+import random  # default random stream of elements that are not bound to a simulator
 #####
 from CRC import CRC
-from simulator import Simulator, Event_queues
+from noise import BSC_noise
+from simulator import Simulator, Event_queues, Timer_service, Event_code, EVENT_TYPES, register_event
+
+# Event types of layers
+DL_START = register_event('DL start')  # data: IDU or None
+DL_TIMEOUT = register_event('DL timeout')  # data: seq_nr
+CH_TRANSMIT = register_event('ch transmit')  # data: PDU
 
 # Service Access Point (SAP) data exchange format: PDU + SDU
 ## An example
 IDU = {'PDU':{'frame':0x1241, 'frame_size': 32}, 'SDU':None}
+## Layers exchange `SAP_data(Frame(0x1241, 32), None)`, a compact version of above dict.
+
+class Frame:
+    """PDU of a layer: `frame` bits + `frame_size`. Headers of layers (e.g. DL seq_nr) and trailers 
+        (e.g. CRC) are stored in tail (LSB) of `frame` like the dict format.
+        Copy-on-write: layers never change a `Frame` that they pass or receive (it may be buffered 
+        for retransmission), they build a new one e.g. with `add_header`, `remove_header`.
+        Dict-style access (`PDU['frame']`) still works.
+        `t_gen`: generation time of packet (set by traffic sources, `None` otherwise). It travels with the
+        frame through headers, PHY and channel (simulation metadata, not bits), so L3 of receiver gets latency."""
+    __slots__ = ('frame', 'frame_size', 't_gen')
+    
+    def __init__(self, frame:int, frame_size:int, t_gen=None) -> None:
+        self.frame = frame
+        self.frame_size = frame_size
+        self.t_gen = t_gen
+    
+    @classmethod
+    def of(cls, PDU):
+        """Convert dict PDU (`{'frame':..., 'frame_size':...}`) to `Frame`. Other PDUs (frames, `None`, arguments
+            of commands e.g. event handle of `'cancel transmit'`) are returned as is."""
+        if not isinstance(PDU, dict):
+            return PDU
+        return cls(PDU['frame'], PDU['frame_size'])
+    
+    def __repr__(self) -> str:
+        return f"{{'frame': {self.frame}, 'frame_size': {self.frame_size}}}"
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, dict):
+            other = Frame.of(other)
+        if not isinstance(other, Frame):
+            return NotImplemented
+        return self.frame == other.frame and self.frame_size == other.frame_size
+    
+    # dict compatibility
+    def __getitem__(self, key):
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+    
+    def to_dict(self) -> dict:
+        return {'frame': self.frame, 'frame_size': self.frame_size}
+    
+    def add_header(self, header:int, header_size:int):
+        """Return new frame with `header` (`header_size` bits) in its tail."""
+        return Frame(self.frame<<header_size | header, self.frame_size+header_size, self.t_gen)
+    
+    def remove_header(self, header_size:int):
+        """Return `(header, frame without header)`. Inverse of `add_header`."""
+        return self.frame & ((1<<header_size)-1), Frame(self.frame>>header_size, self.frame_size-header_size, self.t_gen)
+
+
+class SAP_data:
+    """IDU (`PDU` + `SDU`) exchanged between layers. `SDU` is a command (e.g. `'push'`, `'cancel transmit'`) 
+        or `None` for data. Dict-style access (`IDU['PDU']`) still works."""
+    __slots__ = ('PDU', 'SDU')
+    
+    def __init__(self, PDU:Frame=None, SDU=None) -> None:
+        self.PDU = PDU
+        self.SDU = SDU
+    
+    @classmethod
+    def of(cls, IDU):
+        """Convert dict IDU (`{'PDU':..., 'SDU':...}`) to `SAP_data`. `SAP_data` is returned as is."""
+        if isinstance(IDU, SAP_data):
+            return IDU
+        return cls(Frame.of(IDU.get('PDU')), IDU.get('SDU'))
+    
+    def __repr__(self) -> str:
+        return f"{{'PDU': {self.PDU!r}, 'SDU': {self.SDU!r}}}"
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, dict):
+            other = SAP_data.of(other)
+        if not isinstance(other, SAP_data):
+            return NotImplemented
+        return self.PDU == other.PDU and self.SDU == other.SDU
+    
+    # dict compatibility
+    def __getitem__(self, key):
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+    
+    def to_dict(self) -> dict:
+        return {'PDU': None if self.PDU is None else self.PDU.to_dict(), 'SDU': self.SDU}
+
 
 # Communication Node
 class Node:
@@ -17,6 +117,8 @@ class Node:
         self.L1, self.L2, self.L3 = None, None, None
         self.bind_sim(simulator)
         self.event_queue = Event_queues()
+        self.timers = Timer_service(self.event_queue, DL_TIMEOUT)  # L2 timers (keyed by seq_nr)
+        self.handlers = {}  # event code -> handler(event data). Layers register their events.
     
     def bind_sim(self, simulator:Simulator):
         """Bind this Node to simulator"""
@@ -36,11 +138,20 @@ class Node:
         self.Rx_chann = Rx_chann
         Rx_chann.bind_Rx(self)
 
+    layer_names = ("L1", "L2", "L3")  # Extend in children for new layers e.g. MAC
+    
     def bind_element(self, elem_name, elem):
-        """Bind elements (L1, L2, L3"""
-        assert elem_name in ("L1", "L2", "L3"), f'unknown layer: {elem_name}'
+        """Bind elements (L1, L2, L3). If element has `event_handlers` method, its handlers are registered."""
+        assert elem_name in self.layer_names, f'unknown layer: {elem_name}'
         self.__setattr__(elem_name, elem)  # register element to Node
         elem.assign_Node(self)  # element detects its parent (Node)
+        if hasattr(elem, 'event_handlers'):
+            for command, handler in elem.event_handlers().items():
+                self.register_handler(command, handler)
+    
+    def register_handler(self, command, handler):
+        """Run `handler(data)` for `(timestamp, command, data)` events of this Node. `command`: name or code."""
+        self.handlers[EVENT_TYPES.code(command)] = handler
     
     def from_L1_to_chann(self, IDU:dict):
         """This function provide a platform to interact between layers while each layer does not know other layers type."""
@@ -67,8 +178,11 @@ class Node:
         return self.L2.call_from_L3(IDU)
 
     def add_event(self, event):
-        """Add new event to Node event queue."""
-        self.event_queue.add_event(event)
+        """Add new event to Node event queue. Return event handle (see `Event_queues.cancel_event`).
+            String commands (e.g. `'DL start'`) are translated to event codes."""
+        if event[1].__class__ is not Event_code:
+            event = (event[0], EVENT_TYPES.code(event[1]), event[2])
+        return self.event_queue.add_event(event)
     
     def ret_event_queue(self):
         """Return event queue. Use for find nearest event in all Nodes."""
@@ -81,11 +195,11 @@ class Node:
     def event_run(self):
         """Run nearest event in this Node. This function used when `Simulator` detects nearest event in all Nodes is in this Node."""
         event = self.event_queue.pop_event()
-        # check for event layer. Switch case!
-        if event[1][:2] == 'DL':  # e.g. event[1] = 'DL timeout' => event[1][:2]='DL' => DL event
-            self.L2.event_run(event)
-        else:
-            raise ValueError(f"Unknown event layer {event[1]}")
+        # Handlers table. Switch case!
+        handler = self.handlers.get(event[1])
+        if handler is None:  # e.g. a string command added directly to queue
+            handler = EVENT_TYPES.handler(self.handlers, event[1])
+        handler(event[2])
 
 
 # Data network layers
@@ -96,23 +210,25 @@ class Source:
         """`packet_size`: Size of each packet. Each packet has a fixed size"""
         self.packet_size = packet_size
         self.Node = None
+        self.rng = random  # random stream of information bits
     
     def assign_Node(self, Node:Node):
         """Assign this Source to `Node` that contains this Source."""
         self.Node = Node
+        self.rng = Node.simulator.spawn_rng()
 
     def send_packet(self):
         """generate packet and send to L2.
             Out:
                 `packet`: generated packet
                 `pack_size`: length of packet i.e. `self.pack_size"""
-        IDU = {'PDU':{'frame':getrandbits(self.packet_size), 'frame_size':self.packet_size}, 'SDU':None}
+        IDU = SAP_data(Frame(self.rng.getrandbits(self.packet_size), self.packet_size))
         self.Node.from_L3_to_L2(IDU)
         return
     
     def call_from_L2(self, IDU):
         """An event that L3 receives IDU from L2."""
-        if IDU['SDU'] == 'push':
+        if SAP_data.of(IDU).SDU == 'push':
             self.send_packet()
         else:
             raise ValueError(f"Unknown IDU for L3 {IDU}")
@@ -134,8 +250,27 @@ class Sink:
     
     def call_from_L2(self, IDU):
         """An event that L3 receives frame from L2."""
-        if IDU['SDU'] == None:
-            self.recv_packet(IDU['PDU'])
+        IDU = SAP_data.of(IDU)
+        if IDU.SDU == None:
+            self.recv_packet(IDU.PDU)
+        else:
+            raise ValueError(f"Unknown IDU for L3 {IDU}")
+
+
+class Source_Sink(Source):
+    """L3 of a Node that sends and receives (e.g. both ends of a `Duplex_link`): generates packets like `Source`
+        and counts received packets like `Sink`."""
+    def __init__(self, packet_size:int) -> None:
+        super().__init__(packet_size)
+        self.counter = 0
+    
+    def call_from_L2(self, IDU):
+        """L2 requests a packet (`'push'`) or delivers one."""
+        IDU = SAP_data.of(IDU)
+        if IDU.SDU == 'push':
+            self.send_packet()
+        elif IDU.SDU is None:
+            self.counter += 1
         else:
             raise ValueError(f"Unknown IDU for L3 {IDU}")
 
@@ -148,6 +283,7 @@ class PHY:
             ensure frame is valid. It has 2 method :`encode`, `decode`"""
         self.checker = checker
         self.Node = None  # Node that contains this PHY
+        self.last_handle = None  # event handle of latest frame transmitted by this PHY (see `cancel`)
     
     def assign_Node(self, Node:Node):
         """Assign this PHY to `Node` that contains this PHY."""
@@ -157,45 +293,79 @@ class PHY:
         """An event that PHY receives frame from channel.
             first check frame validation (like CRC) and if it was valid pass frame to L2, if not drops it.
             `PDU`: [Dict] recovered packet from channel. It contains `frame`, `frame_size`."""
-        dec_frame, dec_frame_size, status = self.checker.decode(PDU['frame'], PDU['frame_size'])
+        PDU = Frame.of(PDU)
+        dec_frame, dec_frame_size, status = self.checker.decode(PDU.frame, PDU.frame_size)
         if status == False:  # invalid frame
             return  # Do nithing
         # valid frame -> pass to L2
-        IDU_L2 = {'PDU':{'frame':dec_frame, 'frame_size':dec_frame_size}, 'SDU':None}
+        IDU_L2 = SAP_data(Frame(dec_frame, dec_frame_size, PDU.t_gen))
         self.Node.from_L1_to_L2(IDU_L2)
     
     def call_from_L2(self, IDU:dict):
         """An event that PHY receives frame from L2.
             first add frame validation (like CRC) and then send to channel.
             `IDU`: [Dict] Contains `PDU` and `SDU`."""
-        if not(IDU['SDU'] is None):  # A command to channel e.g. cancel current packet transmission
+        IDU = SAP_data.of(IDU)
+        if not(IDU.SDU is None):  # A command to channel e.g. cancel current packet transmission
             return self.Node.from_L1_to_chann(IDU)
         # Packet transmission in channel
-        PDU = IDU['PDU']
-        enc_frame, enc_frame_size = self.checker.encode(PDU['frame'], PDU['frame_size'])
-        IDU_chann = {'PDU':{'frame':enc_frame, 'frame_size':enc_frame_size}, 'SDU':None}
+        PDU = IDU.PDU
+        enc_frame, enc_frame_size = self.checker.encode(PDU.frame, PDU.frame_size)
+        IDU_chann = SAP_data(Frame(enc_frame, enc_frame_size, PDU.t_gen))
         t_done = self.Node.from_L1_to_chann(IDU_chann)  # time that transmission has done.
+        self.last_handle = self.Node.Tx_chann.last_handle
         return t_done
+    
+    def cancel(self, handle=None) -> bool:
+        """Cancel transmission of `handle` (`last_handle` after `call_from_L2`, default: latest frame of this PHY)
+            with `'cancel transmit'` command of Tx channel (see `Channel.cancel`).
+            Return `False` if frame has already been received or cancelled."""
+        if handle is None:
+            handle = self.last_handle
+        if handle is None:
+            return False
+        return self.Node.from_L1_to_chann(SAP_data(handle, 'cancel transmit'))
 
 # PHY Channel
 class Channel:
-    """Binary symmetric channel (BSC).
-        `p`: error probability
+    """Binary symmetric channel (BSC) or any other channel model of `noise`.
+        `p`: error probability of BSC (`None` if `noise` is given)
         `R_T`: Transmission Rate
-        `D_p`: propagation delay"""
+        `D_p`: propagation delay
+        `noise`: channel model (`noise.Noise_model`, e.g. `Gilbert_Elliott_noise`), default `BSC_noise(p)`"""
     
-    def __init__(self, p, R_T, D_p) -> None:
-        self.p = p  # error probility
+    def __init__(self, p, R_T, D_p, noise=None) -> None:
+        assert (p is None) != (noise is None), "Give either error probability `p` (BSC) or channel model `noise`."
+        self.noise = BSC_noise(p) if noise is None else noise  # noise engine (random stream is set by `bind_sim`)
         self.R_T = R_T  # transmission rate
         self.D_p = D_p  # propagation delay
 
         self.event_queue = Event_queues()
         self.spare_time = 0  # nearest time that channel is free and ready to inject new packet.
+        self.last_handle = None  # event handle of latest transmission (see `cancel`)
+        self.handlers = {CH_TRANSMIT: self.recv_chann}  # event code -> handler(event data)
+    
+    @property
+    def p(self):
+        """Error probability (stored in noise engine, mean bit error probability of other models)."""
+        return self.noise.p
+    
+    @p.setter
+    def p(self, p):
+        """Set error probability of BSC-like models. Models with derived `p` (e.g. `Gilbert_Elliott_noise`)
+            are configured by their own parameters."""
+        prop = getattr(type(self.noise), 'p', None)
+        if isinstance(prop, property) and prop.fset is None:
+            raise ValueError(f"Error probability of {type(self.noise).__name__} is derived from its parameters, "
+                             "set them on the noise model instead.")
+        self.noise.p = p
     
     def bind_sim(self, simulator:Simulator):
         """Bind this Node to simulator"""
         self.simulator = simulator  # Save simulator obj ref.
         simulator.add_element(self)  # Simulator detects this Node
+        self.noise.rng = simulator.spawn_rng()  # own random stream
+        self.noise.np_rng = None
     
     def get_sim_time(self):
         """Get simulator time. Actually fetch time from simulator and returns to ites elements like DL."""
@@ -211,32 +381,55 @@ class Channel:
     
     def call_from_L1(self, IDU):
         """An event that channel receives frame from PHY.
-            It could be 2 state: 1-packet transmitting 2-command(e.g. cancel transmitting)."""
-        if not(IDU['SDU'] is None):  # A command to channel e.g. cancel current packet transmission
-            if IDU['SDU'] == 'cancel transmit':
-                event = self.event_queue.pop_event()  # pop acts like delete event from queue.
-                assert event[1] == 'ch transmit', f"Unknown event for channel {event[1]}"  # check for event type
-                return
+            It could be 2 state: 1-packet transmitting 2-command(e.g. cancel transmitting).
+            `SAP_data(handle, 'cancel transmit')`: cancel transmission of `handle` (`None`: latest), see `cancel`."""
+        IDU = SAP_data.of(IDU)
+        if not(IDU.SDU is None):  # A command to channel e.g. cancel current packet transmission
+            if IDU.SDU == 'cancel transmit':
+                return self.cancel(IDU.PDU)
+            raise ValueError(f"Unknown command for channel {IDU.SDU}")
         # Packet transmitting
         assert self.spare_time <= self.get_sim_time(), "Channel is occupied! You can't transmit new packet"
-        return self.inject_chann(IDU['PDU'])
+        return self.inject_chann(IDU.PDU)
 
     def inject_chann(self, PDU:dict):
         """Inject frame(packet) into channel. This channel affect 2 parameters:
             1-Transmission delay(`R_T`) 2-Propagation delay(`D_p`)"""
-        D_transmission = PDU['frame_size']/self.R_T  # Transmission delay
+        PDU = Frame.of(PDU)
+        D_transmission = PDU.frame_size/self.R_T  # Transmission delay
         self.spare_time = self.get_sim_time()+D_transmission  # at this time, PHY is free and can inject new packet into channel.
         event = (self.spare_time+self.D_p,  # timestamp
-                'ch transmit',  # command
+                CH_TRANSMIT,  # command
                 PDU)  # data: in this case PDU.
-        self.event_queue.add_event(event)
+        self.last_handle = self.event_queue.add_event(event)
         return self.spare_time  # Transmission delay
     
+    def cancel(self, handle=None) -> bool:
+        """Cancel transmission of `handle` (`last_handle` after `inject_chann`, default: latest transmission).
+            Layers use `PHY.cancel`.
+            Only that frame is removed (O(1) tombstone in event queue). If it is still being transmitted, channel
+            is free from now on, for channel and for DL of Tx Node (`channel_freed`).
+            Return `False` if frame has already been received or cancelled."""
+        if handle is None:
+            handle = self.last_handle
+        if handle is None or not self.event_queue.cancel_event(handle):
+            return False
+        t_now = self.get_sim_time()
+        t_done = self.spare_time if handle is self.last_handle else handle[0]-self.D_p  # end of its transmission
+        if t_done > t_now:  # transmission is aborted
+            self.spare_time = t_now
+            channel_freed = getattr(self.Tx_Node.L2, 'channel_freed', None)
+            if channel_freed is not None:
+                channel_freed(t_now)
+        return True
+    
     def recv_chann(self, PDU:dict):
         """Affect noise to packet and then pass it to PHY."""
-        err = sum(map(lambda ind: 1<<ind if random()<self.p else 0, range(PDU['frame_size'])))  # BSC error
-        # err = reduce(lambda x,y:(x<<1)|y, np.where(np.random.rand(PDU['frame_size'])>self.p,0,1))  # BSC error
-        PDU['frame'] = err ^ PDU['frame']  # Add noise
+        err = self.noise.error_mask(PDU.frame_size)  # BSC error: O(errors) draws
+        if err:
+            PDU = Frame(err ^ PDU.frame, PDU.frame_size, PDU.t_gen)  # Add noise (copy on write)
+        elif err is None:
+            return  # frame is erased
         
         self.Rx_Node.from_chann_to_L1(PDU)  # call PHY to receives packet
 
@@ -247,12 +440,35 @@ class Channel:
     def event_run(self):
         """Run nearest event. In this case PHY receives packet from channel."""
         event = self.event_queue.pop_event()
-        # check for event type. Switch case!
-        if event[1] == 'ch transmit':
-            PDU = event[2]  # extract PDU
-            return self.recv_chann(PDU)
-        else:
-            raise ValueError(f"Unknown event for channel {event[1]}")
+        # Handlers table. Switch case!
+        handler = self.handlers.get(event[1])
+        if handler is None:
+            handler = EVENT_TYPES.handler(self.handlers, event[1])
+        return handler(event[2])
+
+
+
+class Duplex_link:
+    """Full duplex link between two Nodes: one `Channel` per direction (`a_to_b`, `b_to_a`), so each direction
+        has its own occupancy (`spare_time`), in flight frames and random stream.
+        `noise`: factory of channel models (called once per direction), default BSC with error probability `p`
+            (`None` if `noise` is given)."""
+    
+    def __init__(self, p, R_T, D_p, noise=None) -> None:
+        assert (p is None) != (noise is None), "Give either error probability `p` (BSC) or channel model `noise`."
+        self.a_to_b = Channel(p, R_T, D_p, None if noise is None else noise())
+        self.b_to_a = Channel(p, R_T, D_p, None if noise is None else noise())
+    
+    def bind_sim(self, simulator:Simulator):
+        """Bind both directions to simulator."""
+        self.a_to_b.bind_sim(simulator)
+        self.b_to_a.bind_sim(simulator)
+    
+    def connect(self, node_a:Node, node_b:Node):
+        """Bind `node_a` and `node_b` to ends of link."""
+        node_a.bind_channels(self.a_to_b, self.b_to_a)
+        node_b.bind_channels(self.b_to_a, self.a_to_b)
+
 
 
 if __name__=='__main__':
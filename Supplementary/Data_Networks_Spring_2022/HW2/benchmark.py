@@ -0,0 +1,258 @@
+# Benchmark suite of simulator hot paths. Results are JSON and can be compared with a stored baseline.
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from simulator import Simulator, Event_queues
+from Layers import Channel, Frame
+from CRC import CRC, PRESETS
+
+# Parameter grids of benchmarks (`--quick` uses first values only)
+CRC_DIVISORS = {'CRC-3': 0xB, 'CRC-8': PRESETS['CRC-8'], 'CRC-32': PRESETS['CRC-32']}
+CRC_FRAME_SIZES = [100, 1000, 12000]
+QUEUE_DEPTHS = [10, 1000, 100000]
+SIM_ELEMENTS = [4, 100, 10000]
+CHANNEL_PS = [0, 1e-4, 1e-2]
+CHANNEL_FRAME_SIZE = 1000
+# Cold start budget: seconds to start a fresh interpreter and import module (`main` fails if exceeded)
+COLD_START_BUDGET = {'simulator': 0.045, 'Layers': 0.1, 'DataLink': 0.1, 'sweep': 0.15}
+
+
+def measure(func, n_ops:int, min_time=0.2, repeat=5) -> float:
+    """Best time per operation of `func()` (which runs `n_ops` operations), like `timeit`: calls are
+        batched until a batch takes `min_time`, best of `repeat` batches is taken."""
+    n_calls = 1
+    while True:
+        t_start = time.perf_counter()
+        for _ in range(n_calls):
+            func()
+        elapsed = time.perf_counter()-t_start
+        if elapsed >= min_time or n_calls >= 1<<20:
+            break
+        n_calls *= 2 if elapsed <= 0 else max(2, min(10, int(1.2*min_time/elapsed)+1))
+    best = elapsed
+    for _ in range(repeat-1):
+        t_start = time.perf_counter()
+        for _ in range(n_calls):
+            func()
+        best = min(best, time.perf_counter()-t_start)
+    return best/(n_calls*n_ops)
+
+
+# Benchmarks: each one yields `(name, params, func, n_ops)`
+def bench_crc(quick):
+    rng = random.Random(0)
+    for crc_name, divisor in CRC_DIVISORS.items():
+        crc = CRC(divisor)
+        for frame_size in CRC_FRAME_SIZES[:1] if quick else CRC_FRAME_SIZES:
+            data = rng.getrandbits(frame_size)
+            enc_data, enc_size = crc.encode(data, frame_size)
+            params = {'crc': crc_name, 'mode': crc.mode, 'frame_size': frame_size}
+            yield 'crc.encode', params, lambda crc=crc, data=data, size=frame_size: crc.encode(data, size), 1
+            yield 'crc.decode', params, lambda crc=crc, data=enc_data, size=enc_size: crc.decode(data, size), 1
+
+
+def bench_crc_batch(quick):
+    """Batch mode of CRC check (`CRC.remainders`), per frame."""
+    import numpy as np
+    n_frames = 1024 if quick else 16384
+    for crc_name, divisor in CRC_DIVISORS.items():
+        crc = CRC(divisor)
+        for frame_size in CRC_FRAME_SIZES[:1] if quick else CRC_FRAME_SIZES:
+            frames = np.random.default_rng(0).integers(0, 256, (n_frames, frame_size//8), dtype=np.uint8)
+            params = {'crc': crc_name, 'frame_size': frame_size}
+            yield 'crc.remainders', params, lambda crc=crc, frames=frames: crc.remainders(frames), n_frames
+
+
+def bench_event_queue(quick):
+    rng = random.Random(0)
+    for depth in QUEUE_DEPTHS[:1] if quick else QUEUE_DEPTHS:
+        queue = Event_queues()
+        for _ in range(depth):
+            queue.add_event((rng.random(), 'event', None))
+        times = [rng.random() for _ in range(1000)]
+
+        def insert_pop(queue=queue, times=times):
+            add_event, pop_event = queue.add_event, queue.pop_event
+            for timestamp in times:
+                add_event((timestamp, 'event', None))
+                pop_event()
+        yield 'event_queue.insert_pop', {'depth': depth}, insert_pop, len(times)
+
+
+class _Bench_element:
+    """Element with one periodic event (Poisson process of rate 1)."""
+    def __init__(self, rng) -> None:
+        self.event_queue = Event_queues()
+        self.rng = rng
+        self.event_queue.add_event((rng.expovariate(1), 'tick', None))
+
+    def ret_event_queue(self):
+        return self.event_queue
+
+    def event_run(self):
+        event = self.event_queue.pop_event()
+        self.event_queue.add_event((event[0]+self.rng.expovariate(1), 'tick', None))
+
+
+def bench_simulator(quick):
+    for n_elements in SIM_ELEMENTS[:1] if quick else SIM_ELEMENTS:
+        rng = random.Random(0)
+        simulator = Simulator(0)
+        for _ in range(n_elements):
+            simulator.add_element(_Bench_element(rng))
+        simulator.init_schedule()
+
+        def steps(simulator=simulator, n_steps=1000):
+            step = simulator.step
+            for _ in range(n_steps):
+                step()
+        yield 'simulator.step', {'elements': n_elements}, steps, 1000
+
+
+class _Null_node:
+    def from_chann_to_L1(self, PDU):
+        pass
+
+
+def bench_channel(quick):
+    for p in CHANNEL_PS[1:2] if quick else CHANNEL_PS:
+        simulator = Simulator(0)
+        channel = Channel(p, 1e6, 1e-3)
+        channel.bind_sim(simulator)
+        channel.bind_Rx(_Null_node())
+        PDU = Frame(random.Random(0).getrandbits(CHANNEL_FRAME_SIZE), CHANNEL_FRAME_SIZE)
+        params = {'p': p, 'frame_size': CHANNEL_FRAME_SIZE}
+        yield 'channel.recv_chann', params, lambda channel=channel, PDU=PDU: channel.recv_chann(PDU), 1
+
+
+def bench_end_to_end(quick):
+    """Events per second of `DL_simul.ipynb` Stop and Wait scenario."""
+    from sweep import build_stop_wait
+    for p in CHANNEL_PS[1:2] if quick else CHANNEL_PS[1:]:
+        def run(p=p, t_end=0.5):
+            simulator = Simulator(0)
+            build_stop_wait(simulator, p=p, R_T=1e6, D_p=1e-3, divisor=0xB, packet_size=96)
+            simulator.init_schedule()
+            step = simulator.step
+            n_events = 0
+            while simulator.time <= t_end:
+                step()
+                n_events += 1
+            return n_events
+        n_events = run()  # deterministic (seeded): same number of events in each call
+        yield 'end_to_end.stop_wait', {'p': p, 'events': n_events}, run, n_events
+
+
+def bench_cold_start(quick):
+    """Fresh interpreter that imports a module (like a process pool worker or a short CLI run)."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    modules = list(COLD_START_BUDGET)
+    for module in modules[-1:] if quick else modules:
+        command = [sys.executable, '-c', f'import {module}']
+        yield 'cold_start.import', {'module': module}, \
+            lambda command=command: subprocess.run(command, cwd=directory, check=True), 1
+
+
+def over_budget(results:dict) -> list:
+    """Cold start results over `COLD_START_BUDGET`: list of `(key, seconds, budget)`."""
+    rows = []
+    for key, result in results['results'].items():
+        if result['name'] == 'cold_start.import':
+            budget = COLD_START_BUDGET[result['params']['module']]
+            if result['sec_per_op'] > budget:
+                rows.append((key, result['sec_per_op'], budget))
+    return rows
+
+
+BENCHMARKS = {
+    'crc': bench_crc,
+    'crc_batch': bench_crc_batch,
+    'event_queue': bench_event_queue,
+    'simulator': bench_simulator,
+    'channel': bench_channel,
+    'end_to_end': bench_end_to_end,
+    'cold_start': bench_cold_start,
+}
+
+
+def result_key(name:str, params:dict) -> str:
+    """Unique key of a benchmark result e.g. `crc.encode[crc=CRC-8,frame_size=100,mode=table]`."""
+    return name+'['+','.join(f'{key}={params[key]}' for key in sorted(params) if key != 'events')+']'
+
+
+def run_benchmarks(names=None, quick=False, min_time=0.2, repeat=5, log=None) -> dict:
+    """Run benchmarks `names` (default: all of `BENCHMARKS`). Return JSON-ready dict:
+        `{'meta': {...}, 'results': {key: {'name', 'params', 'sec_per_op', 'ops_per_sec'}}}`."""
+    results = {}
+    for bench_name in names or BENCHMARKS:
+        for name, params, func, n_ops in BENCHMARKS[bench_name](quick):
+            sec_per_op = measure(func, n_ops, min_time, repeat)
+            key = result_key(name, params)
+            results[key] = {'name': name, 'params': params, 'sec_per_op': sec_per_op, 'ops_per_sec': 1/sec_per_op}
+            if log is not None:
+                print(f'{key}: {1/sec_per_op:,.0f} ops/s', file=log)
+    meta = {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'quick': quick}
+    return {'meta': meta, 'results': results}
+
+
+def compare(results:dict, baseline:dict, threshold=0.2) -> list:
+    """Compare `results` with `baseline` (both `run_benchmarks` outputs). Return list of rows
+        `(key, baseline ops/s, ops/s, ratio, status)`; status is `regression` if slower than
+        `1-threshold` times baseline, `improvement` if faster than `1+threshold`, else `ok`."""
+    rows = []
+    for key, result in results['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            rows.append((key, None, result['ops_per_sec'], None, 'new'))
+            continue
+        ratio = result['ops_per_sec']/base['ops_per_sec']
+        status = 'regression' if ratio < 1-threshold else 'improvement' if ratio > 1+threshold else 'ok'
+        rows.append((key, base['ops_per_sec'], result['ops_per_sec'], ratio, status))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark simulator hot paths.')
+    parser.add_argument('benchmarks', nargs='*', help=f'any of {list(BENCHMARKS)} (default: all)')
+    parser.add_argument('--quick', action='store_true', help='smallest parameters only')
+    parser.add_argument('--min_time', type=float, default=0.2, help='min seconds of each timed batch')
+    parser.add_argument('--repeat', type=int, default=5, help='timed batches (best is taken)')
+    parser.add_argument('--out', default=None, help='write results JSON to this file')
+    parser.add_argument('--baseline', default=None, help='baseline JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown reported as regression')
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks)-set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {sorted(unknown)}')
+    results = run_benchmarks(args.benchmarks, args.quick, args.min_time, args.repeat, log=sys.stderr)
+    if args.out is None:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.out, 'w') as file:
+            json.dump(results, file, indent=1)
+    slow = over_budget(results)
+    for key, seconds, budget in slow:
+        print(f'over budget: {seconds*1e3:.0f} ms > {budget*1e3:.0f} ms  {key}', file=sys.stderr)
+    if args.baseline is None:
+        return 1 if slow else 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    rows = compare(results, baseline, args.threshold)
+    for key, base, ops, ratio, status in rows:
+        base_text = '-' if base is None else f'{base:,.0f}'
+        ratio_text = '-' if ratio is None else f'{ratio:.2f}x'
+        print(f'{status:11} {ratio_text:>7} {base_text:>14} -> {ops:,.0f} ops/s  {key}', file=sys.stderr)
+    return 1 if slow or any(row[4] == 'regression' for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# Undetected error probability of CRC over BSC, from weight distribution of the code
+from math import exp, log, log1p, sqrt
+import random as _random
+
+import numpy as np
+
+from CRC import CRC, PRESETS, syndrome_table
+from noise import BSC_noise
+
+MAX_ENUM_BITS = 20  # codeword enumeration: 2^k codewords (k: data bits)
+MAX_DUAL_BITS = 24  # dual code enumeration: 2^r dual codewords (r: CRC bits)
+
+_WEIGHTS = {}  # (divisor, n) -> weight distribution of code
+_DUAL_WEIGHTS = {}  # (divisor, n) -> weight distribution of dual code
+_BYTE_WEIGHTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """Number of 1 bits of each element of unsigned integer array `values`: `np.bitwise_count` (NumPy >= 2),
+        or a byte lookup table on NumPy 1.x."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    values = np.ascontiguousarray(values)
+    octets = values.view(np.uint8).reshape(values.shape+(values.itemsize,))
+    return _BYTE_WEIGHTS[octets].sum(axis=-1, dtype=np.uint8)
+
+
+def codeword_weights(divisor:int, n:int) -> list:
+    """Weight distribution `A[w]` (number of codewords of weight `w`) of CRC code of `n` bit frames, by
+        enumeration of all `2^k` codewords `m(x)*divisor(x)`, `k = n-r` (vectorized: codewords of first `i`
+        basis rows are XORed with row `i+1`, so the set doubles per row)."""
+    r = divisor.bit_length()-1
+    k = n-r
+    n_words = -(-n//64)
+    codewords = np.zeros((1, n_words), dtype=np.uint64)
+    for i in range(k):
+        row = divisor<<i
+        row = np.array([(row>>(64*j)) & (2**64-1) for j in range(n_words)], dtype=np.uint64)
+        codewords = np.concatenate((codewords, codewords ^ row))
+    weights = popcount(codewords).sum(axis=1, dtype=np.int64)
+    return [int(count) for count in np.bincount(weights, minlength=n+1)]
+
+
+def walsh_hadamard(values):
+    """Unnormalized Walsh-Hadamard transform of `values` (length `2^r`): `out[a] = sum_s values[s]*(-1)^(a.s)`."""
+    out = np.array(values, dtype=np.int64)
+    size = len(out)
+    h = 1
+    while h < size:
+        pairs = out.reshape(-1, 2, h)
+        x, y = pairs[:, 0, :].copy(), pairs[:, 1, :]
+        pairs[:, 0, :] += y
+        pairs[:, 1, :] = x-y
+        h <<= 1
+    return out
+
+
+def dual_weight_distribution(divisor:int, n:int) -> list:
+    """Weight distribution `B[w]` of dual code (`2^r` codewords), cached.
+        Dual codeword of `a` (r bits) has bit `i` = parity of `a & syndrome[i]` (see `CRC.syndrome_table`),
+        so its weight is `(n - W[a])/2` with `W` the Walsh-Hadamard transform of syndrome counts: O(r*2^r)."""
+    key = (divisor, n)
+    if key in _DUAL_WEIGHTS:
+        return _DUAL_WEIGHTS[key]
+    r = divisor.bit_length()-1
+    counts = np.bincount(np.array(syndrome_table(divisor, n), dtype=np.int64), minlength=1<<r)
+    weights = (n-walsh_hadamard(counts))//2
+    dual = [int(count) for count in np.bincount(weights, minlength=n+1)]
+    _DUAL_WEIGHTS[key] = dual
+    return dual
+
+
+def macwilliams(dual:list, n:int, r:int) -> list:
+    """Weight distribution of a code from weight distribution `dual` of its dual (`2^r` codewords):
+        `A[w] = 2^-r * sum_j B[j]*K_w(j)`, Krawtchouk polynomials by recurrence, exact integers."""
+    weights = [0]*(n+1)
+    for j, count in enumerate(dual):
+        if count == 0:
+            continue
+        prev, cur = 1, n-2*j  # K_0(j), K_1(j)
+        weights[0] += count
+        if n >= 1:
+            weights[1] += count*cur
+        for w in range(1, n):
+            prev, cur = cur, ((n-2*j)*cur-(n-w+1)*prev)//(w+1)
+            weights[w+1] += count*cur
+    assert all(weight % (1<<r) == 0 for weight in weights), "MacWilliams identity failed."
+    return [weight>>r for weight in weights]
+
+
+def weight_distribution(divisor:int, n:int) -> list:
+    """Weight distribution `A[w]`, `w = 0..n`, of CRC code of `n` bit frames (data + CRC), cached.
+        Codeword enumeration if data bits `k <= MAX_ENUM_BITS`, else MacWilliams transform of dual code
+        if CRC bits `r <= MAX_DUAL_BITS`."""
+    key = (divisor, n)
+    if key in _WEIGHTS:
+        return _WEIGHTS[key]
+    r = divisor.bit_length()-1
+    assert n > r, f"Frame ({n} bits) must be longer than CRC ({r} bits)."
+    if n-r <= MAX_ENUM_BITS:
+        weights = codeword_weights(divisor, n)
+    elif r <= MAX_DUAL_BITS:
+        weights = macwilliams(dual_weight_distribution(divisor, n), n, r)
+    else:
+        raise ValueError(f"Code too large for exact weight distribution: {n-r} data bits and {r} CRC bits.")
+    _WEIGHTS[key] = weights
+    return weights
+
+
+def min_distance(divisor:int, n:int) -> int:
+    """Minimum Hamming distance of CRC code of `n` bit frames: all error patterns with less errors are detected."""
+    weights = weight_distribution(divisor, n)
+    return next((w for w in range(1, n+1) if weights[w]), n+1)
+
+
+def undetected_prob(divisor:int, n:int, p) -> float:
+    """Probability that a frame of `n` bits (data + CRC) has an error that CRC does not detect over BSC(`p`):
+        `sum_w A[w] * p^w * (1-p)^(n-w)` (terms in log space, big `A[w]` and tiny `p^w` do not overflow)."""
+    if p <= 0:
+        return 0.
+    weights = weight_distribution(divisor, n)
+    if p >= 1:
+        return float(weights[n] > 0)
+    log_p, log_q = log(p), log1p(-p)
+    return sum(exp(log(count)+w*log_p+(n-w)*log_q) for w, count in enumerate(weights) if w and count)
+
+
+def exhaustive_weights(divisor:int, n:int) -> list:
+    """Validator: weight distribution of undetected error patterns, by checking all `2^n` error patterns
+        with `CRC` (batch mode). A pattern is undetected iff its remainder is 0 (CRC is linear)."""
+    assert n <= 26, "Too many error patterns."
+    patterns = np.arange(1<<n, dtype=np.uint64)
+    undetected = patterns[CRC(divisor).remainders(patterns) == 0]
+    weights = np.bincount(popcount(undetected).astype(np.int64), minlength=n+1)
+    return [int(count) for count in weights]
+
+
+def monte_carlo_undetected(divisor:int, n:int, p, trials:int, rng=None):
+    """Validator: estimate `undetected_prob` with `CRC.encode`/`decode` of random frames over BSC(`p`).
+        Frames are drawn given at least one error (`BSC_noise.error_mask_given_error`) and weighted by
+        probability of error, so rare undetected errors need fewer trials. Return `(estimate, standard error)`."""
+    rng = _random.Random(rng)
+    checker = CRC(divisor)
+    noise = BSC_noise(p, rng)
+    r = checker.divisor_len
+    undetected = 0
+    for _ in range(trials):
+        data = rng.getrandbits(n-r)
+        frame, frame_size = checker.encode(data, n-r)
+        _, _, valid = checker.decode(frame ^ noise.error_mask_given_error(frame_size), frame_size)
+        undetected += valid  # error pattern is not 0, so a valid frame is an undetected error
+    p_error = noise.frame_error_prob(n)
+    share = undetected/trials
+    return p_error*share, p_error*sqrt(share*(1-share)/trials)
+
+
+if __name__ == '__main__':
+    import time
+    # Exact weights against exhaustive check of all error patterns
+    for divisor, n in ((0xB, 7), (0xB, 16), (PRESETS['CRC-8'], 20), (0x13, 24)):
+        assert weight_distribution(divisor, n) == exhaustive_weights(divisor, n), (hex(divisor), n)
+    print("weight distributions match exhaustive check")
+    # Frames of `DL_simul.ipynb` (96 bit packet + seq_nr + CRC) and longer frames
+    for packet_size in (96, 1000, 12000):
+        for name, divisor in (('0xB', 0xB), ('CRC-8', PRESETS['CRC-8']), ('CRC-16', PRESETS['CRC-16'])):
+            n = packet_size+1+divisor.bit_length()-1
+            t0 = time.time()
+            line = f"{name:7} n={n:6}: d_min {min_distance(divisor, n)}"
+            line += ''.join(f", p={p:g}: {undetected_prob(divisor, n, p):.3e}" for p in (1e-4, 1e-3, 1e-2))
+            print(line+f" ({time.time()-t0:.2f} s)")
+    divisor, n, p = 0xB, 100, 1e-2
+    estimate, error = monte_carlo_undetected(divisor, n, p, 20000, rng=1)
+    print(f"0xB n={n} p={p}: exact {undetected_prob(divisor, n, p):.4e}, Monte Carlo {estimate:.4e} +- {error:.1e}")
@@ -0,0 +1,172 @@
+# Analytical fast-forward of error-free Stop and Wait cycles
+from math import log, floor
+
+from simulator import Simulator
+from Layers import Node, DL_START
+from noise import BSC_noise
+
+ACK_SIZE = 8+1  # ACK frame of `Stop_Wait_Rx`: ACK_header + seq_nr (without CRC)
+
+
+class Forced_noise:
+    """One-shot noise engine of a channel. Next frame is forced to be clean (`'clean'`) or to have
+        at least one error (`'error'`), then the original noise engine of channel is restored."""
+
+    def __init__(self, channel, mode:str) -> None:
+        assert mode in ('clean', 'error'), f'unknown forced noise: {mode}'
+        self.channel = channel
+        self.noise = channel.noise  # original engine
+        self.mode = mode
+        channel.noise = self
+
+    def __getattr__(self, name):
+        return getattr(self.noise, name)
+
+    def release(self):
+        """Restore original noise engine of channel."""
+        if self.channel.noise is self:
+            self.channel.noise = self.noise
+
+    def error_mask(self, frame_size:int) -> int:
+        self.release()
+        if self.mode == 'clean':
+            return 0
+        return self.noise.error_mask_given_error(frame_size)
+
+
+class Stop_Wait_Fast_Forward:
+    """Run a Stop and Wait link (`Stop_Wait_Tx` node -> `Stop_Wait_Rx` node, e.g. `sweep.build_stop_wait`)
+        and skip error-free cycles analytically.
+
+        A cycle starts with `DL start` of Tx when nothing else of link is pending. If data frame and ACK
+        have no bit error, the cycle takes exactly `T = L_d/R_T + D_p + L_a/R_T + D_p` and delivers one
+        packet. So at a cycle start, number of clean cycles before the next erroneous one is drawn from
+        geometric distribution (`P(clean) = (1-p)^L_d*(1-p)^L_a`) and applied in one step: `DL start` is
+        moved `K*T` ahead, `Sink.counter` is increased by `K` and seq_nr states are flipped `K` times.
+        The next cycle is forced to have an error (`Forced_noise`) and runs event by event until the
+        next cycle start (timeouts, retransmissions, ...). Near `t_end` only whole cycles are skipped and
+        the last one is forced clean, so counters at `t_end` have the same distribution as a full run.
+
+        Payloads of skipped packets are not generated (random streams differ from a full run) and
+        `Sink.counter` is increased at the start of skipped stretch."""
+
+    def __init__(self, simulator:Simulator, node_tx:Node, node_rx:Node, rng=None) -> None:
+        """`simulator`: simulator of link. Other elements of it run as usual.
+            `node_tx`, `node_rx`: Nodes with `Stop_Wait_Tx` + `Source` and `Stop_Wait_Rx` + `Sink`.
+            `rng`: random stream of cycle draws (default: spawned from simulator)."""
+        self.simulator = simulator
+        self.node_tx, self.node_rx = node_tx, node_rx
+        self.chann_tx, self.chann_rx = node_tx.Tx_chann, node_rx.Tx_chann
+        assert isinstance(self.chann_tx.noise, BSC_noise) and isinstance(self.chann_rx.noise, BSC_noise), \
+            "Fast forward needs memoryless BSC channels."
+        self.rng = simulator.spawn_rng() if rng is None else rng
+        self.forced_pending = False  # next cycle start is the forced cycle: do not skip
+        self.forced = []  # `Forced_noise` engines of forced cycle
+        self.skipped_cycles = 0  # statistics
+        self.jumps = 0
+        _, _, _, ack_delay = self.cycle()
+        assert node_tx.L2.timeout > ack_delay, \
+            f"Timeout ({node_tx.L2.timeout}) must be longer than ACK delay ({ack_delay}) for fast forward."
+
+    def cycle(self):
+        """Return `(L_d, L_a, T, ack_delay)`: data and ACK frame sizes on channel, duration of a clean
+            cycle and delay from end of data transmission to ACK reception."""
+        L_d = self.node_tx.L3.packet_size+1+self.node_tx.L1.checker.divisor_len
+        L_a = ACK_SIZE+self.node_rx.L1.checker.divisor_len
+        ack_delay = self.chann_tx.D_p+L_a/self.chann_rx.R_T+self.chann_rx.D_p
+        return L_d, L_a, L_d/self.chann_tx.R_T+ack_delay, ack_delay
+
+    def at_cycle_start(self, elem_ind:int) -> bool:
+        """Return whether nearest event (of element `elem_ind`) starts a new cycle."""
+        node_tx = self.node_tx
+        if self.simulator.elements[elem_ind] is not node_tx:
+            return False
+        queue = node_tx.event_queue
+        return (queue.size == 1 and queue.queue[0][2][1] is DL_START and not self.node_rx.event_queue.size
+                and not self.chann_tx.event_queue.size and not self.chann_rx.event_queue.size
+                and node_tx.L2.next_frame_to_send == self.node_rx.L2.frame_expexcted)
+
+    def draw_clean_cycles(self, q:float) -> float:
+        """Number of clean cycles before first erroneous one. `q`: probability of clean cycle."""
+        if q >= 1:
+            return float('inf')
+        if q <= 0:
+            return 0
+        return floor(log(1-self.rng.random())/log(q))  # P(K >= k) = q^k
+
+    def jump(self, t_end):
+        """Skip clean cycles that start at nearest event (`DL start` of Tx) and force next cycle."""
+        L_d, L_a, T, _ = self.cycle()
+        noise_tx, noise_rx = self.chann_tx.noise, self.chann_rx.noise
+        P_d = noise_tx.frame_error_prob(L_d)
+        P_a = noise_rx.frame_error_prob(L_a)
+        queue = self.node_tx.event_queue
+        t_start = queue.nearest_event_time()
+        K = self.draw_clean_cycles((1-P_d)*(1-P_a))
+        K_max = floor((t_end-t_start)/T)  # whole cycles before `t_end`
+        if K > K_max:
+            K, force = K_max, 'clean'
+        else:
+            force = 'error'
+        if K:
+            self.apply_cycles(K, t_start, T, L_d)
+        # Force next cycle
+        if force == 'clean':
+            self.forced = [Forced_noise(self.chann_tx, 'clean'), Forced_noise(self.chann_rx, 'clean')]
+        elif self.rng.random()*(1-(1-P_d)*(1-P_a)) < P_d:  # data frame has error, ACK (if any) as usual
+            self.forced = [Forced_noise(self.chann_tx, 'error')]
+        else:  # only ACK has error
+            self.forced = [Forced_noise(self.chann_tx, 'clean'), Forced_noise(self.chann_rx, 'error')]
+        self.forced_pending = True
+
+    def apply_cycles(self, K:int, t_start:float, T:float, L_d:int):
+        """Apply `K` clean cycles that start at `t_start`: final state of link after them."""
+        Tx, Rx = self.node_tx.L2, self.node_rx.L2
+        self.node_rx.L3.counter += K
+        if K & 1:
+            Tx.next_frame_to_send = 1-Tx.next_frame_to_send
+            Rx.frame_expexcted = 1-Rx.frame_expexcted
+        if Tx.buffer_packet:  # first packet is delivered (e.g. retransmitted one), later ones are skipped
+            Tx.pop_buffer()
+        t_next = t_start+K*T
+        Tx.spare_time = self.chann_tx.spare_time = t_next-T+L_d/self.chann_tx.R_T
+        Rx.spare_time = self.chann_rx.spare_time = t_next-self.chann_rx.D_p
+        event = self.node_tx.event_queue.pop_event()
+        self.node_tx.add_event((t_next, event[1], event[2]))
+        self.skipped_cycles += K
+        self.jumps += 1
+
+    def run(self, t_end, t_start=0) -> None:
+        """Like `Simulator.run` but skip clean cycles of link."""
+        simulator = self.simulator
+        simulator.time = t_start
+        simulator.init_schedule()
+        while simulator.time <= t_end:
+            elem_ind, _ = simulator.nearest_event()
+            if self.at_cycle_start(elem_ind):
+                if self.forced_pending:
+                    self.forced_pending = False  # forced cycle starts now
+                else:
+                    self.jump(t_end)
+                    continue  # `DL start` may have moved
+            simulator.step()
+        for forced in self.forced:  # forced cycle may not be finished at `t_end`
+            forced.release()
+        self.forced = []
+
+
+if __name__ == '__main__':
+    import time
+    from sweep import build_stop_wait, frame_size
+    point = {'p': 1e-4, 'R_T': 1e6, 'D_p': 1e-3, 'divisor': 0xB, 'packet_size': 96}
+    t_end = 200
+    for fast in (False, True):
+        simulator = Simulator(1)
+        node_tx, node_rx = build_stop_wait(simulator, **point)
+        t0 = time.time()
+        if fast:
+            Stop_Wait_Fast_Forward(simulator, node_tx, node_rx).run(t_end)
+        else:
+            simulator.run(t_end)
+        utilization = node_rx.L3.counter*frame_size({**point, 'arq': 'stop_wait', 'N_window': 1})/point['R_T']/t_end
+        print(f"fast forward: {fast}, utilization: {utilization:.5f}, run time: {time.time()-t0:.3f} s")
@@ -0,0 +1,375 @@
+# Opt-in instrumentation: streaming metrics and binary trace
+from collections import Counter
+from math import frexp, ldexp, sqrt, inf
+from struct import Struct
+
+from Layers import Node, Channel, Frame, SAP_data
+
+# Trace record: (timestamp, kind, element index, value). Little endian, 22 bytes.
+TRACE_RECORD = Struct('<dHId')
+TRACE_KINDS = ('inject', 'recv clean', 'recv detected', 'recv undetected', 'timeout', 'deliver', 'erased')
+_KIND_CODES = {kind: code for code, kind in enumerate(TRACE_KINDS)}
+SAP_METHODS = ('from_L1_to_chann', 'from_chann_to_L1', 'from_L1_to_L2', 'from_L2_to_L1', 'from_L2_to_L3', 'from_L3_to_L2')
+
+
+class Online_stats:
+    """Streaming mean/variance (Welford), min and max of values. O(1) memory."""
+    __slots__ = ('n', 'mean', 'M2', 'min', 'max')
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean = 0.0
+        self.M2 = 0.0  # sum of squared deviations from mean
+        self.min = inf
+        self.max = -inf
+
+    def add(self, x):
+        self.n += 1
+        delta = x-self.mean
+        self.mean += delta/self.n
+        self.M2 += delta*(x-self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def merge(self, other):
+        """Add all values of `other` (e.g. stats of another replication). Chan et al. parallel formula."""
+        if other.n == 0:
+            return
+        n = self.n+other.n
+        delta = other.mean-self.mean
+        self.mean += delta*other.n/n
+        self.M2 += other.M2+delta*delta*self.n*other.n/n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        """Sample variance."""
+        return self.M2/(self.n-1) if self.n > 1 else float('nan')
+
+    @property
+    def std(self) -> float:
+        return sqrt(self.variance)
+
+    def to_dict(self) -> dict:
+        return {'n': self.n, 'mean': self.mean if self.n else float('nan'), 'std': self.std,
+                'min': self.min, 'max': self.max}
+
+
+class Log_histogram:
+    """HDR-style histogram of positive values: buckets are powers of 2 split into `sub_buckets` linear
+        sub-buckets, so relative error of quantiles is below `1/sub_buckets` for any value range.
+        Memory is bounded by number of used buckets (`sub_buckets` per octave), not by number of values."""
+
+    def __init__(self, sub_buckets=64) -> None:
+        self.sub_buckets = sub_buckets
+        self.buckets = {}  # bucket index -> count
+        self.count = 0
+        self.zeros = 0  # values <= 0
+
+    def bucket(self, x) -> int:
+        """Index of bucket that contains `x` > 0."""
+        mantissa, exponent = frexp(x)  # x = mantissa*2^exponent, mantissa in [0.5, 1)
+        return exponent*self.sub_buckets+int((2*mantissa-1)*self.sub_buckets)
+
+    def bucket_value(self, index:int) -> float:
+        """Middle value of bucket `index`."""
+        exponent, sub = divmod(index, self.sub_buckets)
+        return ldexp(0.5*(1+(sub+0.5)/self.sub_buckets), exponent)
+
+    def add(self, x, count=1):
+        self.count += count
+        if x <= 0:
+            self.zeros += count
+            return
+        index = self.bucket(x)
+        self.buckets[index] = self.buckets.get(index, 0)+count
+
+    def merge(self, other):
+        assert other.sub_buckets == self.sub_buckets, "Histograms must have same resolution."
+        self.count += other.count
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0)+count
+
+    def quantile(self, q:float) -> float:
+        """Approximate `q` quantile (0 <= q <= 1)."""
+        if self.count == 0:
+            return float('nan')
+        rank = q*(self.count-1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return self.bucket_value(index)
+        return self.bucket_value(max(self.buckets))
+
+    def to_dict(self, quantiles=(0.5, 0.9, 0.99)) -> dict:
+        return {'n': self.count, **{f'p{100*q:g}': self.quantile(q) for q in quantiles}}
+
+
+class Trace_writer:
+    """Binary trace of `TRACE_RECORD` records written to `file` in chunks of `chunk_size` records,
+        so memory does not grow with run length."""
+
+    def __init__(self, file, chunk_size=1<<16) -> None:
+        """`file`: path or binary file object."""
+        self.own_file = isinstance(file, str)
+        self.file = open(file, 'wb') if self.own_file else file
+        self.buffer = bytearray(chunk_size*TRACE_RECORD.size)
+        self.offset = 0
+        self.n_records = 0
+
+    def write(self, timestamp:float, kind:str, element:int, value=0.0):
+        TRACE_RECORD.pack_into(self.buffer, self.offset, timestamp, _KIND_CODES[kind], element, value)
+        self.offset += TRACE_RECORD.size
+        self.n_records += 1
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.file.write(memoryview(self.buffer)[:self.offset])
+        self.offset = 0
+
+    def close(self):
+        self.flush()
+        if self.own_file:
+            self.file.close()
+
+
+def read_trace(file, chunk_size=1<<16):
+    """Iterate over `(timestamp, kind, element, value)` records of a trace file (path). Reads in chunks."""
+    with open(file, 'rb') as trace:
+        while True:
+            chunk = trace.read(chunk_size*TRACE_RECORD.size)
+            if not chunk:
+                return
+            for timestamp, kind, element, value in TRACE_RECORD.iter_unpack(chunk):
+                yield timestamp, TRACE_KINDS[kind], element, value
+
+
+class Recorder:
+    """Instrumentation of a `Simulator`. `attach` wraps methods of its elements (instance attributes),
+        `detach` restores them, so a simulator without recorder runs exactly the original code.
+
+        Hooks: SAP methods of `Node` (`from_*`), `Channel.inject_chann`/`recv_chann`, DL `timeout_func`,
+        DL `start_timer` (one per data frame sent) and DL `call_from_L1` of senders (ACK path).
+        Metrics (all O(1) memory per element):
+            `counters`: `(name, element index)` -> count, e.g. `('L3->L2', 0)`, `('recv undetected', 2)`.
+            `stats`: `Online_stats` e.g. `('bit errors', channel)`.
+            `histograms`: `Log_histogram` e.g. `('delay', Rx Node)` (L3 of Tx to L3 of Rx).
+            `busy_time`: transmission time of each channel (occupancy = busy time/sim time).
+        Element index is index of element in `Simulator.elements`. Cycles skipped by fast forward are not seen."""
+
+    def __init__(self, trace=None, chunk_size=1<<16, max_pending=1<<16) -> None:
+        """`trace`: optional trace file (path or binary file object), see `Trace_writer`.
+            `max_pending`: max number of packets in flight that are tracked for delay (oldest is dropped)."""
+        self.counters = Counter()
+        self.stats = {}
+        self.histograms = {}
+        self.busy_time = Counter()
+        self.trace = None if trace is None else Trace_writer(trace, chunk_size)
+        self.max_pending = max_pending
+        self.pending = {}  # packet bits -> generation time
+        self.receiving = None  # [channel index, sent PDU, received PDU, passed CRC] of current reception
+        self.hooks = []  # (obj, name, original, own attribute, replaced handler tables)
+        self.simulator = None
+
+    def attach(self, simulator):
+        """Hook all `Node`s and `Channel`s of `simulator`. Attach after network is built."""
+        assert self.simulator is None, "Recorder is already attached."
+        self.simulator = simulator
+        for index, elem in enumerate(simulator.elements):
+            if isinstance(elem, Node):
+                self.attach_node(elem, index)
+            elif isinstance(elem, Channel):
+                self.attach_channel(elem, index)
+        return self
+
+    def detach(self):
+        """Remove hooks and flush trace."""
+        for obj, name, original, own, tables in reversed(self.hooks):
+            if own:
+                setattr(obj, name, original)
+            else:
+                delattr(obj, name)
+            for table, key in tables:
+                table[key] = original
+        self.hooks = []
+        self.simulator = None
+        if self.trace is not None:
+            self.trace.close()
+
+    def hook(self, obj, name:str, before=None, after=None):
+        """Wrap method `name` of `obj`: `before(*args)` runs before it and `after(result, *args)` after it.
+            Handler tables (`obj.handlers`, `obj.Node.handlers`) that contain the method are updated too."""
+        original = getattr(obj, name)
+        if after is None:
+            def wrapper(*args):
+                before(*args)
+                return original(*args)
+        elif before is None:
+            def wrapper(*args):
+                result = original(*args)
+                after(result, *args)
+                return result
+        else:
+            def wrapper(*args):
+                before(*args)
+                result = original(*args)
+                after(result, *args)
+                return result
+        tables = []
+        for table in (getattr(obj, 'handlers', None), getattr(getattr(obj, 'Node', None), 'handlers', None)):
+            if isinstance(table, dict):
+                for key, handler in table.items():
+                    if handler == original:
+                        table[key] = wrapper
+                        tables.append((table, key))
+        self.hooks.append((obj, name, original, name in vars(obj), tables))
+        setattr(obj, name, wrapper)
+
+    def count(self, name, element, n=1):
+        self.counters[(name, element)] += n
+
+    def add_stat(self, name, element, x):
+        stats = self.stats.get((name, element))
+        if stats is None:
+            stats = self.stats[(name, element)] = Online_stats()
+        stats.add(x)
+
+    def add_histogram(self, name, element, x):
+        histogram = self.histograms.get((name, element))
+        if histogram is None:
+            histogram = self.histograms[(name, element)] = Log_histogram()
+        histogram.add(x)
+
+    def record(self, kind, element, value=0.0):
+        """Write a trace record (if trace is enabled)."""
+        if self.trace is not None:
+            self.trace.write(self.simulator.time, kind, element, value)
+
+    # Node hooks
+    def attach_node(self, node:Node, index:int):
+        for method in SAP_METHODS:
+            name = method[5:].replace('_to_', '->')  # e.g. 'L3->L2'
+            self.hook(node, method, before=lambda *args, name=name: self.count(name, index))
+        self.hook(node, 'from_L3_to_L2', before=self.packet_generated)
+        self.hook(node, 'from_L2_to_L3', before=lambda IDU: self.packet_delivered(IDU, index))
+        self.hook(node, 'from_chann_to_L1', before=self.frame_received)
+        self.hook(node, 'from_L1_to_L2', before=self.frame_passed)
+        DL = node.L2
+        if DL is None:
+            return
+        if hasattr(DL, 'timeout_func'):
+            self.hook(DL, 'timeout_func', before=lambda seq_nr: self.timeout(index, seq_nr))
+        if hasattr(DL, 'start_timer'):  # ACK frames (e.g. of `Go_BackN_Duplex`) have no frame timer
+            self.hook(DL, 'start_timer', before=lambda *args: self.count('data frames', index))
+        if hasattr(node.L3, 'send_packet'):  # sender: L2 receives ACK/NAK frames
+            self.hook(DL, 'call_from_L1', before=lambda IDU: self.count('ack frames', index))
+
+    def packet_generated(self, IDU):
+        IDU = SAP_data.of(IDU)
+        if IDU.SDU is not None or IDU.PDU is None:
+            return
+        pending = self.pending
+        if len(pending) >= self.max_pending:
+            del pending[next(iter(pending))]  # drop oldest
+        pending[IDU.PDU.frame] = self.simulator.time
+
+    def packet_delivered(self, IDU, index):
+        IDU = SAP_data.of(IDU)
+        if IDU.SDU is not None:
+            return
+        t_gen = self.pending.pop(IDU.PDU.frame, None)
+        if t_gen is None:  # e.g. undetected error in payload
+            self.count('unmatched deliveries', index)
+            return
+        if IDU.PDU.t_gen is not None:  # traffic sources: time spent in L3 backlog counts too
+            t_gen = IDU.PDU.t_gen
+        delay = self.simulator.time-t_gen
+        self.add_histogram('delay', index, delay)
+        self.add_stat('delay', index, delay)
+        self.record('deliver', index, delay)
+
+    def frame_received(self, PDU):
+        if self.receiving is not None:
+            self.receiving[2] = Frame.of(PDU)
+
+    def frame_passed(self, IDU):
+        if self.receiving is not None:
+            self.receiving[3] = True
+
+    def timeout(self, index, seq_nr):
+        self.count('timeout', index)
+        self.record('timeout', index, seq_nr)
+
+    # Channel hooks
+    def attach_channel(self, channel:Channel, index:int):
+        self.hook(channel, 'inject_chann', after=lambda t_done, PDU: self.frame_injected(channel, index, PDU))
+        self.hook(channel, 'recv_chann', before=lambda PDU: self.start_receiving(index, PDU),
+                  after=lambda result, PDU: self.end_receiving())
+
+    def frame_injected(self, channel, index, PDU):
+        PDU = Frame.of(PDU)
+        self.count('inject', index)
+        self.busy_time[index] += PDU.frame_size/channel.R_T
+        self.record('inject', index, PDU.frame_size)
+
+    def start_receiving(self, index, PDU):
+        self.receiving = [index, PDU, None, False]  # received PDU is set when channel passes frame to PHY
+
+    def end_receiving(self):
+        index, sent, received, passed = self.receiving
+        self.receiving = None
+        if received is None:  # erased by channel (e.g. `Erasure_noise`): PHY never saw it
+            self.count('erased', index)
+            self.record('erased', index)
+            return
+        bit_errors = (sent.frame ^ received.frame).bit_count()
+        self.add_stat('bit errors', index, bit_errors)
+        if bit_errors == 0:
+            kind = 'recv clean'
+        else:
+            kind = 'recv undetected' if passed else 'recv detected'
+        self.count(kind, index)
+        self.record(kind, index, bit_errors)
+
+    def summary(self) -> dict:
+        """Flat dict of all metrics: `'name[element]'` -> value (stats and histograms are expanded)."""
+        out = {f'{name}[{elem}]': value for (name, elem), value in sorted(self.counters.items())}
+        elapsed = self.simulator.time if self.simulator is not None else 0
+        for elem, busy in sorted(self.busy_time.items()):
+            out[f'busy time[{elem}]'] = busy
+            if elapsed > 0:
+                out[f'occupancy[{elem}]'] = busy/elapsed
+        for (name, elem), count in sorted(self.counters.items()):  # DL retransmissions: data frames - new packets
+            if name == 'data frames':
+                out[f'retransmissions[{elem}]'] = count-self.counters[('L3->L2', elem)]
+        for (name, elem), stats in sorted(self.stats.items()):
+            out.update({f'{name} {key}[{elem}]': value for key, value in stats.to_dict().items()})
+        for (name, elem), histogram in sorted(self.histograms.items()):
+            out.update({f'{name} {key}[{elem}]': value for key, value in histogram.to_dict().items() if key != 'n'})
+        return out
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    from simulator import Simulator
+    from sweep import build_stop_wait
+    simulator = Simulator(1)
+    build_stop_wait(simulator, p=1e-3, R_T=1e6, D_p=1e-3, divisor=0xB, packet_size=96)
+    path = os.path.join(tempfile.mkdtemp(), 'trace.bin')
+    recorder = Recorder(trace=path).attach(simulator)
+    simulator.run(2)
+    summary = recorder.summary()
+    recorder.detach()
+    for key, value in summary.items():
+        print(f'{key}: {value}')
+    print('trace records:', sum(1 for _ in read_trace(path)))
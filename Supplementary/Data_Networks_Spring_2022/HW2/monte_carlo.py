@@ -0,0 +1,137 @@
+# Batch (NumPy) Monte Carlo backend of Stop and Wait over BSC
+import numpy as np
+
+from CRC import syndrome_table
+from noise import BSC_noise
+from simulator import Seed_sequence
+
+ACK_SIZE = 8+1  # ACK frame of `Stop_Wait_Rx`: ACK_header + seq_nr (without CRC)
+MAX_BLOCK = 1<<20  # attempts per block (memory bound)
+
+
+def compose_scan(image0, image1):
+    """Inclusive prefix composition of maps on {0, 1}. Map `i` sends 0 -> `image0[i]`, 1 -> `image1[i]`.
+        Return images of `map_i o ... o map_0` for each `i` (Hillis-Steele scan: log2(n) vectorized steps)."""
+    image0, image1 = image0.copy(), image1.copy()
+    n = len(image0)
+    step = 1
+    while step < n:
+        prev0, prev1 = image0[:-step], image1[:-step]  # map_{i-step} o ... (earlier maps)
+        cur0, cur1 = image0[step:], image1[step:]
+        image0[step:], image1[step:] = np.where(prev0, cur1, cur0), np.where(prev1, cur1, cur0)
+        step <<= 1
+    return image0, image1
+
+
+def child_generators(rng, n:int) -> list:
+    """`n` independent NumPy `Generator`s derived from `rng` (`Seed_sequence`, `Generator` or seed).
+        Same streams as `Generator.spawn`, which NumPy < 1.25 does not have."""
+    if isinstance(rng, Seed_sequence):
+        return [child.numpy_rng() for child in rng.spawn(n)]
+    if isinstance(rng, np.random.Generator):
+        seed_seq = rng.bit_generator._seed_seq  # public `seed_seq` since NumPy 1.25
+    else:
+        seed_seq = np.random.SeedSequence(rng)
+    return [np.random.default_rng(child) for child in seed_seq.spawn(n)]
+
+
+class Stop_Wait_Batch:
+    """Stop and Wait link of `DL_simul.ipynb` (`sweep.build_stop_wait`) simulated as arrays of attempts.
+
+        An attempt is one data frame transmission. Its fate depends only on its error masks:
+        data frame is lost (CRC detects error) or received with seq_nr flipped or not (undetected error),
+        ACK is lost (detected error or corrupted header) or received with seq_nr flipped or not.
+        CRC check is vectorized with `syndrome_table`: remainder of a frame is XOR of syndromes of its errors.
+        Given `sigma = next_frame_to_send ^ frame_expected`, an attempt delivers a packet, advances Tx
+        and maps `sigma` to a new value. Maps of all attempts are composed by a parallel prefix scan,
+        so `sigma` before each attempt (and everything else) is computed without a Python loop.
+        Advancing attempts take `L_d/R_T + 2*D_p + L_a/R_T`, others `L_d/R_T + timeout`.
+        Timeout must be longer than ACK delay (otherwise ACK and timeout race, use event-driven `Simulator`).
+
+        Metrics match `Simulator` runs: packets of attempts that start until `t_end` are counted (the first
+        event after `t_end`, which `Simulator.run` still runs, is the data frame of the last attempt)."""
+
+    def __init__(self, p, R_T, D_p, divisor, packet_size, timeout) -> None:
+        """Parameters of both channels and Nodes like `sweep.build_stop_wait`."""
+        self.p, self.R_T, self.D_p = p, R_T, D_p
+        self.r = divisor.bit_length()-1  # CRC size
+        self.L_d = packet_size+1+self.r  # data frame: payload + seq_nr + CRC
+        self.L_a = ACK_SIZE+self.r  # ACK frame: ACK_header + seq_nr + CRC
+        self.syndromes_d = np.array(syndrome_table(divisor, self.L_d), dtype=np.uint64)
+        self.syndromes_a = np.array(syndrome_table(divisor, self.L_a), dtype=np.uint64)
+        self.T_ack = self.L_d/R_T+2*D_p+self.L_a/R_T  # attempt that is ACKed
+        self.T_timeout = self.L_d/R_T+timeout  # attempt that times out
+        self.timeout = timeout
+        ack_delay = 2*D_p+self.L_a/R_T
+        assert timeout > ack_delay, f"Timeout ({timeout}) must be longer than ACK delay ({ack_delay})."
+
+    def frame_fates(self, noise:BSC_noise, n:int, frame_size:int, syndromes):
+        """Draw errors of `n` frames. Return `(lost, flip, header_err)` bool arrays: CRC detected error,
+            undetected error flipped seq_nr (bit `r`), undetected error in bits above seq_nr."""
+        frame_ind, bit_ind = noise.error_positions((n, frame_size))
+        syndrome = np.zeros(n, dtype=np.uint64)
+        np.bitwise_xor.at(syndrome, frame_ind, syndromes[bit_ind])
+        lost = syndrome != 0
+        flip = np.zeros(n, dtype=bool)
+        flip[frame_ind[bit_ind == self.r]] = True
+        header_err = np.zeros(n, dtype=bool)
+        header_err[frame_ind[bit_ind > self.r]] = True
+        return lost, flip & ~lost, header_err & ~lost
+
+    def attempts(self, noise_tx:BSC_noise, noise_rx:BSC_noise, n:int, sigma:int):
+        """Simulate `n` attempts that start with `sigma`. Return `(deliver, advance, sigma_after)`."""
+        d_lost, d_flip, _ = self.frame_fates(noise_tx, n, self.L_d, self.syndromes_d)
+        a_lost, a_flip, a_header = self.frame_fates(noise_rx, n, self.L_a, self.syndromes_a)
+        a_lost |= a_header  # Tx drops non-ACK frames
+        # Rx delivers iff received seq_nr == frame_expected iff d_flip == sigma. Tx advances iff ACK seq_nr
+        # (1-frame_expected, maybe flipped) == next_frame_to_send iff sigma (after delivery) == 1-a_flip.
+        deliver, advance, image = [], [], []
+        for s in (0, 1):
+            deliver_s = ~d_lost & (d_flip == bool(s))
+            sigma_s = deliver_s ^ bool(s)
+            advance_s = ~d_lost & ~a_lost & (sigma_s != a_flip)
+            deliver.append(deliver_s)
+            advance.append(advance_s)
+            image.append(sigma_s ^ advance_s)
+        after0, after1 = compose_scan(image[0], image[1])
+        sigma_after = after1 if sigma else after0  # sigma after each attempt
+        sigma_before = np.concatenate(([bool(sigma)], sigma_after[:-1]))
+        deliver = np.where(sigma_before, deliver[1], deliver[0])
+        advance = np.where(sigma_before, advance[1], advance[0])
+        return deliver, advance, int(sigma_after[-1])
+
+    def run(self, t_end, rng=None) -> dict:
+        """Simulate until `t_end`. `rng`: `Seed_sequence`, NumPy `Generator` or seed (see `child_generators`).
+            Return `{'delivered', 'attempts'}`."""
+        rng_tx, rng_rx = child_generators(rng, 2)
+        noise_tx = BSC_noise(self.p, np_rng=rng_tx)
+        noise_rx = BSC_noise(self.p, np_rng=rng_rx)
+        t, sigma, delivered, n_attempts = 0.0, 0, 0, 0
+        while t <= t_end:
+            n = int(min(MAX_BLOCK, (t_end-t)/self.T_ack+64))
+            deliver, advance, sigma_next = self.attempts(noise_tx, noise_rx, n, sigma)
+            ends = t+np.cumsum(np.where(advance, self.T_ack, self.T_timeout))
+            starts = np.concatenate(([t], ends[:-1]))
+            n_run = int(np.searchsorted(starts, t_end, side='right'))  # attempts that start until `t_end`
+            delivered += int(np.count_nonzero(deliver[:n_run]))
+            n_attempts += n_run
+            if n_run < n:
+                break
+            t, sigma = float(ends[-1]), sigma_next
+        return {'delivered': delivered, 'attempts': n_attempts}
+
+
+if __name__ == '__main__':
+    # Cross check with event-driven simulator and theory
+    import statistics
+    from simulator import Seed_sequence
+    from sweep import run_replication, theory, frame_size, auto_timeout, GRID_DEFAULTS
+    t_end, reps = 2, 40
+    for p in (1e-4, 1e-3, 5e-3):
+        point = {name: values[0] for name, values in GRID_DEFAULTS.items()}
+        point['p'] = p
+        seeds = Seed_sequence(0).spawn(reps)
+        event = [run_replication(point, seed, t_end)['utilization'] for seed in seeds]
+        batch = [run_replication(point, seed, t_end, backend='batch')['utilization'] for seed in seeds]
+        print(f"p={p}: event {statistics.fmean(event):.5f} +- {statistics.stdev(event):.5f}, "
+              f"batch {statistics.fmean(batch):.5f} +- {statistics.stdev(batch):.5f}, theory {theory(point)['theory_noisy']:.5f}")
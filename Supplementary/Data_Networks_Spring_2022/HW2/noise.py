@@ -0,0 +1,247 @@
+# Channel noise engines
+from abc import ABC, abstractmethod
+from math import log, log1p, expm1, inf
+import random as _random
+
+
+class Noise_model(ABC):
+    """Interface of channel models (noise engines of `Layers.Channel`). Models must implement `error_mask`.
+        `error_mask(frame_size)`: error mask of next frame (integer, bit `i` is 1 if bit `i` flips), or `None`
+            if frame is lost (erased). Frames are drawn in order of reception, so models may keep state.
+        `p`: mean bit error probability.
+        `rng`: `random.Random` stream of model (set by `Channel.bind_sim`, replaced by `Simulator.reseed`).
+        `np_rng`: NumPy generator of batch mode (`None`: created from `rng` on first use)."""
+
+    rng = _random
+    np_rng = None
+
+    @abstractmethod
+    def error_mask(self, frame_size:int):
+        """Error mask of next frame of `frame_size` bits, `None` if it is erased."""
+
+
+def bernoulli_mask(random, p, log_q, n:int) -> int:
+    """Error mask of `n` bits that flip independently with probability `p` (`log_q` = log(1-p)).
+        Gaps between errors are geometric: O(errors+1) draws of `random()`."""
+    if p <= 0 or n <= 0:
+        return 0
+    if p >= 1:
+        return (1<<n)-1
+    mask = 0
+    pos = int(log(1-random())/log_q)  # 1-random() in (0, 1]
+    while pos < n:
+        mask |= 1<<pos
+        pos += 1+int(log(1-random())/log_q)
+    return mask
+
+
+class BSC_noise(Noise_model):
+    """Binary symmetric channel (BSC) noise: each bit of frame flips independently with probability `p`.
+        Instead of one random draw per bit, gaps between errors are drawn from geometric distribution 
+        (number of clean bits before next error), so an error mask costs O(errors+1) random draws.
+        
+        Error masks are integers: bit `i` of mask is 1 if bit `i` of frame flips (frame ^ mask)."""
+    
+    def __init__(self, p, rng=None, np_rng=None) -> None:
+        """`p`: bit error probability
+            `rng`: random generator with `random()` method e.g. `random.Random(seed)` (default: `random` module)
+            `np_rng`: NumPy `Generator` for batch mode (default: created on first use from `rng`)"""
+        self.p = p
+        self.rng = _random if rng is None else rng
+        self.np_rng = np_rng
+        self.log_q_p = None  # (p, log(1-p)) cache
+    
+    def log_q(self):
+        """Return log(1-p). Cached while `p` does not change."""
+        if self.log_q_p is None or self.log_q_p[0] != self.p:
+            self.log_q_p = (self.p, log(1-self.p))
+        return self.log_q_p[1]
+    
+    def error_mask(self, frame_size:int) -> int:
+        """Return error mask of one frame with `frame_size` bits."""
+        p = self.p
+        if p <= 0:
+            return 0
+        return bernoulli_mask(self.rng.random, p, self.log_q() if p < 1 else None, frame_size)
+    
+    def frame_error_prob(self, frame_size:int) -> float:
+        """Probability that a frame with `frame_size` bits has at least one error."""
+        return -expm1(frame_size*log1p(-self.p)) if self.p < 1 else float(frame_size > 0)
+    
+    def error_mask_given_error(self, frame_size:int) -> int:
+        """Return error mask of one frame with `frame_size` bits, given that it has at least one error.
+            First error position is drawn from the truncated geometric distribution, later bits are 
+            independent like `error_mask`."""
+        p = self.p
+        assert p > 0 and frame_size > 0, "Frame can not have an error."
+        if p >= 1:
+            return (1<<frame_size)-1
+        u = self.rng.random()*self.frame_error_prob(frame_size)  # P(first error < pos) = 1-(1-p)^pos
+        pos = min(int(log1p(-u)/self.log_q()), frame_size-1)
+        return 1<<pos | self.error_mask(frame_size-pos-1)<<(pos+1)
+    
+    def get_np_rng(self):
+        """Return NumPy generator of batch mode. NumPy is imported only here."""
+        if self.np_rng is None:
+            import numpy as np
+            self.np_rng = np.random.default_rng(self.rng.getrandbits(128))
+        return self.np_rng
+    
+    def error_positions(self, frame_sizes):
+        """Batch mode: draw errors of many frames at once.
+            `frame_sizes`: sequence of frame sizes (or `(n_frames, frame_size)` tuple for fixed size frames)
+            Return `(frame_ind, bit_ind)` NumPy arrays: bit `bit_ind[k]` of frame `frame_ind[k]` flips."""
+        import numpy as np
+        rng = self.get_np_rng()
+        if isinstance(frame_sizes, tuple):
+            n_frames, frame_size = frame_sizes
+            total = n_frames*frame_size
+        else:
+            frame_sizes = np.asarray(frame_sizes, dtype=np.int64)
+            ends = np.cumsum(frame_sizes)
+            total = int(ends[-1]) if len(ends) else 0
+        p = self.p
+        if p <= 0 or total == 0:
+            pos = np.empty(0, dtype=np.int64)
+        elif p >= 1:
+            pos = np.arange(total, dtype=np.int64)
+        else:
+            # All frames form one bit stream: positions of errors are cumulative sums of geometric gaps.
+            pos = []
+            last = -1
+            block = max(16, int(total*p*1.1)+16)
+            while last < total:
+                gaps = rng.geometric(p, size=block)  # gap >= 1
+                block_pos = last+np.cumsum(gaps)
+                last = int(block_pos[-1])
+                pos.append(block_pos)
+            pos = np.concatenate(pos)
+            pos = pos[pos < total]
+        if isinstance(frame_sizes, tuple):
+            return pos//frame_size, pos % frame_size
+        frame_ind = np.searchsorted(ends, pos, side='right')
+        starts = ends-frame_sizes
+        return frame_ind, pos-starts[frame_ind]
+    
+    def error_masks(self, frame_sizes, packed=False):
+        """Batch mode: error masks of many frames. See `error_positions`.
+            Return list of integer masks, or if `packed`, a NumPy uint8 array with one row per frame 
+            that contains big-endian bytes of mask (`mask.to_bytes(n_bytes, 'big')`)."""
+        import numpy as np
+        frame_ind, bit_ind = self.error_positions(frame_sizes)
+        if isinstance(frame_sizes, tuple):
+            n_frames, max_size = frame_sizes
+        else:
+            n_frames, max_size = len(frame_sizes), (max(frame_sizes) if len(frame_sizes) else 0)
+        if packed:
+            n_bytes = (max_size+7)//8
+            out = np.zeros((n_frames, n_bytes), dtype=np.uint8)
+            np.bitwise_or.at(out, (frame_ind, n_bytes-1-bit_ind//8), (1<<(bit_ind % 8)).astype(np.uint8))
+            return out
+        masks = [0]*n_frames
+        for frame, bit in zip(frame_ind.tolist(), bit_ind.tolist()):
+            masks[frame] |= 1<<bit
+        return masks
+
+
+class Gilbert_Elliott_noise(Noise_model):
+    """Gilbert-Elliott burst noise: a two state (good/bad) Markov chain over bits. In each bit, state
+        changes with probability `p_gb` (good -> bad) or `p_bg` (bad -> good), and the bit flips with
+        probability `e_good` or `e_bad` of current state (Gilbert model: `e_good=0`, `e_bad=0.5`).
+
+        Sojourn in a state is geometric, so instead of one draw per bit, the remaining length of current
+        run is drawn once (closed form) and kept between frames: a frame inside one run costs one
+        `bernoulli_mask` (O(errors+1) draws). Chain advances over transmitted bits only (idle time of
+        channel does not change state). Initial state is drawn from the stationary distribution."""
+
+    def __init__(self, p_gb, p_bg, e_good=0., e_bad=0.5, rng=None) -> None:
+        assert 0 <= p_gb <= 1 and 0 <= p_bg <= 1 and p_gb+p_bg > 0, "Invalid transition probabilities."
+        self.p_gb, self.p_bg = p_gb, p_bg
+        self.e_good, self.e_bad = e_good, e_bad
+        if rng is not None:
+            self.rng = rng
+        self.bad = None  # current state (`None`: not drawn yet)
+        self.run_left = 0  # bits left in current state
+        self.logs = None  # (parameters, log(1-x) of each) cache
+
+    @property
+    def pi_bad(self) -> float:
+        """Stationary probability of bad state."""
+        return self.p_gb/(self.p_gb+self.p_bg)
+
+    @property
+    def p(self) -> float:
+        """Mean bit error probability (stationary)."""
+        return (1-self.pi_bad)*self.e_good+self.pi_bad*self.e_bad
+
+    @property
+    def mean_burst(self) -> float:
+        """Mean length of bad state runs (bits)."""
+        return 1/self.p_bg if self.p_bg > 0 else inf
+
+    def get_logs(self):
+        """Return `(log(1-p_gb), log(1-p_bg), log(1-e_good), log(1-e_bad))`. Cached while parameters do not change."""
+        params = (self.p_gb, self.p_bg, self.e_good, self.e_bad)
+        if self.logs is None or self.logs[0] != params:
+            self.logs = (params, tuple(log1p(-x) if x < 1 else -inf for x in params))
+        return self.logs[1]
+
+    def sojourn(self, p_leave, log_stay) -> float:
+        """Draw length of a run (>= 1 bits) of a state that is left with probability `p_leave` per bit."""
+        if p_leave <= 0:
+            return inf
+        if p_leave >= 1:
+            return 1
+        return 1+int(log(1-self.rng.random())/log_stay)
+
+    def error_mask(self, frame_size:int) -> int:
+        log_gg, log_bb, log_qg, log_qb = self.get_logs()
+        random = self.rng.random
+        if self.bad is None:
+            self.bad = random() < self.pi_bad
+            self.run_left = self.sojourn(self.p_bg, log_bb) if self.bad else self.sojourn(self.p_gb, log_gg)
+        mask = 0
+        pos = 0
+        while pos < frame_size:
+            if self.run_left <= 0:  # state changes
+                self.bad = not self.bad
+                self.run_left = self.sojourn(self.p_bg, log_bb) if self.bad else self.sojourn(self.p_gb, log_gg)
+            n = min(self.run_left, frame_size-pos)
+            if self.bad:
+                mask |= bernoulli_mask(random, self.e_bad, log_qb, n)<<pos
+            else:
+                mask |= bernoulli_mask(random, self.e_good, log_qg, n)<<pos
+            pos += n
+            self.run_left -= n
+        return mask
+
+
+class Erasure_noise(Noise_model):
+    """Per frame erasure: each frame is lost with probability `p_erasure` (e.g. collision, loss of sync),
+        otherwise its errors are drawn from `inner` model (default: no bit errors). One draw per frame.
+        `inner` shares random stream of this model."""
+
+    def __init__(self, p_erasure, inner:Noise_model=None, rng=None) -> None:
+        self.p_erasure = p_erasure
+        self.inner = inner
+        self.rng = _random if rng is None else rng
+
+    @property
+    def rng(self):
+        return self._rng
+
+    @rng.setter
+    def rng(self, rng):
+        self._rng = rng
+        if self.inner is not None:
+            self.inner.rng = rng
+
+    @property
+    def p(self) -> float:
+        """Mean bit error probability of received frames."""
+        return 0. if self.inner is None else self.inner.p
+
+    def error_mask(self, frame_size:int):
+        if self.p_erasure > 0 and self._rng.random() < self.p_erasure:
+            return None
+        return 0 if self.inner is None else self.inner.error_mask(frame_size)
@@ -0,0 +1,275 @@
+# Conservative parallel discrete event simulation (YAWNS time windows) over partitioned networks
+import multiprocessing
+from collections import deque
+from math import inf
+
+from simulator import Simulator
+from Layers import Channel
+
+
+class Outbox_queue:
+    """Replaces event queue of a `Channel` that is owned by another partition, on the Tx side.
+        Injected frames (`Channel.inject_chann`) become messages to the owner partition."""
+
+    def __init__(self, outbox:list, elem_ind:int) -> None:
+        self.outbox = outbox
+        self.elem_ind = elem_ind
+        self.size = 0
+        self.listener = None
+
+    def add_event(self, event:tuple):
+        self.outbox.append((self.elem_ind, event))
+        return [event[0], 0, event]  # handle of `Channel.cancel`
+
+    def cancel_event(self, handle):
+        raise RuntimeError("Channel commands (e.g. 'cancel transmit') can not cross partitions.")
+
+
+def partition_topology(edges, n_parts:int) -> dict:
+    """Partition of each node id of `topology.Topology` `edges` (graph only, nothing is built): nodes are split
+        in `n_parts` blocks of BFS order (neighbors tend to share a partition). For `Parallel_simulator` with
+        `functools.partial(partition_topology, edges)`."""
+    neighbors = {}  # node id -> neighbor ids (both directions), in order of first appearance
+    for u, v, *_ in edges:
+        neighbors.setdefault(u, []).append(v)
+        neighbors.setdefault(v, []).append(u)
+    order, visited = [], set()
+    for root in neighbors:  # BFS of each component
+        if root in visited:
+            continue
+        visited.add(root)
+        frontier = deque([root])
+        while frontier:
+            node = frontier.popleft()
+            order.append(node)
+            for neighbor in neighbors[node]:
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    frontier.append(neighbor)
+    return {node: rank*n_parts//len(order) for rank, node in enumerate(order)}
+
+
+class Partition_worker:
+    """One partition: builder builds only elements of this partition and channels from it to other partitions
+        (same seed => same element indices and random streams as a sequential run, see `Simulator.reserve`).
+        Built channels of other partitions are Tx ends of such channels: their frames go to `outbox`."""
+
+    def __init__(self, build, parts, part:int, seed, t_start=0) -> None:
+        self.simulator = Simulator(seed)
+        self.model = build(self.simulator, parts=parts, part=part)
+        self.parts = self.model.element_parts
+        self.part = part
+        self.outbox = []  # (channel index, event)
+        elements = self.simulator.elements
+        owned = sorted(elem_ind for elem_ind, elem_part in self.parts.items() if elem_part == part)
+        delays = []
+        for elem_ind, elem_part in self.parts.items():
+            elem = elements[elem_ind]
+            if elem_part != part and isinstance(elem, Channel):
+                elem.event_queue = Outbox_queue(self.outbox, elem_ind)
+                delays.append(elem.D_p)
+        # A frame injected at `t` is received at `t+D_T+D_p`: no partition is affected by this one before it
+        self.lookahead = min(delays, default=inf)
+        self.simulator.time = t_start
+        self.simulator.init_schedule(owned)
+
+    def deliver(self, inbound):
+        elements = self.simulator.elements
+        for elem_ind, event in inbound:
+            elements[elem_ind].ret_event_queue().add_event(event)
+
+    def messages(self):
+        """Return and clear outbox: `(partition, channel index, event)` messages."""
+        parts = self.parts
+        messages = [(parts[elem_ind], elem_ind, event) for elem_ind, event in self.outbox]
+        self.outbox.clear()
+        return messages
+
+    def window(self, inbound, w_end, t_end):
+        """Deliver `inbound` messages and run events with `timestamp < w_end` and `timestamp <= t_end`.
+            Return `(messages, nearest event key)`."""
+        self.deliver(inbound)
+        simulator = self.simulator
+        peek, step = simulator.peek, simulator.step
+        key = peek()
+        while key is not None and key[0] < w_end and key[0] <= t_end:
+            step()
+            key = peek()
+        return self.messages(), key
+
+    def step(self):
+        """Run nearest event. Return `(messages, nearest event key)`."""
+        self.simulator.step()
+        return self.messages(), self.simulator.peek()
+
+    def collect(self, collect):
+        return None if collect is None else collect(self.simulator, self.model)
+
+    def handle(self, command):
+        name, *args = command
+        return getattr(self, name)(*args)
+
+
+def _worker_main(connection, args):
+    """Process entry point: run commands of coordinator."""
+    worker = Partition_worker(*args)
+    connection.send((worker.lookahead, worker.simulator.peek()))
+    while True:
+        command = connection.recv()
+        if command[0] == 'close':
+            break
+        connection.send(worker.handle(command))
+    connection.close()
+
+
+class Parallel_simulator:
+    """Conservative parallel simulation of a network partitioned across worker processes (YAWNS).
+        Each window runs all events with `timestamp < T_min + lookahead` in parallel, `T_min` being the
+        nearest event (or message) of all partitions and `lookahead` the minimum `D_p` of channels between
+        partitions. Frames injected into such channels are exchanged as messages at the end of each window
+        (they can not be received inside it). After `t_end`, the single next event is run like `Simulator.run`,
+        so results are identical to a sequential run of the same network and seed.
+
+        `partition(n_parts)`: partition of each network node (e.g. `partition_topology` with `functools.partial`).
+            It is computed once and passed to `build`.
+        `build(simulator, parts=..., part=...)`: builds partition `part` of the network in a new `Simulator`:
+            its elements and channels from it to other partitions, other elements are reserved
+            (`Simulator.reserve`), e.g. `topology.build_topology` with `functools.partial`. Returns a model object
+            with `element_parts` (element index -> partition, a `Channel` is in partition of its Rx Node).
+            Must be deterministic and picklable.
+        `processes`: run partitions in worker processes (`False`: in this process, for debugging)."""
+
+    def __init__(self, build, partition, n_parts:int, seed=None, processes=True) -> None:
+        self.build = build
+        self.partition = partition
+        self.n_parts = n_parts
+        self.seed = seed
+        self.processes = processes
+        self.windows = 0  # statistics of last run
+        self.messages = 0
+
+    def start_workers(self, t_start):
+        """Start workers. Return `(lookahead, nearest event keys)`.
+            Lookahead must be positive: windows of a zero delay channel between partitions are empty, so the
+            run would never advance (put both ends of such channels in one partition, or run sequentially)."""
+        self.connections, self.workers, self.worker_processes = [], [], []
+        parts = self.partition(self.n_parts)
+        replies = []
+        if not self.processes:
+            for part in range(self.n_parts):
+                worker = Partition_worker(self.build, parts, part, self.seed, t_start)
+                self.workers.append(worker)
+                replies.append((worker.lookahead, worker.simulator.peek()))
+            return self.check_lookahead(replies)
+        context = multiprocessing.get_context()
+        for part in range(self.n_parts):
+            parent, child = context.Pipe()
+            args = (self.build, parts, part, self.seed, t_start)
+            process = context.Process(target=_worker_main, args=(child, args), daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.worker_processes.append(process)
+        replies = [connection.recv() for connection in self.connections]
+        return self.check_lookahead(replies)
+
+    def check_lookahead(self, replies):
+        L = min(lookahead for lookahead, _ in replies)  # each worker sees channels from its partition
+        if L <= 0:
+            self.stop_workers()
+            raise ValueError(f"Lookahead is {L}: a channel between partitions has no propagation delay. "
+                             "Partition the network so such channels stay inside a partition, or use n_parts=1.")
+        return L, [key for _, key in replies]
+
+    def call(self, commands:dict) -> dict:
+        """Send `commands` (partition -> command) to workers. Return replies (partition -> reply)."""
+        if not self.processes:
+            return {part: self.workers[part].handle(command) for part, command in commands.items()}
+        for part, command in commands.items():
+            self.connections[part].send(command)
+        return {part: self.connections[part].recv() for part in commands}
+
+    def stop_workers(self):
+        for connection in self.connections:
+            connection.send(('close',))
+            connection.close()
+        for process in self.worker_processes:
+            process.join()
+        self.connections, self.workers, self.worker_processes = [], [], []
+
+    def run(self, t_end, t_start=0, collect=None) -> list:
+        """Run until `t_end`. `collect(simulator, model)`: picklable function that returns results of a partition.
+            Return list of `collect` results of partitions (only elements of a partition ran in it)."""
+        L, keys = self.start_workers(t_start)
+        try:
+            inbound = [[] for _ in range(self.n_parts)]
+            self.windows = self.messages = 0
+            while True:
+                key = self.nearest(keys, inbound)
+                if key is None:
+                    raise ValueError("No event in simulator.")
+                if key[0] > t_end:
+                    break
+                replies = self.call({part: ('window', inbound[part], key[0]+L, t_end) for part in range(self.n_parts)})
+                inbound, keys = self.route(replies)
+                self.windows += 1
+            # `Simulator.run` runs one event after `t_end`: nearest event of all partitions
+            replies = self.call({part: ('window', inbound[part], -inf, t_end) for part in range(self.n_parts)})
+            inbound, keys = self.route(replies)
+            key = self.nearest(keys, inbound)
+            part = self.partition_of(key, keys)
+            inbound, _ = self.route(self.call({part: ('step',)}))
+            self.call({part: ('window', inbound[part], -inf, t_end) for part in range(self.n_parts)})
+            return [reply for _, reply in sorted(self.call({part: ('collect', collect) for part in range(self.n_parts)}).items())]
+        finally:
+            self.stop_workers()
+
+    def route(self, replies:dict):
+        """Route messages of `replies` to their partitions. Return `(inbound, keys)`."""
+        inbound = [[] for _ in range(self.n_parts)]
+        keys = [None]*self.n_parts
+        for part, (messages, key) in replies.items():
+            keys[part] = key
+            for dest, elem_ind, event in messages:
+                inbound[dest].append((elem_ind, event))
+            self.messages += len(messages)
+        return inbound, keys
+
+    @staticmethod
+    def nearest(keys, inbound):
+        """Nearest `(timestamp, element index)` of events and messages in flight (`None`: no event)."""
+        candidates = [key for key in keys if key is not None]
+        candidates += [(event[0], elem_ind) for messages in inbound for elem_ind, event in messages]
+        return min(candidates, default=None)
+
+    @staticmethod
+    def partition_of(key, keys) -> int:
+        return keys.index(key)
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    from functools import partial
+    from topology import build_topology
+
+    def delivered(simulator, topology):
+        return topology.delivered()
+
+    n, n_flows, t_end = 400, 200, 0.1
+    rng = random.Random(0)
+    edges = [(i, (i+1) % n) for i in range(n)]+[(i, (i+n//2) % n) for i in range(0, n//2, 7)]
+    flows = [tuple(rng.sample(range(n), 2)) for _ in range(n_flows)]
+    build = partial(build_topology, edges=edges, flows=flows)
+    t0 = time.time()
+    simulator = Simulator(1)
+    topology = build(simulator)
+    simulator.run(t_end)
+    sequential = topology.delivered()
+    print(f"sequential: {time.time()-t0:.2f} s, delivered {sum(sequential.values())}")
+    for n_parts in (2, 4):
+        engine = Parallel_simulator(build, partial(partition_topology, edges), n_parts, seed=1)
+        t0 = time.time()
+        results = engine.run(t_end, collect=delivered)
+        parallel = sum(results, start=type(sequential)())
+        print(f"{n_parts} partitions: {time.time()-t0:.2f} s, {engine.windows} windows, {engine.messages} messages, "
+              f"identical: {parallel == sequential}")
@@ -0,0 +1,290 @@
+# Opt-in profiling of simulator runs: `simulator.run(t_end, profiler=Profiler())`
+# Wall time is attributed to event types, elements and layers by sampling, so overhead stays small and
+# results do not depend on profiling (profiler has its own random stream).
+import random
+import sys
+from time import perf_counter
+
+# Frames that only forward calls: hidden in stacks, their time goes to caller
+TRAMPOLINES = ('Node.from_', '<lambda>')
+ENGINE_CLASSES = ('Simulator', 'Event_queues', 'Timer_service', 'Event_registry', 'Event_code', 'simulator', 'heapq')
+FRAME_CLASSES = ('Frame', 'SAP_data')
+
+
+class Profiler:
+    """Sampling profiler of `Simulator.run`/`resume` (pass `profiler=`).
+        Events of each element are counted exactly (the only per event overhead). About one event in
+        `sample_every` (random gaps, so periodic event patterns are not aliased) is a sample: its type is seen
+        and its wall time is measured. Events of an `(element, type)` are estimated as events of element times
+        share of type in its samples, their time as that count times mean sampled time.
+        One sample in about `stack_every` is traced (`sys.setprofile`) instead of timed: self time of each call
+        stack (`'DL start;Simulator.step;Node.event_run;...'`, rooted at event type, trampolines `Node.from_*`
+        and lambdas hidden). Stacks give time per layer (classes of elements and their layers, e.g.
+        `PHY.checker` -> `'L1'`, noise -> `'channel'`, queues -> `'engine'`, other helpers count for their
+        caller) and flamegraph input (`write_folded`).
+        Queue depths are sampled every `depth_every` events (at most `max_depth_samples`, interval doubles)."""
+
+    def __init__(self, sample_every=64, stack_every=4096, depth_every=4096, max_depth_samples=1024, seed=0) -> None:
+        self.sample_every = sample_every
+        self.stack_every = stack_every  # 0: no stack samples
+        self.depth_every = depth_every
+        self.max_depth_samples = max_depth_samples
+        self.rng = random.Random(seed)
+        self.counts = []  # element index -> events
+        self.seen = {}  # (element index, event type) -> samples
+        self.sampled = {}  # (element index, event type) -> [timed events, total time]
+        self.folded = {}  # folded stack -> self time of traced events
+        self.layer_time = {}  # layer -> self time of traced events
+        self.depths = []  # (sim time, wall time, events, events in all queues, longest queue)
+        self.layers = None  # class or module name -> layer, see `classify`
+        self.n_events = 0
+        self.n_stacks = 0
+        self.wall_time = 0.
+        self.t_resume = None  # wall clock at start of current `resume`
+        self.sim_time = 0.
+        self.next_sample = 1
+        self.next_stack = 1
+        self.next_depth = 1
+        self.simulator = None
+
+    def gap(self, mean:int) -> int:
+        return self.rng.randint(1, 2*mean-1)
+
+    def classify(self, simulator):
+        """Map classes (and modules of their functions) of `simulator` elements to layers."""
+        layers = {name: 'engine' for name in ENGINE_CLASSES}
+        layers.update({name: 'frames' for name in FRAME_CLASSES})
+
+        def add(obj, layer):
+            if obj is None:
+                return
+            for cls in type(obj).__mro__[:-1]:  # methods are named by class that defines them
+                layers.setdefault(cls.__name__, layer)
+            layers.setdefault(type(obj).__module__, layer)  # module functions e.g. `noise.bernoulli_mask`
+
+        for elem in simulator.elements:
+            if hasattr(elem, 'layer_names'):
+                add(elem, 'node')
+                for name in elem.layer_names:
+                    layer = getattr(elem, name, None)
+                    add(layer, name)
+                    add(getattr(layer, 'checker', None), name)
+            else:
+                add(elem, 'channel')
+                noise = getattr(elem, 'noise', None)
+                while noise is not None:  # wrapped models e.g. `Erasure_noise.inner`
+                    add(noise, 'channel')
+                    noise = getattr(noise, 'inner', None)
+        self.layers = layers
+
+    # Run loop
+    def resume(self, simulator, t_end, checkpoint=None):
+        """Run `simulator` until `t_end` like `Simulator.resume` and profile it."""
+        if self.simulator is not simulator:
+            self.simulator = simulator
+            self.classify(simulator)
+        step = simulator.step
+        counts = self.counts
+        counts += [0]*(len(simulator.elements)-len(counts))
+        n, next_sample = self.n_events, self.next_sample
+        if checkpoint is not None:
+            checkpoint.start()
+        t_sim = simulator.time
+        t_wall = self.t_resume = perf_counter()
+        while simulator.time <= t_end:
+            n += 1
+            if n < next_sample:
+                counts[step()] += 1
+            else:
+                next_sample = self.sample(simulator, n)
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save(simulator)
+        self.wall_time += perf_counter()-t_wall
+        self.sim_time += simulator.time-t_sim
+        self.n_events, self.next_sample = n, next_sample
+
+    def sample(self, simulator, n:int) -> int:
+        """Run `n`-th event timed or traced. Return index of next sampled event."""
+        if n >= self.next_depth:
+            self.sample_depth(simulator, n)
+        elem_ind, queue = simulator.nearest_event()
+        key = (elem_ind, queue.queue[0][2][1])
+        self.counts[elem_ind] += 1
+        self.seen[key] = self.seen.get(key, 0)+1
+        if self.stack_every and n >= self.next_stack:
+            self.next_stack = n+self.gap(self.stack_every)
+            self.sample_stack(simulator, str(key[1]))
+        else:
+            t0 = perf_counter()
+            simulator.step()
+            elapsed = perf_counter()-t0
+            sampled = self.sampled.get(key)
+            if sampled is None:
+                self.sampled[key] = [1, elapsed]
+            else:
+                sampled[0] += 1
+                sampled[1] += elapsed
+        return n+self.gap(self.sample_every)
+
+    def sample_depth(self, simulator, n:int):
+        sizes = [len(elem.ret_event_queue()) for elem in simulator.elements]
+        self.depths.append((simulator.time, self.wall_time+perf_counter()-self.t_resume, n, sum(sizes), max(sizes, default=0)))
+        if len(self.depths) > self.max_depth_samples:  # keep every other sample
+            self.depths = self.depths[::2]
+            self.depth_every *= 2
+        self.next_depth = n+self.depth_every
+
+    def sample_stack(self, simulator, root:str):
+        """Run next event under `sys.setprofile` and add self time of its call stacks. An active profile function
+            is paused during the event."""
+        folded, layer_time, layers = self.folded, self.layer_time, self.layers
+        keys = [root]  # folded stack of each visible frame
+        frames = []  # per open call: whether it is in `keys`
+        current = ['engine']  # layer of innermost Python frame
+        clock = [None]
+
+        def tracer(frame, event, arg):
+            stack = keys[-1]
+            if clock[0] is not None:  # first event: time before it is `setprofile` itself
+                elapsed = perf_counter()-clock[0]
+                folded[stack] = folded.get(stack, 0.)+elapsed
+                layer_time[current[-1]] = layer_time.get(current[-1], 0.)+elapsed
+            if event == 'call' or event == 'c_call':
+                layer = current[-1]  # builtins, trampolines and helpers (e.g. stats, random) work for caller
+                if event == 'call':
+                    code = frame.f_code
+                    name = getattr(code, 'co_qualname', code.co_name)
+                    owner = name.split('.', 1)[0] if '.' in name else frame.f_globals.get('__name__')
+                    layer = layers.get(owner, layer)
+                else:
+                    name = getattr(arg, '__qualname__', None) or repr(arg)
+                visible = not name.startswith(TRAMPOLINES)
+                if visible:
+                    keys.append(f'{stack};{name}')
+                else:
+                    layer = current[-1]
+                current.append(layer)
+                frames.append(visible)
+            elif frames:  # return, c_return, c_exception
+                if frames.pop():
+                    keys.pop()
+                current.pop()
+            clock[0] = perf_counter()
+
+        previous = sys.getprofile()  # e.g. cProfile or a debugger: restored after this event
+        sys.setprofile(tracer)
+        try:
+            simulator.step()
+        finally:
+            if previous is None or callable(previous):
+                sys.setprofile(previous)
+            else:  # C profilers (`cProfile.Profile`) are not callable: `enable` reinstalls them
+                previous.enable()
+        self.n_stacks += 1
+
+    # Results
+    def estimates(self) -> dict:
+        """`(element index, event type)` -> `(estimated events, estimated time)`. Types that were never timed
+            get mean time of all timed events, elements that were never sampled get type `None`."""
+        timed = sum(sampled[0] for sampled in self.sampled.values())
+        mean = sum(sampled[1] for sampled in self.sampled.values())/timed if timed else 0.
+        samples = [0]*len(self.counts)
+        for (elem_ind, _), count in self.seen.items():
+            samples[elem_ind] += count
+        keys = list(self.seen)+[(elem_ind, None) for elem_ind, count in enumerate(samples)
+                                if count == 0 and self.counts[elem_ind]]
+        result = {}
+        for key in keys:
+            elem_ind = key[0]
+            count = self.counts[elem_ind]*self.seen[key]/samples[elem_ind] if samples[elem_ind] else self.counts[elem_ind]
+            sampled = self.sampled.get(key)
+            result[key] = (count, count*(sampled[1]/sampled[0] if sampled else mean))
+        return result
+
+    def element_label(self, index:int) -> str:
+        return f'{type(self.simulator.elements[index]).__name__}[{index}]'
+
+    def handler_label(self, key) -> str:
+        """Name of handler of event `key` e.g. `'Stop_Wait_Tx.start_transmit'`."""
+        elem_ind, code = key
+        handler = None if code is None else getattr(self.simulator.elements[elem_ind], 'handlers', {}).get(code)
+        return getattr(handler, '__qualname__', f'{self.element_label(elem_ind)}.event_run')
+
+    def to_dict(self, top=10) -> dict:
+        """Profile summary: totals, time per event type/element/handler/layer and queue depth samples."""
+        event_types, elements, handlers = {}, {}, {}
+        for key, (count, time) in self.estimates().items():
+            for table, name in ((event_types, 'unsampled' if key[1] is None else str(key[1])), (elements, self.element_label(key[0])),
+                                (handlers, self.handler_label(key))):
+                entry = table.setdefault(name, {'events': 0, 'time': 0.})
+                entry['events'] += count
+                entry['time'] += time
+
+        def ranked(table, limit=None):
+            items = sorted(table.items(), key=lambda item: -item[1]['time'])
+            return dict(items[:limit])
+
+        traced = sum(self.layer_time.values())
+        return {'events': self.n_events, 'wall_time': self.wall_time, 'sim_time': self.sim_time,
+                'events_per_s': self.n_events/self.wall_time if self.wall_time else float('nan'),
+                'timed_events': sum(sampled[0] for sampled in self.sampled.values()), 'traced_events': self.n_stacks,
+                'event_types': ranked(event_types), 'elements': ranked(elements, top), 'handlers': ranked(handlers, top),
+                'layers': {layer: time/traced for layer, time in sorted(self.layer_time.items(), key=lambda item: -item[1])},
+                'depths': self.depths}
+
+    def report(self, top=10) -> str:
+        summary = self.to_dict(top)
+        lines = [f"{summary['events']} events in {summary['wall_time']:.3f} s ({summary['events_per_s']:.0f} events/s), "
+                 f"{summary['sim_time']:g} s simulated, {summary['timed_events']} timed, {summary['traced_events']} traced"]
+        for title in ('event_types', 'elements', 'handlers'):
+            lines.append(f"{title.replace('_', ' ')} (estimated time, events, mean):")
+            for name, entry in summary[title].items():
+                lines.append(f"  {name:40} {entry['time']:9.4f} s {entry['events']:9.0f} "
+                             f"{entry['time']/entry['events']*1e6 if entry['events'] else 0.:8.2f} us")
+        lines.append("layers (share of traced time): "+', '.join(f"{layer} {share:.1%}" for layer, share in summary['layers'].items()))
+        if self.depths:
+            lines.append(f"queued events: mean {sum(d[3] for d in self.depths)/len(self.depths):.1f}, "
+                         f"max {max(d[3] for d in self.depths)}, longest element queue {max(d[4] for d in self.depths)}")
+        return '\n'.join(lines)
+
+    def write_folded(self, path:str):
+        """Write stacks in folded format (`frame;frame;... value`, value: nanoseconds of self time of traced
+            events), input of `flamegraph.pl` and speedscope."""
+        with open(path, 'w') as file:
+            for stack, time in sorted(self.folded.items()):
+                if time >= 1e-9:
+                    file.write(f'{stack} {round(time*1e9)}\n')
+
+
+def main(argv=None):
+    import argparse
+    from CRC import PRESETS
+    from sweep import ARQ, build_stop_wait
+    from simulator import Simulator
+    parser = argparse.ArgumentParser(description='Profile a data link simulation.')
+    parser.add_argument('--p', type=float, default=1e-4, help='bit error probability')
+    parser.add_argument('--R_T', type=float, default=1e6, help='transmission rate')
+    parser.add_argument('--D_p', type=float, default=1e-3, help='propagation delay')
+    parser.add_argument('--divisor', default='0xB', help='CRC divisor e.g. 0xB, CRC-8')
+    parser.add_argument('--packet_size', type=int, default=96)
+    parser.add_argument('--arq', choices=list(ARQ), default='stop_wait')
+    parser.add_argument('--N_window', type=int, default=1)
+    parser.add_argument('--t_end', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample_every', type=int, default=64)
+    parser.add_argument('--stack_every', type=int, default=4096, help='0: no stack samples')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--folded', default=None, help='write folded stacks (flamegraph input) to this file')
+    args = parser.parse_args(argv)
+    divisor = PRESETS[args.divisor] if args.divisor in PRESETS else int(args.divisor, 0)
+    simulator = Simulator(seed=args.seed)
+    build_stop_wait(simulator, args.p, args.R_T, args.D_p, divisor, args.packet_size, args.arq, args.N_window)
+    profiler = Profiler(args.sample_every, args.stack_every)
+    simulator.run(args.t_end, profiler=profiler)
+    print(profiler.report(args.top))
+    if args.folded is not None:
+        profiler.write_folded(args.folded)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,88 @@
 # Data network simulator 
+# Layers, DL and sweep workers import this module: hashlib, pickle and zlib are imported where they are used.
+from heapq import heappush, heappop, heapify
+from functools import partial
+import os
+import random
+import time as _time
+
+
+class Event_code(int):
+    """Integer code of an event type (see `Event_registry`). Events carry codes instead of strings, so 
+        dispatching an event is one table lookup. For readability and old code, a code prints as its 
+        name and compares equal to it: `DL_TIMEOUT == 'DL timeout'`. Use codes (not names) as dict keys."""
+    
+    def __new__(cls, code:int, name:str):
+        obj = int.__new__(cls, code)
+        obj.name = name
+        return obj
+    
+    def __repr__(self) -> str:
+        return repr(self.name)
+    
+    def __str__(self) -> str:
+        return self.name
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, str):
+            return self.name == other
+        return int.__eq__(self, other)
+    
+    def __ne__(self, other) -> bool:
+        return not self.__eq__(other)
+    
+    __hash__ = int.__hash__
+    
+    def __reduce__(self):
+        return (register_event, (self.name,))
+
+
+class Event_registry:
+    """Registry of event types: name (e.g. `'DL timeout'`) <-> `Event_code`.
+        Layers register their event types once (`register_event`) and handlers against codes 
+        (see `Node.register_handler`). String commands are still accepted and translated by `code`."""
+    
+    def __init__(self) -> None:
+        self.codes = {}  # name -> code
+        self.types = []  # code -> Event_code
+    
+    def __contains__(self, command) -> bool:
+        return command in self.codes or (isinstance(command, int) and 0 <= command < len(self.types))
+    
+    def register(self, name:str) -> Event_code:
+        """Register event type `name` and return its code. Registering a name again returns same code."""
+        if name not in self.codes:
+            self.codes[name] = Event_code(len(self.types), name)
+            self.types.append(self.codes[name])
+        return self.codes[name]
+    
+    def code(self, command) -> Event_code:
+        """Translate `command` (name or code) to `Event_code`."""
+        if isinstance(command, Event_code):
+            return command
+        try:
+            if isinstance(command, str):
+                return self.codes[command]
+            return self.types[command]
+        except (KeyError, IndexError, TypeError):
+            raise ValueError(f"Unknown event type {command}") from None
+    
+    def handler(self, handlers:dict, command):
+        """Return handler of `command` in `handlers` (event code -> handler) table. Slow path for string commands."""
+        handler = handlers.get(self.code(command))
+        if handler is None:
+            raise ValueError(f"No handler for event {command}")
+        return handler
+
+
+EVENT_TYPES = Event_registry()
+
+
+def register_event(name:str) -> Event_code:
+    """Register event type `name` in global registry and return its code."""
+    return EVENT_TYPES.register(name)
+
+
 class Event_queues:
     """This queue can store events in order of time. If you add a event, queue automatically 
         insert event that every event before new event has smaller timestamp.
@@ -6,35 +90,82 @@ class Event_queues:
         1 for Rx chann and 1 for Tx, Rx `OR` 1 queue for all elements.
         
         Events are tuple with `(timestamp, command, data)` format. for example:
-        `(0.02, 'chann transmit', {'frame':0xAB23, 'frame_size':16})`"""
+        `(0.02, 'chann transmit', {'frame':0xAB23, 'frame_size':16})`
+        
+        Internally events are kept in a binary heap of `[timestamp, order, event]` entries, so
+        insert and pop cost O(log n). `order` breaks ties between same timestamp events exactly 
+        like the old sorted list did: newer event pops first (see `insort_left`).
+        `add_event` returns the heap entry as a cancellation handle. Cancelled events are only 
+        tombstoned (`entry[2] = None`) and dropped lazily when they reach the top of the heap 
+        (top of heap is always an alive event).
+        
+        `listener` (if set) is called whenever nearest event of queue may have changed. `Simulator` 
+        uses it to keep its global schedule up to date."""
     
     def __init__(self) -> None:
-        self.queue = []
-        self.size = 0
+        self.queue = []  # heap of [timestamp, order, event]
+        self.size = 0  # number of alive events
+        self.n_dead = 0  # number of tombstoned entries still in heap
+        self.order = 0  # tie breaker: decreases on each insert
+        self.listener = None  # callback on nearest event change
     
     def __len__(self) -> int:
         """Retutn size of waiting events in queue."""
         return self.size
     
     def __repr__(self) -> str:
-        return self.queue.__repr__()
+        return list(self).__repr__()
     
     def __iter__(self):
-        """Create iterator. Use for map, filter, reduce operations."""
-        return self.queue.__iter__()
+        """Create iterator over alive events in order of time. Use for map, filter, reduce operations."""
+        return (entry[2] for entry in sorted(self.queue) if entry[2] is not None)
 
     def has_event(self):
         """Return wether queue is not empty or not i.e. len>0 => True; len==0 =>False"""
         return self.size > 0
 
     def clear_event(self):
+        for entry in self.queue:  # old handles become invalid
+            entry[2] = None
         self.queue = []
         self.size = 0
+        self.n_dead = 0
+        if self.listener is not None:
+            self.listener()
     
-    def add_event(self, event:tuple) -> None:
-        """Add new event to queue."""
-        self.insort_left(event)
+    def add_event(self, event:tuple):
+        """Add new event to queue. Return a handle that can be passed to `cancel_event`."""
+        handle = self.insort_left(event)
         self.size += 1  # Increase queue length
+        if self.listener is not None and self.queue[0] is handle:  # new nearest event
+            self.listener()
+        return handle
+    
+    def cancel_event(self, handle) -> bool:
+        """Cancel event of `handle` (returned by `add_event`). Event is tombstoned and removed lazily.
+            Return `False` if event has already been popped or cancelled."""
+        if handle[2] is None:
+            return False
+        handle[2] = None  # tombstone
+        self.size -= 1
+        self.n_dead += 1
+        nearest = self.queue[0] is handle
+        if self.n_dead > 32 and self.n_dead > self.size:  # too many tombstones: compact heap
+            self.queue = [entry for entry in self.queue if entry[2] is not None]
+            heapify(self.queue)
+            self.n_dead = 0
+        elif nearest:
+            self.drop_dead()
+        if self.listener is not None and nearest:
+            self.listener()
+        return True
+    
+    def drop_dead(self):
+        """Remove tombstoned entries from top of heap."""
+        queue = self.queue
+        while queue and queue[0][2] is None:
+            heappop(queue)
+            self.n_dead -= 1
     
     def nearest_event_time(self):
         """Return nearest event timestamp."""
@@ -42,58 +173,340 @@ class Event_queues:
         return self.queue[0][0]  # first 0: nearest event, second 0: timestamp
     
     def set_events(self, queue):
-        """Set events."""
-        self.queue = queue
-        self.size = len(queue)
+        """Set events. `queue` is an iterable of events in order of time (e.g. filtered `list(self)`).
+            Events that are already in this queue keep their entries, so their handles (e.g. timers of
+            `Timer_service`) stay valid. Handles of events that are not in `queue` become invalid."""
+        alive = {id(entry[2]): entry for entry in self.queue if entry[2] is not None}
+        entries = []
+        for ind, event in enumerate(queue):  # later events in `queue` pop later if timestamps are equal
+            entry = alive.pop(id(event), None)
+            if entry is None:
+                entry = [event[0], 0, event]
+            entry[0], entry[1] = event[0], self.order+1+ind
+            entries.append(entry)
+        for entry in alive.values():  # removed events
+            entry[2] = None
+        heapify(entries)
+        self.queue = entries
+        self.size = len(entries)
+        self.n_dead = 0
+        if self.listener is not None:
+            self.listener()
     
     def pop_event(self, index=0):
         """Pop an event in queue.
-            Default: nearest event."""
+            Default: nearest event. Other indices (in order of time) cost O(n log n): the event is tombstoned
+            like `cancel_event`, so handles of other events stay valid."""
         assert self.size != 0, "Queue has no event."
+        if index != 0:
+            entry = sorted(entry for entry in self.queue if entry[2] is not None)[index]
+            event = entry[2]
+            self.cancel_event(entry)
+            return event
+        entry = heappop(self.queue)
+        event = entry[2]
+        entry[2] = None  # handle is not valid anymore
         self.size -= 1
-        return self.queue.pop(index)
+        self.drop_dead()
+        if self.listener is not None:
+            self.listener()
+        return event
     
     def insort_left(self, event):
         """Inspired by `bisect` module.
             Insert new `event` in queue, and keep it sorted. If new `event` has same timestamp 
-            with another event in queue, insert new event to the left of the leftmost such events."""
-        lo = 0;
-        hi = self.size
-        while lo < hi:
-            mid = (lo+hi)//2
-            if self.queue[mid][0] < event[0]:lo = mid+1  # 0: event timestamp
-            else: hi = mid
-        self.queue.insert(lo, event)
+            with another event in queue, insert new event to the left of the leftmost such events.
+            Return heap entry of event (handle)."""
+        entry = [event[0], self.order, event]  # 0: event timestamp
+        self.order -= 1  # newer events pop first in same timestamps
+        heappush(self.queue, entry)
+        return entry
+
+
+class Timer_service:
+    """Keyed timers (e.g. one per `seq_nr`) on top of an `Event_queues`.
+        A timer is a `(timestamp, command, key)` event, for example `(0.012, 'DL timeout', 3)`.
+        Start, restart and cancel cost O(log n) (cancel is O(1) tombstoning), no queue scan needed."""
+    
+    def __init__(self, event_queue:Event_queues, command='DL timeout') -> None:
+        """`event_queue`: queue that timer events are added to (e.g. `Node.event_queue`).
+            `command`: command (name or `Event_code`) of timer events."""
+        self.event_queue = event_queue
+        self.command = EVENT_TYPES.code(command) if command in EVENT_TYPES else command
+        self.handles = {}  # key -> event handle
+    
+    def __len__(self) -> int:
+        """Return number of running timers."""
+        return sum(1 for handle in self.handles.values() if handle[2] is not None)
+    
+    def is_running(self, key) -> bool:
+        """Return whether timer `key` is running."""
+        handle = self.handles.get(key)
+        return handle is not None and handle[2] is not None
+    
+    def start(self, key, timestamp):
+        """Start timer `key` that expires at `timestamp`. A running timer with same key is restarted."""
+        self.cancel(key)
+        handle = self.event_queue.add_event((timestamp, self.command, key))
+        self.handles[key] = handle
+        return handle
+    
+    restart = start
+    
+    def cancel(self, key) -> bool:
+        """Cancel timer `key`. Return `False` if it was not running."""
+        handle = self.handles.pop(key, None)
+        if handle is None:
+            return False
+        return self.event_queue.cancel_event(handle)
+    
+    def cancel_all(self):
+        """Cancel all running timers."""
+        for key in list(self.handles):
+            self.cancel(key)
+    
+    def expire(self, key):
+        """Forget timer `key`. Owner calls this when timer event of `key` has been popped."""
+        self.handles.pop(key, None)
+
+
+class Seed_sequence:
+    """Spawnable tree of seeds, like `numpy.random.SeedSequence`. Each node is identified by 
+        `(entropy, spawn_key)` and children get independent, reproducible streams.
+        `random()` returns a `random.Random` (fast scalar draws) and `numpy_rng()` a NumPy `Generator` 
+        (batch draws, NumPy is imported only there)."""
+    
+    def __init__(self, entropy=None, spawn_key=()) -> None:
+        """`entropy`: master seed [int]. `None`: fresh entropy from OS (not reproducible).
+            `spawn_key`: path of this node in seed tree."""
+        if entropy is None:
+            entropy = int.from_bytes(os.urandom(16), 'big')
+        self.entropy = entropy
+        self.spawn_key = tuple(spawn_key)
+        self.n_children_spawned = 0
+    
+    def __repr__(self) -> str:
+        return f'Seed_sequence(entropy={self.entropy}, spawn_key={self.spawn_key})'
+    
+    def spawn(self, n_children:int):
+        """Return `n_children` new child seed sequences."""
+        start = self.n_children_spawned
+        self.n_children_spawned += n_children
+        return [Seed_sequence(self.entropy, self.spawn_key+(i,)) for i in range(start, start+n_children)]
+    
+    def generate_state(self, n_bits=128) -> int:
+        """Return a `n_bits` integer seed of this node."""
+        from hashlib import blake2b
+        digest = blake2b(f'{self.entropy}/{self.spawn_key}'.encode(), digest_size=(n_bits+7)//8).digest()
+        return int.from_bytes(digest, 'big')>>(-n_bits % 8)
+    
+    def random(self):
+        """Return `random.Random` stream of this node."""
+        return random.Random(self.generate_state())
+    
+    def numpy_rng(self):
+        """Return NumPy `Generator` stream of this node."""
+        import numpy as np
+        return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=self.spawn_key))
 
 
 class Simulator:
-    """Simulator engine"""
-    def __init__(self) -> None:
+    """Simulator engine
+        Nearest event of each element is kept in a global heap of `(timestamp, element index)`, so 
+        finding next event costs O(log n) in number of elements. Element event queues notify simulator 
+        (`Event_queues.listener`) when their nearest event changes. Outdated heap entries are skipped lazily."""
+    def __init__(self, seed=None) -> None:
+        """`seed`: master seed [int or `Seed_sequence`] of random streams of elements (`Channel`, `Source`, ...).
+            Same seed and same network construction order => bit-identical runs. `None`: not reproducible."""
         self.elements = []  # Initialize network elements list
         self.time = float(0)  # Initialize simulation time
+        self.seed_seq = seed if isinstance(seed, Seed_sequence) else Seed_sequence(seed)
+        self.schedule = []  # heap of (nearest event timestamp, element index)
+        self.sched_time = []  # scheduled timestamp of each element (None: not scheduled)
 
     def add_element(self, element) -> None:
         """Add elements to simulator e.g. Node, channel"""
         self.elements.append(element)
+        self.sched_time.append(None)
+
+    def reserve(self, n_elements=0, n_rngs=0) -> None:
+        """Skip `n_elements` element indices (`None` placeholders) and `n_rngs` random streams of elements that
+            are not built here (e.g. other partitions of `parallel.Parallel_simulator`), so indices and streams
+            of built elements are those of a full build."""
+        self.elements += [None]*n_elements
+        self.sched_time += [None]*n_elements
+        self.seed_seq.n_children_spawned += n_rngs
 
     def get_sim_time(self) -> float:
         """Return simulation time."""
         return self.time
     
+    def spawn_rng(self):
+        """Return a new independent `random.Random` stream. Elements call this when they are bound 
+            to simulator, so streams depend only on master seed and binding order."""
+        return self.seed_seq.spawn(1)[0].random()
+    
+    def reschedule(self, elem_ind):
+        """Update global schedule for nearest event of element `elem_ind`."""
+        queue = self.elements[elem_ind].ret_event_queue()
+        new_time = queue.nearest_event_time() if queue.size else None
+        if new_time == self.sched_time[elem_ind]:
+            return
+        self.sched_time[elem_ind] = new_time
+        if new_time is None:
+            return
+        heappush(self.schedule, (new_time, elem_ind))
+        if len(self.schedule) > 2*len(self.elements)+64:  # too many outdated entries: rebuild
+            self.schedule = [(t, ind) for ind, t in enumerate(self.sched_time) if t is not None]
+            heapify(self.schedule)
+    
+    def init_schedule(self, elements=None):
+        """Bind element event queues to simulator and build global schedule.
+            `elements`: indices of elements to schedule (default: all). Other elements never run 
+            (e.g. elements of other partitions in `parallel.Parallel_simulator`)."""
+        self.schedule = []
+        for elem_ind in range(len(self.elements)) if elements is None else elements:
+            self.elements[elem_ind].ret_event_queue().listener = partial(self.reschedule, elem_ind)
+            self.sched_time[elem_ind] = None
+            self.reschedule(elem_ind)
+    
     def nearest_event(self):
-        """Find nearest event across all elements."""
-        node_event = enumerate(map(lambda elem: elem.ret_event_queue(), self.elements))  # Extract all events queue + enumerate
-        node_has_event = filter(lambda n_e: n_e[1].has_event(), node_event)  # Extract event queues has at least 1 event.
-        node_time_event = min(node_has_event, key=lambda n_e: n_e[1].nearest_event_time())  # Find nearest event across all nodes
-        return node_time_event  # Maybe need some exception handling
+        """Find nearest event across all elements. Return `(element index, element event queue)`."""
+        schedule, sched_time = self.schedule, self.sched_time
+        while schedule:
+            event_time, elem_ind = schedule[0]
+            if sched_time[elem_ind] == event_time:
+                return elem_ind, self.elements[elem_ind].ret_event_queue()
+            heappop(schedule)  # outdated entry
+        raise ValueError("No event in simulator.")
+    
+    def peek(self):
+        """Return `(timestamp, element index)` of nearest event, or `None` if there is no event."""
+        try:
+            elem_ind, _ = self.nearest_event()
+        except ValueError:
+            return None
+        return self.sched_time[elem_ind], elem_ind
+    
+    def step(self) -> int:
+        """Run nearest event of all elements. Return index of element that ran it.
+            `init_schedule` must be called before first step (`run` does it)."""
+        elem_ind, event = self.nearest_event()
+        new_time, _ = heappop(self.schedule)
+        self.sched_time[elem_ind] = None  # this entry is consumed
+        assert new_time >= self.time, "Bad timinig! New event occured in past!!"
+        self.time = new_time  # Update time
+        self.elements[elem_ind].event_run()  # Run nearest event!
+        self.reschedule(elem_ind)
+        return elem_ind
     
-    def run(self, t_end, t_start=0) -> None:
+    def run(self, t_end, t_start=0, checkpoint=None, profiler=None) -> None:
+        """Run from `t_start` until `t_end`. `checkpoint`: optional `Checkpoint` policy (see `resume`).
+            `profiler`: optional `profiler.Profiler` that runs and profiles the events (see `resume`)."""
         self.time = t_start
-        step = 1  # counter
+        self.init_schedule()
+        self.resume(t_end, checkpoint, profiler)
+    
+    def resume(self, t_end, checkpoint=None, profiler=None) -> None:
+        """Continue a run from current state (e.g. restored snapshot) until `t_end`.
+            `checkpoint`: save a snapshot whenever `checkpoint` is due. Resuming a saved snapshot gives a 
+            bit-identical run to an uninterrupted one.
+            `profiler`: run loop of `profiler` is used instead (same events, timed by sampling)."""
+        if profiler is not None:
+            return profiler.resume(self, t_end, checkpoint)
+        if checkpoint is None:
+            while self.time <= t_end:
+                self.step()
+            return
+        checkpoint.start()
         while self.time <= t_end:
-            elem_ind, event = self.nearest_event()
-            new_time = event.nearest_event_time()
-            assert new_time >= self.time, "Bad timinig! New event occured in past!!"
-            self.time = new_time  # Update time
-            self.elements[elem_ind].event_run()  # Run nearest event!
-            step += 1
\ No newline at end of file
+            self.step()
+            if checkpoint.due():
+                checkpoint.save(self)
+    
+    # Snapshots
+    def snapshot(self, level=6) -> bytes:
+        """Return full state of simulator (elements, event queues, schedule, random streams, ...) 
+            as compressed bytes. Elements must be picklable (e.g. detach `metrics.Recorder` first)."""
+        import pickle, zlib
+        return SNAPSHOT_MAGIC+zlib.compress(pickle.dumps(self, pickle.HIGHEST_PROTOCOL), level)
+    
+    @staticmethod
+    def restore(data:bytes):
+        """Return simulator of `snapshot` bytes. Reach elements by `elements` of returned simulator."""
+        assert data[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC, "Not a simulator snapshot."
+        import pickle, zlib
+        return pickle.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC):]))
+    
+    def save(self, path:str):
+        """Write snapshot to `path` atomically (a crash never leaves a partial file)."""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(self.snapshot())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    
+    @staticmethod
+    def load(path:str):
+        """Return simulator of snapshot file `path`."""
+        with open(path, 'rb') as file:
+            return Simulator.restore(file.read())
+    
+    def fork(self, seed=None):
+        """Return an independent copy of simulator (e.g. a what-if branch from a warmed-up state).
+            `seed`: if given, copy gets new random streams (see `reseed`), otherwise it replays same randomness."""
+        import pickle
+        simulator = pickle.loads(pickle.dumps(self, pickle.HIGHEST_PROTOCOL))
+        if seed is not None:
+            simulator.reseed(seed)
+        return simulator
+    
+    def reseed(self, seed):
+        """Replace random streams of elements with streams of master `seed`. Every `random.Random` named 
+            `rng` of elements, their layers (`L1`, `L2`, ...) and noise engines gets a new stream in element order."""
+        self.seed_seq = seed if isinstance(seed, Seed_sequence) else Seed_sequence(seed)
+        for elem in self.elements:
+            owners = [elem, getattr(elem, 'noise', None)]
+            owners += [getattr(elem, name, None) for name in getattr(elem, 'layer_names', ())]
+            for owner in owners:
+                if isinstance(getattr(owner, 'rng', None), random.Random):
+                    owner.rng = self.spawn_rng()
+                if getattr(owner, 'np_rng', None) is not None:
+                    owner.np_rng = None  # recreated from new `rng`
+
+
+SNAPSHOT_MAGIC = b'DNSIM1\n'  # snapshot format: magic + zlib(pickle(Simulator))
+
+
+class Checkpoint:
+    """Checkpoint policy of `Simulator.run`/`resume`: save snapshot to `path` every `every_events` 
+        events and/or every `every_seconds` seconds of wall clock time.
+        After a crash: `Simulator.load(path).resume(t_end, checkpoint)` continues the run exactly."""
+    
+    def __init__(self, path:str, every_events=None, every_seconds=None) -> None:
+        assert every_events or every_seconds, "Give `every_events` or `every_seconds`."
+        self.path = path
+        self.every_events = every_events
+        self.every_seconds = every_seconds
+        self.n_events = 0  # events since last checkpoint
+        self.last_save = None  # wall clock time of last checkpoint
+        self.n_saved = 0
+    
+    def start(self):
+        self.n_events = 0
+        self.last_save = _time.monotonic()
+    
+    def due(self) -> bool:
+        """Count one event and return whether a checkpoint is due."""
+        self.n_events += 1
+        if self.every_events and self.n_events >= self.every_events:
+            return True
+        if self.every_seconds and not self.n_events & 0xFF:  # check clock every 256 events
+            return _time.monotonic()-self.last_save >= self.every_seconds
+        return False
+    
+    def save(self, simulator:Simulator):
+        simulator.save(self.path)
+        self.n_saved += 1
+        self.start()
\ No newline at end of file
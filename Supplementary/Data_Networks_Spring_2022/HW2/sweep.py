@@ -0,0 +1,305 @@
+# Parameter sweep runner: grid of (p, R_T, D_p, divisor, packet_size, ARQ, timeout) x replications
+# Startup matters (replications run in fresh worker processes, CLI runs are short): process pool,
+# CLI and CSV modules are imported where they are used, NumPy only by the `batch` backend.
+import itertools
+import math
+import os
+import statistics
+import sys
+
+from simulator import Simulator, Seed_sequence
+from Layers import Node, Source, Sink, Source_Sink, PHY, Duplex_link
+from CRC import CRC, PRESETS, crc_tables, syndrome_table
+from DataLink import Stop_Wait_Tx, Stop_Wait_Rx, Go_BackN_Tx, Go_BackN_Rx, Selective_Repeat_Tx, Selective_Repeat_Rx, \
+    Go_BackN_Duplex
+from fast_forward import Stop_Wait_Fast_Forward
+
+# ARQ name -> (Tx DL factory(timeout, N_window), Rx DL factory(timeout, N_window), seq_nr bits(N_window))
+ARQ = {
+    'stop_wait': (lambda timeout, N_window: Stop_Wait_Tx(timeout), lambda timeout, N_window: Stop_Wait_Rx(),
+                  lambda N_window: 1),
+    'go_back_n': (Go_BackN_Tx, Go_BackN_Rx, lambda N_window: N_window.bit_length()),
+    'selective_repeat': (Selective_Repeat_Tx, Selective_Repeat_Rx, lambda N_window: (2*N_window-1).bit_length()),
+}
+
+# Sweep grid parameters and their default values
+GRID_DEFAULTS = {
+    'p': [1e-4],
+    'R_T': [1e6],
+    'D_p': [1e-3],
+    'divisor': [0xB],
+    'packet_size': [96],
+    'arq': ['stop_wait'],
+    'N_window': [1],  # window size of sliding window ARQs (Stop and Wait ignores it)
+    'timeout': [None],  # None: (2*D_p + ACK_size/R_T)*1.01 like `DL_simul.ipynb`
+}
+ACK_HEADER_SIZE = 8  # ACK header (ACK frame: header + seq_nr, see `Stop_Wait_Rx`)
+BACKENDS = ('event', 'fast_forward', 'batch')  # see `run_replication`
+
+
+def seq_bits(point:dict) -> int:
+    """Number of seq_nr bits in frames of `point` ARQ."""
+    return ARQ[point['arq']][2](point['N_window'])
+
+
+def frame_size(point:dict) -> int:
+    """Data frame size of `point`: payload + seq_nr + CRC."""
+    return point['packet_size']+seq_bits(point)+(point['divisor'].bit_length()-1)
+
+
+def ack_size(point:dict) -> int:
+    """ACK frame size of `point`: header + seq_nr + CRC (PHY adds CRC to ACKs too)."""
+    return ACK_HEADER_SIZE+seq_bits(point)+(point['divisor'].bit_length()-1)
+
+
+def auto_timeout(point:dict) -> float:
+    """Timeout of `point` if it is not given: round trip time of ACK + 1% margin."""
+    return (2*point['D_p'] + ack_size(point)/point['R_T'])*1.01
+
+
+def build_stop_wait(simulator:Simulator, p, R_T, D_p, divisor, packet_size, arq='stop_wait', N_window=1, timeout=None,
+                    noise=None, source=None, sink=None):
+    """Build `DL_simul.ipynb` network: Tx Node -> chann_tx -> Rx Node -> chann_rx -> Tx Node.
+        `noise`: factory of channel models (called once per channel, see `noise.Noise_model`), default BSC
+            with error probability `p` (`None` if `noise` is given).
+        `source`, `sink`: L3 of Tx and Rx Nodes (e.g. `traffic.Traffic_source`), default saturated
+        `Source(packet_size)` and `Sink()`.
+        Return `(node_tx, node_rx)`. Initial `DL start` event is added to Tx Node."""
+    if timeout is None:
+        timeout = auto_timeout({'D_p':D_p, 'R_T':R_T, 'divisor':divisor, 'arq':arq, 'N_window':N_window})
+    checker = CRC(divisor)
+    Tx_DL, Rx_DL, _ = ARQ[arq]
+    # Nodes
+    node_tx = Node(simulator)
+    node_rx = Node(simulator)
+    # Channel: 2 same channel (one per direction)
+    link = Duplex_link(p, R_T, D_p, noise)
+    link.bind_sim(simulator)
+    link.connect(node_tx, node_rx)
+    # Tx
+    node_tx.bind_element('L1', PHY(checker=checker))
+    node_tx.bind_element('L2', Tx_DL(timeout, N_window))
+    node_tx.bind_element('L3', Source(packet_size) if source is None else source)
+    # Rx
+    node_rx.bind_element('L1', PHY(checker=checker))
+    node_rx.bind_element('L2', Rx_DL(timeout, N_window))
+    node_rx.bind_element('L3', Sink() if sink is None else sink)
+    # Initializing event
+    node_tx.add_event((0, 'DL start', None))
+    return node_tx, node_rx
+
+
+def build_duplex(simulator:Simulator, p, R_T, D_p, divisor, packet_size, N_window=1, timeout=None, ack_delay=0.,
+                 noise=None):
+    """Build a link with traffic in both directions: Node A <-> `Duplex_link` <-> Node B, both with
+        `Go_BackN_Duplex` (ACKs piggybacked on data frames) and `Source_Sink`. `p`, `noise`: see `build_stop_wait`.
+        Default timeout: an ACK may wait for the reverse frame in transmission and then ride on the next one,
+        `(2*D_p + 2*L_d/R_T + ack_delay)` + 1% margin. Return `(node_a, node_b)`."""
+    if timeout is None:
+        L_d = packet_size+2*N_window.bit_length()+1+(divisor.bit_length()-1)  # payload + seq_nr + ack + kind + CRC
+        timeout = (2*D_p + 2*L_d/R_T + ack_delay)*1.01
+    checker = CRC(divisor)
+    node_a = Node(simulator)
+    node_b = Node(simulator)
+    link = Duplex_link(p, R_T, D_p, noise)
+    link.bind_sim(simulator)
+    link.connect(node_a, node_b)
+    for node in (node_a, node_b):
+        node.bind_element('L1', PHY(checker=checker))
+        node.bind_element('L2', Go_BackN_Duplex(timeout, N_window, ack_delay))
+        node.bind_element('L3', Source_Sink(packet_size))
+        node.add_event((0, 'DL start', None))
+    return node_a, node_b
+
+
+def theory(point:dict) -> dict:
+    """Closed-form utilization of `point`.
+        `P = 1-(1-p)^L`: frame error probability (`1-p*L` of `DL_simul.ipynb` is its first order, negative for p*L > 1).
+        Stop and Wait: `D_T/(D_T+2*D_p)*(1-P)`.
+        Sliding window (a = D_p/D_T, K = 1+2a):
+            Go Back N: (1-P)/(1+2aP) if N >= K else N(1-P)/(K(1-P+NP)),
+            Selective Repeat: 1-P if N >= K else N(1-P)/K."""
+    L = frame_size(point)
+    D_T = L/point['R_T']
+    P = 1-(1-point['p'])**L
+    if point['arq'] == 'stop_wait':
+        ideal = D_T/(D_T+2*point['D_p'])
+        return {'theory_ideal': ideal, 'theory_noisy': ideal*(1-P)}
+    N = point['N_window']
+    a = point['D_p']/D_T
+    K = 1+2*a
+    ideal = min(1.0, N/K)
+    if point['arq'] == 'go_back_n':
+        noisy = (1-P)/(1+2*a*P) if N >= K else N*(1-P)/(K*(1-P+N*P))
+    else:
+        noisy = 1-P if N >= K else N*(1-P)/K
+    return {'theory_ideal': ideal, 'theory_noisy': noisy}
+
+
+def run_replication(point:dict, seed, t_end, backend='event') -> dict:
+    """Run one replication of `point` until `t_end` and return its metrics.
+        `backend`: `event`: event-driven `Simulator`, `fast_forward`: skip error-free cycles analytically 
+            (`Stop_Wait_Fast_Forward`), `batch`: NumPy arrays of attempts (`monte_carlo.Stop_Wait_Batch`).
+            Only Stop and Wait has `fast_forward` and `batch` backends, other ARQs always run event-driven."""
+    assert backend in BACKENDS, f'unknown backend: {backend}'
+    if backend == 'batch' and point['arq'] == 'stop_wait':
+        from monte_carlo import Stop_Wait_Batch  # NumPy is imported only here
+        seed_seq = seed if isinstance(seed, Seed_sequence) else Seed_sequence(seed)
+        timeout = auto_timeout(point) if point['timeout'] is None else point['timeout']
+        link = Stop_Wait_Batch(point['p'], point['R_T'], point['D_p'], point['divisor'], point['packet_size'], timeout)
+        delivered = link.run(t_end, seed_seq)['delivered']
+    else:
+        simulator = Simulator(seed)
+        node_tx, node_rx = build_stop_wait(simulator, **point)
+        if backend == 'fast_forward' and point['arq'] == 'stop_wait':
+            Stop_Wait_Fast_Forward(simulator, node_tx, node_rx).run(t_end)
+        else:
+            simulator.run(t_end)
+        delivered = node_rx.L3.counter
+    return {'delivered': delivered, 'utilization': delivered*frame_size(point)/point['R_T']/t_end}
+
+
+def _run_task(task):
+    """Process pool entry point."""
+    point_ind, point, seed, t_end, backend = task
+    return point_ind, run_replication(point, seed, t_end, backend)
+
+
+def warm_worker(divisors, backend='event'):
+    """Process pool initializer: import backend modules and build CRC tables of `divisors` once per worker,
+        before its first replication (tables are cached per process, see `CRC.crc_tables`)."""
+    for divisor in divisors:
+        crc_tables(divisor, CRC(divisor).n_slices)
+    if backend == 'batch':
+        import monte_carlo  # NumPy
+        for divisor in divisors:
+            syndrome_table(divisor, 1)
+
+
+def t_quantile(q:float, df:int) -> float:
+    """Quantile `q` of Student's t distribution with `df` degrees of freedom.
+        Exact for df=1, 2, Cornish-Fisher expansion (Abramowitz & Stegun 26.7.5) otherwise."""
+    if df == 1:
+        return math.tan(math.pi*(q-0.5))
+    if df == 2:
+        return (2*q-1)/math.sqrt(2*q*(1-q))
+    z = statistics.NormalDist().inv_cdf(q)
+    g1 = (z**3+z)/4
+    g2 = (5*z**5+16*z**3+3*z)/96
+    g3 = (3*z**7+19*z**5+17*z**3-15*z)/384
+    g4 = (79*z**9+776*z**7+1482*z**5-1920*z**3-945*z)/92160
+    return z+g1/df+g2/df**2+g3/df**3+g4/df**4
+
+
+def summarize(values, confidence=0.95) -> dict:
+    """Mean, sample std and t confidence interval of `values`."""
+    n = len(values)
+    mean = statistics.fmean(values)
+    if n < 2:
+        return {'n': n, 'mean': mean, 'std': float('nan'), 'ci_low': float('nan'), 'ci_high': float('nan')}
+    std = statistics.stdev(values)
+    half = t_quantile((1+confidence)/2, n-1)*std/math.sqrt(n)
+    return {'n': n, 'mean': mean, 'std': std, 'ci_low': mean-half, 'ci_high': mean+half}
+
+
+def grid_points(grid:dict):
+    """Cartesian product of `grid` (missing parameters get `GRID_DEFAULTS`). Return list of points."""
+    unknown = set(grid)-set(GRID_DEFAULTS)
+    assert not unknown, f'unknown sweep parameters: {unknown}'
+    names = list(GRID_DEFAULTS)
+    values = [list(grid.get(name, GRID_DEFAULTS[name])) for name in names]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def sweep(grid:dict, replications=10, t_end=10, seed=0, workers=None, confidence=0.95, chunksize=None, backend='event'):
+    """Run all points of `grid` with `replications` independent replications each and return tidy rows
+        (one dict per point: parameters, utilization stats + confidence interval, theory values).
+        `seed`: master seed. Replication `k` of point `i` uses child `(i, k)` of master seed, so results
+            do not depend on `workers`.
+        `workers`: process pool size (None: all CPUs, 0: run in this process).
+        `backend`: simulation backend of replications (see `run_replication`)."""
+    points = grid_points(grid)
+    master = Seed_sequence(seed)
+    tasks = []
+    for point_ind, (point, point_seed) in enumerate(zip(points, master.spawn(len(points)))):
+        for rep_seed in point_seed.spawn(replications):
+            tasks.append((point_ind, point, rep_seed, t_end, backend))
+    results = [[] for _ in points]
+    if workers == 0:
+        outputs = map(_run_task, tasks)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        n_workers = workers or os.cpu_count() or 1
+        divisors = sorted(set(point['divisor'] for point in points))
+        pool = ProcessPoolExecutor(max_workers=n_workers, initializer=warm_worker, initargs=(divisors, backend))
+        if chunksize is None:
+            chunksize = max(1, len(tasks)//(4*n_workers))
+        outputs = pool.map(_run_task, tasks, chunksize=chunksize)
+    try:
+        for point_ind, metrics in outputs:
+            results[point_ind].append(metrics)
+    finally:
+        if workers != 0:
+            pool.shutdown()
+    rows = []
+    for point, reps in zip(points, results):
+        row = dict(point)
+        row['timeout'] = auto_timeout(point) if point['timeout'] is None else point['timeout']
+        row['delivered'] = statistics.fmean(rep['delivered'] for rep in reps)
+        stats = summarize([rep['utilization'] for rep in reps], confidence)
+        row.update({'utilization' if key == 'mean' else key: value for key, value in stats.items()})
+        row.update(theory(point))
+        rows.append(row)
+    return rows
+
+
+def write_csv(rows, file):
+    """Write tidy `rows` as CSV to `file` (file object)."""
+    import csv
+    if not rows:
+        return
+    writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def parse_divisor(text:str) -> int:
+    """`0xB`, `11` or preset name e.g. `CRC-8`."""
+    return PRESETS[text] if text in PRESETS else int(text, 0)
+
+
+def parse_timeout(text:str):
+    """`auto` or seconds."""
+    return None if text == 'auto' else float(text)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Sweep data link simulations over a parameter grid.')
+    parser.add_argument('--p', type=float, nargs='+', default=GRID_DEFAULTS['p'], help='bit error probability')
+    parser.add_argument('--R_T', type=float, nargs='+', default=GRID_DEFAULTS['R_T'], help='transmission rate')
+    parser.add_argument('--D_p', type=float, nargs='+', default=GRID_DEFAULTS['D_p'], help='propagation delay')
+    parser.add_argument('--divisor', type=parse_divisor, nargs='+', default=GRID_DEFAULTS['divisor'], help='CRC divisor e.g. 0xB, CRC-8')
+    parser.add_argument('--packet_size', type=int, nargs='+', default=GRID_DEFAULTS['packet_size'])
+    parser.add_argument('--arq', choices=list(ARQ), nargs='+', default=GRID_DEFAULTS['arq'])
+    parser.add_argument('--N_window', type=int, nargs='+', default=GRID_DEFAULTS['N_window'], help='sliding window size')
+    parser.add_argument('--timeout', type=parse_timeout, nargs='+', default=GRID_DEFAULTS['timeout'], help='seconds or auto')
+    parser.add_argument('--reps', type=int, default=10, help='replications per point')
+    parser.add_argument('--t_end', type=float, default=10, help='simulation time of each replication')
+    parser.add_argument('--seed', type=int, default=0, help='master seed')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size (0: no pool)')
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--backend', choices=BACKENDS, default='event', help='Stop and Wait simulation backend')
+    parser.add_argument('--out', default=None, help='output CSV file (default: stdout)')
+    args = parser.parse_args(argv)
+    grid = {name: getattr(args, name) for name in GRID_DEFAULTS}
+    rows = sweep(grid, args.reps, args.t_end, args.seed, args.workers, args.confidence, backend=args.backend)
+    if args.out is None:
+        write_csv(rows, sys.stdout)
+    else:
+        with open(args.out, 'w', newline='') as file:
+            write_csv(rows, file)
+
+
+if __name__ == '__main__':
+    main()
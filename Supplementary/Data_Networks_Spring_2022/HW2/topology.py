@@ -0,0 +1,327 @@
+# Multi-node topologies: routers with multiple interfaces, connected by ARQ links
+from collections import Counter, deque
+
+from simulator import Simulator
+from Layers import Node, PHY, Channel, Frame, SAP_data
+from CRC import CRC
+from sweep import ARQ, auto_timeout
+
+
+class Link:
+    """Directed ARQ link `src -> dst`: an interface Node at each end (PHY + DL + `Port`), a data channel
+        (`src` -> `dst`) and an ACK channel (`dst` -> `src`). Same wiring as `sweep.build_stop_wait`.
+        Element order: Tx Node, Rx Node, data channel, ACK channel (see `Topology.element_parts`)."""
+
+    def __init__(self, simulator:Simulator, src_router, dst_router, checker:CRC, p, R_T, D_p,
+                 arq='stop_wait', N_window=1, timeout=None, noise=None) -> None:
+        """`noise`: factory of channel models (see `sweep.build_stop_wait`), default BSC with error probability `p`
+                (`None` if `noise` is given).
+            An end given as `Remote_router` is built elsewhere: its interface Node is reserved
+            (`Simulator.reserve`, attribute is `None`), both channels are built. Links with two remote ends
+            are only reserved."""
+        src_end, dst_end = not isinstance(src_router, Remote_router), not isinstance(dst_router, Remote_router)
+        self.tx_node = Node(simulator) if src_end else simulator.reserve(1)
+        self.rx_node = Node(simulator) if dst_end else simulator.reserve(1)
+        if not (src_end or dst_end):
+            self.data_chann = self.ack_chann = simulator.reserve(2, n_rngs=2)
+            return
+        if timeout is None:
+            timeout = auto_timeout({'D_p': D_p, 'R_T': R_T, 'divisor': checker.divisor, 'arq': arq, 'N_window': N_window})
+        Tx_DL, Rx_DL, _ = ARQ[arq]
+        self.data_chann = Channel(p, R_T, D_p, None if noise is None else noise())
+        self.ack_chann = Channel(p, R_T, D_p, None if noise is None else noise())
+        self.data_chann.bind_sim(simulator)
+        self.ack_chann.bind_sim(simulator)
+        # Tx interface of `src`
+        if src_end:
+            self.tx_node.bind_channels(self.data_chann, self.ack_chann)
+            self.tx_node.bind_element('L1', PHY(checker=checker))
+            self.tx_node.bind_element('L2', Tx_DL(timeout, N_window))
+            self.tx_node.bind_element('L3', Port(src_router, dst_router.address))
+        # Rx interface of `dst`
+        if dst_end:
+            self.rx_node.bind_channels(self.ack_chann, self.data_chann)
+            self.rx_node.bind_element('L1', PHY(checker=checker))
+            self.rx_node.bind_element('L2', Rx_DL(timeout, N_window))
+            self.rx_node.bind_element('L3', Port(dst_router, src_router.address))
+
+
+class Remote_router:
+    """End of a `Link` whose router is built in another partition: only its address is known."""
+    __slots__ = ('address',)
+
+    def __init__(self, address:int) -> None:
+        self.address = address
+
+
+class Port:
+    """L3 element of an interface Node: connects DL of one link to the `Router` of its end.
+        Tx interface: DL pulls packets (`'push'` requests). Rx interface: DL delivers packets."""
+
+    def __init__(self, router, neighbor:int) -> None:
+        """`router`: router of this end of link. `neighbor`: address of router at other end."""
+        self.router = router
+        self.neighbor = neighbor
+        self.Node = None
+
+    def assign_Node(self, Node:Node):
+        self.Node = Node
+
+    def call_from_L2(self, IDU):
+        """DL requests a packet (`'push'`) or delivers one (`None`)."""
+        IDU = SAP_data.of(IDU)
+        if IDU.SDU == 'push':
+            packet = self.router.next_packet(self.neighbor)
+            if packet is not None:  # else: DL waits for `wakeup`
+                self.Node.from_L3_to_L2(SAP_data(packet))
+        elif IDU.SDU is None:
+            self.router.forward(IDU.PDU)
+        else:
+            raise ValueError(f"Unknown IDU for L3 {IDU}")
+
+
+class Router:
+    """L3 forwarding element of a topology node. Packets carry `src` and `dst` addresses in their tail
+        (`addr_bits` each, `dst` last). A packet for another node is queued (FIFO) on the interface of its
+        next hop (shortest path, see `Topology.next_hops`), forwarding is O(1) per hop.
+        Flows (`Topology.add_flow`) are greedy: when an interface has no queued packet, a new packet of one of
+        its flows is generated (round robin), like `Source` of `DL_simul.ipynb`."""
+
+    def __init__(self, topology, address:int, rng) -> None:
+        self.topology = topology
+        self.address = address
+        self.rng = rng  # random stream of payloads
+        self.ports = {}  # neighbor address -> Port of Tx interface
+        self.queues = {}  # neighbor address -> queued packets
+        self.flows = {}  # neighbor address (first hop) -> destinations of flows
+        self.delivered = Counter()  # source address -> delivered packets
+        self.forwarded = 0
+        self.generated = 0
+        self.dropped = 0  # packets with unknown destination (undetected errors in address)
+
+    def add_port(self, port:Port):
+        self.ports[port.neighbor] = port
+        self.queues[port.neighbor] = deque()
+
+    def new_packet(self, dst:int) -> Frame:
+        topology = self.topology
+        packet = Frame(self.rng.getrandbits(topology.packet_size), topology.packet_size)
+        self.generated += 1
+        return packet.add_header(self.address, topology.addr_bits).add_header(dst, topology.addr_bits)
+
+    def next_packet(self, neighbor:int):
+        """Packet for interface to `neighbor`: queued packet, else a new packet of a flow, else `None`."""
+        queue = self.queues[neighbor]
+        if queue:
+            return queue.popleft()
+        flows = self.flows.get(neighbor)
+        if flows:
+            flows.rotate(-1)
+            return self.new_packet(flows[-1])
+        return None
+
+    def forward(self, packet:Frame):
+        """Deliver `packet` here or queue it on interface of next hop."""
+        topology = self.topology
+        dst = packet.frame & topology.addr_mask
+        if dst >= len(topology.ids):
+            self.dropped += 1
+            return
+        if dst == self.address:
+            self.delivered[(packet.frame>>topology.addr_bits) & topology.addr_mask] += 1
+            return
+        routes = topology.routes.get(dst)
+        if routes is None:
+            routes = topology.next_hops(dst)
+        neighbor = routes[self.address]
+        assert neighbor is not None, f"No route from {topology.ids[self.address]} to {topology.ids[dst]}"
+        self.queues[neighbor].append(packet)
+        self.forwarded += 1
+        self.ports[neighbor].Node.L2.wakeup()
+
+
+class Topology:
+    """Network of `Router`s built from an edge list. Each edge is a pair of directed ARQ `Link`s
+        (4 interface Nodes and 4 Channels), so each router has one interface per neighbor.
+        Construction is O(1) per edge. Routing tables (next hop to each destination, BFS shortest path in
+        hops) are computed per destination on first use and cached, or all at once by `build_routes`."""
+
+    def __init__(self, simulator:Simulator, edges, p=None, R_T=1e6, D_p=1e-3, divisor=0xB, packet_size=96,
+                 arq='stop_wait', N_window=1, timeout=None, directed=False, noise=None, parts=None, part=None) -> None:
+        """`edges`: iterable of `(u, v)` or `(u, v, params)`; node ids are any hashable. `params` overrides
+                link parameters of this edge (`p`, `R_T`, `D_p`, `arq`, `N_window`, `timeout`, `noise`).
+            `p`, `noise`: channel model of links, BSC with error probability `p` (default 1e-4) or `noise` factory
+                (not both). An edge that sets one of them replaces the other.
+            `directed`: if `False`, each edge is a link in both directions.
+            `parts`: partition of each node id (e.g. `parallel.partition_topology`), fills `element_parts`.
+            `part`: build only routers of partition `part` (others are `None`), their interface Nodes and channels
+                of their links. Indices and random streams of other elements are reserved, so built elements are
+                those of a full build (`parallel.Parallel_simulator`)."""
+        self.simulator = simulator
+        self.packet_size = packet_size
+        self.checker = CRC(divisor)
+        if p is None and noise is None:
+            p = 1e-4
+        defaults = {'p': p, 'R_T': R_T, 'D_p': D_p, 'arq': arq, 'N_window': N_window, 'timeout': timeout,
+                    'noise': noise}
+        edges = [edge if len(edge) == 3 else (edge[0], edge[1], {}) for edge in edges]
+        # Addresses
+        self.index = {}  # node id -> address
+        self.ids = []  # address -> node id
+        for u, v, _ in edges:
+            for node_id in (u, v):
+                if node_id not in self.index:
+                    self.index[node_id] = len(self.ids)
+                    self.ids.append(node_id)
+        self.addr_bits = max(1, (len(self.ids)-1).bit_length())
+        self.addr_mask = (1<<self.addr_bits)-1
+        self.parts = None if parts is None else [parts[node_id] for node_id in self.ids]  # address -> partition
+        self.part = part
+        self.element_parts = {}  # element index -> partition (if `parts` is given), a Channel is in partition of its Rx Node
+        self.routers = []
+        for address in range(len(self.ids)):
+            if self.built(address):
+                self.routers.append(Router(self, address, simulator.spawn_rng()))
+            else:
+                simulator.reserve(n_rngs=1)
+                self.routers.append(None)
+        # Links
+        self.links = {}  # (u address, v address) -> Link
+        self.adjacency = [[] for _ in self.ids]  # address -> addresses of neighbors (outgoing links)
+        self.reverse = [[] for _ in self.ids]  # address -> addresses of incoming links
+        for u, v, params in edges:
+            pairs = [(u, v)] if directed else [(u, v), (v, u)]
+            link_params = {**defaults, **params}
+            if ('p' in params) != ('noise' in params):  # channel model of edge replaces default one
+                link_params['noise' if 'p' in params else 'p'] = None
+            for a, b in pairs:
+                self.add_link(self.index[a], self.index[b], link_params)
+        self.routes = {}  # destination address -> next hop of each address
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def built(self, address:int) -> bool:
+        """Whether router `address` is built here (see `part`)."""
+        return self.part is None or self.parts[address] == self.part
+
+    def add_link(self, src:int, dst:int, params:dict):
+        assert (src, dst) not in self.links, f"Duplicate link {self.ids[src]} -> {self.ids[dst]}"
+        first = len(self.simulator.elements)
+        src_router = self.routers[src] or Remote_router(src)
+        dst_router = self.routers[dst] or Remote_router(dst)
+        link = Link(self.simulator, src_router, dst_router, self.checker, **params)
+        self.links[(src, dst)] = link
+        if self.parts is not None:
+            src_part, dst_part = self.parts[src], self.parts[dst]
+            for offset, elem_part in enumerate((src_part, dst_part, dst_part, src_part)):
+                self.element_parts[first+offset] = elem_part
+        if self.routers[src] is not None:
+            self.routers[src].add_port(link.tx_node.L3)
+        self.adjacency[src].append(dst)
+        self.reverse[dst].append(src)
+        self.routes = {}  # topology changed
+
+    def router(self, node_id) -> Router:
+        """Router of `node_id` (`None` if it is built in another partition)."""
+        return self.routers[self.index[node_id]]
+
+    def next_hops(self, dst:int):
+        """Routing table of destination address `dst`: list of next hop address of each address
+            (`None`: unreachable or `dst` itself). BFS from `dst` over incoming links: O(nodes+links), cached."""
+        routes = self.routes.get(dst)
+        if routes is not None:
+            return routes
+        routes = [None]*len(self.ids)
+        visited = [False]*len(self.ids)
+        visited[dst] = True
+        frontier = deque([dst])
+        reverse = self.reverse
+        while frontier:
+            node = frontier.popleft()
+            for prev in reverse[node]:
+                if not visited[prev]:
+                    visited[prev] = True
+                    routes[prev] = node  # first hop of `prev` towards `dst`
+                    frontier.append(prev)
+        self.routes[dst] = routes
+        return routes
+
+    def build_routes(self):
+        """Compute routing tables of all destinations (O(nodes*(nodes+links)))."""
+        for dst in range(len(self.ids)):
+            self.next_hops(dst)
+
+    def path(self, src, dst) -> list:
+        """Node ids on shortest path from node `src` to node `dst`."""
+        src, dst = self.index[src], self.index[dst]
+        routes = self.next_hops(dst)
+        path = [src]
+        while path[-1] != dst:
+            hop = routes[path[-1]]
+            assert hop is not None, f"No route from {self.ids[src]} to {self.ids[dst]}"
+            path.append(hop)
+        return [self.ids[node] for node in path]
+
+    def add_flow(self, src, dst):
+        """Greedy flow of packets from node `src` to node `dst` (see `Router`). Only routers that are built
+            here generate packets."""
+        src, dst = self.index[src], self.index[dst]
+        assert src != dst, "Flow source and destination must differ."
+        router = self.routers[src]
+        if router is None:
+            return
+        first_hop = self.next_hops(dst)[src]
+        assert first_hop is not None, f"No route from {self.ids[src]} to {self.ids[dst]}"
+        router.flows.setdefault(first_hop, deque()).append(dst)
+        router.ports[first_hop].Node.L2.wakeup()
+
+    def delivered(self) -> Counter:
+        """Delivered packets of each `(src, dst)` node id pair (`src` is `None` if its address is unknown).
+            Only routers that are built here are counted."""
+        counts = Counter()
+        n = len(self.ids)
+        for router in self.routers:
+            if router is None:
+                continue
+            for src, count in router.delivered.items():
+                counts[(self.ids[src] if src < n else None, self.ids[router.address])] += count
+        return counts
+
+
+def build_topology(simulator:Simulator, edges, flows=(), parts=None, part=None, **params) -> Topology:
+    """Build `Topology` of `edges` (link parameters `params`) and add greedy `flows` (`(src, dst)` pairs).
+        Picklable builder (with `functools.partial`) for `parallel.Parallel_simulator`: `parts`, `part` build
+        one partition (see `Topology`)."""
+    topology = Topology(simulator, edges, parts=parts, part=part, **params)
+    for src, dst in flows:
+        topology.add_flow(src, dst)
+    return topology
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    # Ring of `n` nodes with random chords, flows between random node pairs
+    n, n_chords, n_flows, t_end = 1000, 500, 200, 0.2
+    rng = random.Random(0)
+    edges = [(i, (i+1) % n) for i in range(n)]
+    chords = set()
+    while len(chords) < n_chords:
+        u, v = sorted(rng.sample(range(n), 2))
+        if v-u not in (1, n-1):
+            chords.add((u, v))
+    edges += sorted(chords)
+    t0 = time.time()
+    simulator = Simulator(1)
+    topology = Topology(simulator, edges)
+    flows = [tuple(rng.sample(range(n), 2)) for _ in range(n_flows)]
+    for src, dst in flows:
+        topology.add_flow(src, dst)
+    t1 = time.time()
+    simulator.run(t_end)
+    t2 = time.time()
+    hops = sum(len(topology.path(src, dst))-1 for src, dst in flows)/n_flows
+    delivered = topology.delivered()
+    print(f"{n} nodes, {len(edges)} edges, {len(simulator.elements)} elements: build {t1-t0:.2f} s, run {t2-t1:.2f} s")
+    print(f"mean hops {hops:.2f}, delivered {sum(delivered.values())}, forwarded {sum(r.forwarded for r in topology.routers)}")
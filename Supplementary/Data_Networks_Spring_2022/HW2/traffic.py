@@ -0,0 +1,301 @@
+# L3 traffic: arrival processes (Poisson, on/off, trace), bounded backlog in front of DL, latency of packets
+# Unlike `Layers.Source` (saturated: a packet whenever DL pulls one), packets arrive by their own events and
+# wait in backlog, so queueing delay and throughput under load can be measured.
+from collections import deque
+from math import inf
+import random
+
+from simulator import Simulator, register_event
+from Layers import Frame, SAP_data, Sink
+from metrics import Online_stats, Log_histogram
+from sweep import build_stop_wait
+
+L3_ARRIVAL = register_event('L3 arrival')  # data: packet size
+ARRIVAL_BLOCK = 4096  # arrival times drawn per NumPy call
+POLICIES = ('drop_tail', 'drop_head', 'backpressure')  # full backlog policies, see `Traffic_source`
+
+
+## Arrival processes
+# `draw(np_rng, n)` returns next `n` arrival times (process time: starts at 0, ascending) and their packet
+# sizes (`None`: sizes of source). Fewer times: process ends after them (trace).
+class Poisson_arrivals:
+    """Poisson arrivals of `rate` packets/s (exponential inter-arrival times)."""
+    def __init__(self, rate) -> None:
+        assert rate > 0, "Rate must be positive."
+        self.rate = rate
+        self.t_last = 0.  # process time of latest drawn arrival
+
+    @property
+    def mean_rate(self) -> float:
+        return self.rate
+
+    def draw(self, np_rng, n:int) -> tuple:
+        times = self.t_last+np_rng.exponential(1/self.rate, n).cumsum()
+        self.t_last = float(times[-1])
+        return times.tolist(), None
+
+
+class On_off_arrivals:
+    """Poisson arrivals of `rate` packets/s during on periods, none during off periods. Periods are exponential
+        with means `mean_on`, `mean_off`; process starts with an on period.
+        Vectorized: arrivals are drawn on "on time" axis (Poisson of `rate`), then each one is shifted by total
+        off time before its on period (`searchsorted` of period ends)."""
+    def __init__(self, rate, mean_on, mean_off) -> None:
+        assert rate > 0 and mean_on > 0 and mean_off >= 0, "Invalid on/off parameters."
+        self.rate = rate
+        self.mean_on = mean_on
+        self.mean_off = mean_off
+        self.t_on = 0.  # on time of latest drawn arrival
+        self.ends = None  # on time of end of drawn on periods (from period of latest arrival)
+        self.off_before = None  # total off time before each of `ends` periods
+        self.last_end = 0.  # on time of end of last drawn period
+        self.next_off = 0.  # total off time before next (not drawn) period
+
+    @property
+    def mean_rate(self) -> float:
+        return self.rate*self.mean_on/(self.mean_on+self.mean_off)
+
+    def draw(self, np_rng, n:int) -> tuple:
+        import numpy as np
+        t_on = self.t_on+np_rng.exponential(1/self.rate, n).cumsum()
+        self.t_on = float(t_on[-1])
+        ends, off_before = [], []
+        if self.ends is not None:
+            ends.append(self.ends)
+            off_before.append(self.off_before)
+        while self.last_end <= self.t_on:  # draw on periods until latest arrival
+            k = int(n/(self.rate*self.mean_on))+16
+            on = np_rng.exponential(self.mean_on, k).cumsum()+self.last_end
+            off = np_rng.exponential(self.mean_off, k).cumsum()+self.next_off
+            ends.append(on)
+            off_before.append(np.concatenate(([self.next_off], off[:-1])))
+            self.last_end, self.next_off = float(on[-1]), float(off[-1])
+        ends, off_before = np.concatenate(ends), np.concatenate(off_before)
+        period = np.searchsorted(ends, t_on, side='right')
+        times = t_on+off_before[period]
+        self.ends, self.off_before = ends[period[-1]:], off_before[period[-1]:]  # passed periods are dropped
+        return times.tolist(), None
+
+
+class Trace_arrivals:
+    """Arrivals of a trace: ascending arrival `times` (s) and optional packet `sizes` (bits).
+        Network has no event after trace is delivered (`Simulator.run` raises), so `t_end` should be in trace."""
+    def __init__(self, times, sizes=None) -> None:
+        self.times = list(times)
+        self.sizes = None if sizes is None else list(sizes)
+        assert self.sizes is None or len(self.sizes) == len(self.times), "One size per arrival."
+        assert all(a <= b for a, b in zip(self.times, self.times[1:])), "Arrival times must be ascending."
+        self.pos = 0
+
+    @classmethod
+    def from_file(cls, path:str):
+        """Load trace of text file: one arrival per line, `time [size]` (whitespace separated, `#` comments)."""
+        times, sizes = [], []
+        with open(path) as file:
+            for line in file:
+                fields = line.split('#', 1)[0].split()
+                if fields:
+                    times.append(float(fields[0]))
+                    sizes.append(int(fields[1]) if len(fields) > 1 else None)
+        has_sizes = [size is not None for size in sizes]
+        if any(has_sizes) and not all(has_sizes):
+            raise ValueError(f"Trace {path}: either all or none of arrivals have a size.")
+        return cls(times, sizes if all(has_sizes) and sizes else None)
+
+    @property
+    def mean_rate(self) -> float:
+        return len(self.times)/self.times[-1] if self.times and self.times[-1] > 0 else float('nan')
+
+    def draw(self, np_rng, n:int) -> tuple:
+        start, self.pos = self.pos, min(self.pos+n, len(self.times))
+        return self.times[start:self.pos], None if self.sizes is None else self.sizes[start:self.pos]
+
+
+## L3 elements
+class Traffic_source:
+    """L3 traffic generator. Packets arrive by `arrivals` process (own `'L3 arrival'` events, times drawn in
+        blocks of `block`), wait in a FIFO backlog of at most `limit` packets and are passed to L2 when it pulls
+        one (`'push'`). An arrival to empty backlog wakes up L2 (`DataLink.wakeup`).
+        `packet_size`: bits per packet (int), or `(sizes, probs)` for random sizes (ignored if trace has sizes).
+        `policy` of full backlog: `'drop_tail'` drops arriving packet, `'drop_head'` drops oldest packet,
+            `'backpressure'` holds arriving packet in source and pauses arrivals until L2 pulls a packet
+            (later arrivals are shifted by pause, held packet keeps its arrival time).
+        Packets carry their arrival time (`Frame.t_gen`), see `Traffic_sink`. Arrivals start at `t_start`."""
+    def __init__(self, arrivals, packet_size=96, limit=None, policy='drop_tail', t_start=0., block=ARRIVAL_BLOCK) -> None:
+        assert policy in POLICIES, f"Unknown backlog policy: {policy}"
+        assert limit is None or limit >= 1, "Backlog must hold at least one packet."
+        self.arrivals = arrivals
+        self.packet_size = packet_size
+        self.limit = inf if limit is None else limit
+        self.policy = policy
+        self.block = block
+        self.offset = t_start  # simulation time of process time 0 (grows by backpressure pauses)
+        self.backlog = deque()
+        self.times, self.sizes, self.pos = [], [], 0  # drawn arrivals, next one is `pos`
+        self.held = None  # (packet, hold time) under backpressure
+        self.generated, self.dropped, self.sent, self.max_backlog = 0, 0, 0, 0
+        self.Node = None
+        self.rng = random  # random stream of information bits
+        self.np_rng = None  # arrival times and sizes (created from `rng` on first use)
+
+    def assign_Node(self, Node):
+        """Assign this source to `Node` and schedule first arrival."""
+        self.Node = Node
+        self.rng = Node.simulator.spawn_rng()
+        self.np_rng = None
+        self.schedule_arrival()
+
+    def event_handlers(self) -> dict:
+        return {L3_ARRIVAL: self.arrival}
+
+    def get_np_rng(self):
+        """Return NumPy generator of arrivals. NumPy is imported only here."""
+        if self.np_rng is None:
+            import numpy as np
+            self.np_rng = np.random.default_rng(self.rng.getrandbits(128))
+        return self.np_rng
+
+    def draw_sizes(self, n:int) -> list:
+        if isinstance(self.packet_size, int):
+            return [self.packet_size]*n
+        sizes, probs = self.packet_size
+        return self.get_np_rng().choice(sizes, n, p=probs).tolist()
+
+    def schedule_arrival(self):
+        """Add event of next arrival. Draw a new block of arrivals if drawn ones are used."""
+        if self.pos == len(self.times):
+            self.times, self.sizes = self.arrivals.draw(self.get_np_rng(), self.block)
+            self.pos = 0
+            if not self.times:  # process ended
+                return
+            if self.sizes is None:
+                self.sizes = self.draw_sizes(len(self.times))
+        self.Node.add_event((self.times[self.pos]+self.offset, L3_ARRIVAL, self.sizes[self.pos]))
+        self.pos += 1
+
+    def arrival(self, size:int):
+        """A packet of `size` bits arrives: queue it (or apply `policy`) and schedule next arrival."""
+        now = self.Node.get_sim_time()
+        packet = Frame(self.rng.getrandbits(size), size, now)
+        self.generated += 1
+        backlog = self.backlog
+        if len(backlog) >= self.limit:
+            if self.policy == 'backpressure':
+                self.held = (packet, now)  # arrivals resume in `send_packet`
+                return
+            self.dropped += 1
+            if self.policy == 'drop_tail':
+                return self.schedule_arrival()
+            backlog.popleft()
+        backlog.append(packet)
+        if len(backlog) > self.max_backlog:
+            self.max_backlog = len(backlog)
+        self.schedule_arrival()
+        if len(backlog) == 1:  # L2 may be waiting for packets
+            self.Node.L2.wakeup()
+
+    def send_packet(self):
+        """Pass oldest packet of backlog to L2. Resume arrivals if they were paused by backpressure."""
+        packet = self.backlog.popleft()
+        self.sent += 1
+        if self.held is not None:
+            held, t_hold = self.held
+            self.held = None
+            self.backlog.append(held)
+            self.offset += self.Node.get_sim_time()-t_hold
+            self.schedule_arrival()
+        self.Node.from_L3_to_L2(SAP_data(packet))
+
+    def call_from_L2(self, IDU):
+        """L2 requests a packet (`'push'`). Nothing is passed if backlog is empty (L2 waits for `wakeup`)."""
+        if SAP_data.of(IDU).SDU == 'push':
+            if self.backlog:
+                self.send_packet()
+        else:
+            raise ValueError(f"Unknown IDU for L3 {IDU}")
+
+    def summary(self) -> dict:
+        return {'generated': self.generated, 'dropped': self.dropped, 'sent': self.sent,
+                'backlog': len(self.backlog), 'max_backlog': self.max_backlog,
+                'drop_ratio': self.dropped/self.generated if self.generated else float('nan')}
+
+
+class Traffic_sink(Sink):
+    """`Sink` that measures delivered bits and latency of packets (arrival in source, `Frame.t_gen`, to
+        delivery): mean/std in `latency`, distribution (quantiles) in `latency_hist`."""
+    def __init__(self, sub_buckets=64) -> None:
+        super().__init__()
+        self.bits = 0
+        self.latency = Online_stats()
+        self.latency_hist = Log_histogram(sub_buckets)
+
+    def recv_packet(self, PDU):
+        self.counter += 1
+        self.bits += PDU.frame_size
+        if PDU.t_gen is not None:
+            delay = self.Node.get_sim_time()-PDU.t_gen
+            self.latency.add(delay)
+            self.latency_hist.add(delay)
+
+    def summary(self, t_end, quantiles=(0.5, 0.9, 0.99)) -> dict:
+        """Delivered packets, throughput (bit/s) until `t_end` and latency statistics."""
+        return {'delivered': self.counter, 'throughput': self.bits/t_end,
+                'latency': {**self.latency.to_dict(), **self.latency_hist.to_dict(quantiles)}}
+
+
+def build_traffic_link(simulator:Simulator, arrivals, p, R_T, D_p, divisor, packet_size=96, arq='stop_wait',
+                       N_window=1, timeout=None, limit=None, policy='drop_tail', noise=None):
+    """`sweep.build_stop_wait` network with `Traffic_source` (`arrivals`, `packet_size`, `limit`, `policy`) and
+        `Traffic_sink`. Timeout does not depend on packet size. Return `(node_tx, node_rx)`."""
+    source = Traffic_source(arrivals, packet_size, limit, policy)
+    sink = Traffic_sink()
+    return build_stop_wait(simulator, p, R_T, D_p, divisor, None, arq, N_window, timeout, noise, source, sink)
+
+
+if __name__ == '__main__':
+    import time
+    R_T, D_p, divisor, packet_size = 1e6, 1e-4, 0xB, 1000
+    r = divisor.bit_length()-1
+    L_d, L_a = packet_size+1+r, 8+1+r  # data and ACK frames of Stop and Wait
+    service = (L_d+L_a)/R_T+2*D_p  # Stop and Wait over error free channel: deterministic service time
+    print("Stop and Wait, Poisson arrivals, p=0: latency against M/D/1 (wait + L_d/R_T + D_p)")
+    for load in (0.3, 0.6, 0.9):
+        simulator = Simulator(seed=1)
+        node_tx, node_rx = build_traffic_link(simulator, Poisson_arrivals(load/service), 0, R_T, D_p, divisor,
+                                              packet_size, timeout=2*service)
+        t0 = time.time()
+        simulator.run(50.)
+        latency = node_rx.L3.summary(50.)['latency']
+        md1 = load*service/(2*(1-load))+L_d/R_T+D_p
+        print(f"  load {load}: mean {latency['mean']*1e3:.3f} ms (M/D/1 {md1*1e3:.3f} ms), "
+              f"p50 {latency['p50']*1e3:.3f} ms, p99 {latency['p99']*1e3:.3f} ms, {latency['n']} packets "
+              f"({time.time()-t0:.2f} s)")
+    print("Overload (load 1.5), backlog limit 20")
+    for policy in POLICIES:
+        simulator = Simulator(seed=1)
+        node_tx, node_rx = build_traffic_link(simulator, Poisson_arrivals(1.5/service), 0, R_T, D_p, divisor,
+                                              packet_size, timeout=2*service, limit=20, policy=policy)
+        simulator.run(10.)
+        source, latency = node_tx.L3.summary(), node_rx.L3.summary(10.)
+        print(f"  {policy:12}: throughput {latency['throughput']/1e3:.1f} kbit/s, dropped {source['dropped']}"
+              f"/{source['generated']}, mean latency {latency['latency']['mean']*1e3:.2f} ms")
+    print("On/off arrivals and random packet sizes (Go Back N, N=8, p=1e-5)")
+    arrivals = On_off_arrivals(500, mean_on=0.05, mean_off=0.1)
+    simulator = Simulator(seed=1)
+    sizes = ([500, 1000, 12000], [0.5, 0.3, 0.2])
+    node_tx, node_rx = build_traffic_link(simulator, arrivals, 1e-5, R_T, D_p, divisor, sizes, arq='go_back_n',
+                                          N_window=8, limit=100)
+    simulator.run(20.)
+    source, sink = node_tx.L3.summary(), node_rx.L3.summary(20.)
+    print(f"  offered {arrivals.mean_rate:.0f} packets/s: throughput {sink['throughput']/1e3:.1f} kbit/s, "
+          f"dropped {source['dropped']}/{source['generated']}, latency mean {sink['latency']['mean']*1e3:.1f} ms, "
+          f"p99 {sink['latency']['p99']*1e3:.1f} ms")
+    print("Arrival cost at 1e5 arrivals/s (backlog limit 1, most arrivals are dropped)")
+    for block in (1, ARRIVAL_BLOCK):
+        simulator = Simulator(seed=1)
+        source = Traffic_source(Poisson_arrivals(1e5), packet_size, limit=1, block=block)
+        build_stop_wait(simulator, 0, R_T, D_p, divisor, None, timeout=2*service, source=source, sink=Traffic_sink())
+        t0 = time.time()
+        simulator.run(2.)
+        generated = source.generated
+        print(f"  block {block:5}: {(time.time()-t0)/generated*1e6:.2f} us per arrival ({generated} arrivals)")